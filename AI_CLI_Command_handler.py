@@ -1,14 +1,70 @@
 import platform
 import os
 import init_ai_config
-import json
-from AI_client_service import AIClientService
+import re
+import sys
+import threading
+import time
+from config_registry import registry as config_registry
+from sessions import DEFAULT_SESSION, Session
+from stream_renderer import StreamRenderer
+# AI_client_service 会导入 openai/httpx/pydantic,耗时远大于其余模块,
+# 推迟到 load_ai_client 时再导入,启动后可在后台线程预热
+
+# 设置为1时不在后台预热导入
+NO_WARMUP_ENV = "DEEPMINI_NO_WARMUP"
+
+def warm_up_imports():
+    """在后台线程预先导入AI客户端模块,用户输入命令时同步完成"""
+    def _import():
+        try:
+            import AI_client_service  # noqa: F401
+        except Exception:
+            # 预热失败不影响使用,load_ai_client 时会再次导入并报告错误
+            pass
+    thread = threading.Thread(target=_import, name="import-warmup", daemon=True)
+    thread.start()
+    return thread
 
 class Command_handler :
+    # 可在命令行调用的命令,启动时构建为 命令名 -> 绑定方法 的注册表
+    COMMANDS = (
+        "help", "exit", "system_cmd", "get_system_info",
+        "create_config", "show_config", "list_configs",
+        "load_ai_client", "unload_ai_client", "reload_ai_config",
+        "chat", "batch_chat",
+        "cache_stats", "cache_clear", "retry_stats", "show_endpoints", "stats",
+        "load_conversation", "save_conversation", "compact_conversation", "save_status",
+        "clear_conversation", "show_conversation", "search_conversation",
+        "session",
+    )
+
     def __init__ (self):
         self.IsLoop = True
-        self.ai_client = None
-        self.current_config = None
+        # 命名会话,各自持有客户端服务; ai_client/current_config 指向前台会话
+        self.sessions = {DEFAULT_SESSION: Session(DEFAULT_SESSION)}
+        self.current_session = DEFAULT_SESSION
+        self.commands = {name: getattr(self, name) for name in self.COMMANDS}
+
+    @property
+    def session_obj(self) -> Session:
+        return self.sessions[self.current_session]
+
+    @property
+    def ai_client(self):
+        return self.session_obj.client
+
+    @ai_client.setter
+    def ai_client(self, client):
+        self.session_obj.client = client
+
+    @property
+    def current_config(self):
+        return self.session_obj.config_path
+
+    @current_config.setter
+    def current_config(self, config_path):
+        self.session_obj.config_path = config_path
 
     def help(self):
         help_info =  """
@@ -50,24 +106,73 @@ class Command_handler :
              说明: 修改配置文件后刷新，无需重启客户端
         AI对话功能:
           11. chat            与AI进行对话
-             用法: chat <消息内容> [--stream/--no-stream]
+             用法: chat <消息内容> [--stream/--no-stream] [--bg]
              示例: chat 你好
                    chat 写一个Python函数 --no-stream
              参数: --stream    流式输出(实时显示)
                    --no-stream 非流式输出(一次性显示)
+                   --bg        在后台发送
+             说明: 流式输出时按 Ctrl+C 取消请求,已收到的部分标记为截断后保存;
+                   再按一次 Ctrl+C 转入后台
+          12. batch_chat      批量并发对话
+             用法: batch_chat <input.jsonl> <output.jsonl> [--concurrency N]
+             说明: 输入每行 {"id": ..., "prompt": ...},结果完成即写入输出文件
+                   重新运行时跳过输出中已成功的id,支持断点续跑
+        响应缓存:
+          13. cache_stats     显示响应缓存命中统计
+             用法: cache_stats
+             说明: 需要在配置中开启 response_cache,仅缓存 temperature 为 0 的请求
+          14. cache_clear     清空响应缓存
+             用法: cache_clear
+        限流与重试:
+          15. retry_stats     显示限流排队和自动重试统计
+             用法: retry_stats
+          16. show_endpoints  显示各端点的实时延迟和健康状态
+             用法: show_endpoints
+             说明: 在配置中用 endpoints 列表配置多个端点
+        请求指标:
+          17. stats           显示每个模型/端点的延迟与吞吐分位数(p50/p95/p99)
+             用法: stats [--export <path>]
+             说明: --export 导出到文件,.prom 结尾为Prometheus文本格式,否则为JSON
         对话历史管理:
-          12. load_conversation  加载对话历史
+          18. load_conversation  加载对话历史
              用法: load_conversation [filename]
              说明: 默认使用配置文件中的log_file
-          13. save_conversation  保存对话历史
+          19. save_conversation  保存对话历史
              用法: save_conversation [filename]
              说明: 默认使用配置文件中的log_file
-          14. clear_conversation 清空当前对话历史
+          20. clear_conversation 清空当前对话历史
              用法: clear_conversation
              说明: 需要确认操作
-          15. show_conversation  显示对话摘要
+          21. show_conversation  显示对话摘要
              用法: show_conversation
              显示: 对话轮数、消息数、字符数等
+          22. compact_conversation 压缩JSONL对话日志
+             用法: compact_conversation [filename]
+             说明: 修复残缺尾部并将日志重写为单个快照; 对 .archive 归档则立即压缩封存当前段
+          23. search_conversation 全文搜索所有对话历史
+             用法: search_conversation <关键词...> [--limit N]
+             说明: 多个关键词须同时出现,结果显示文件、轮次和片段
+          24. save_status     显示后台自动保存的状态
+             用法: save_status
+             说明: 自动保存在后台合并写入,这里显示待写入数、合并次数和写入失败的错误
+        多会话:
+          25. session         管理同时进行的多个命名会话
+             用法: session new <name> [config_name]  新建会话并切换到该会话
+                   session use <name>                切换会话并显示其缓存的输出
+                   session list                      列出所有会话
+                   session close <name>              关闭会话
+             说明: 每个会话有独立的配置和对话历史,连接参数相同的会话共用连接池
+                   流式对话中连按两次 Ctrl+C 或查看后台会话时按 Ctrl+C 转入后台,输出缓存到切换回来时显示
+                   chat ... --bg 直接在后台发送
+        ========================================
+        命令行参数:
+          python AI_CLI_Command_handler.py --daemon [--config config.json]
+             说明: 启动常驻的守护进程,保留连接池、配置和对话历史
+          python AI_CLI_Command_handler.py --oneshot <消息> [--config 配置文件名] [--no-stream] [--no-history]
+             说明: 通过守护进程发送一条消息,回复写到标准输出; '-' 表示从标准输入读取
+          python AI_CLI_Command_handler.py --daemon-status / --daemon-stop
+             说明: 显示守护进程状态 / 停止守护进程
         ========================================
         使用流程:
           1. 首次使用: create_config <你的API密钥>
@@ -127,8 +232,9 @@ class Command_handler :
             return
         
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = json.load(f)
+            # 注册表返回的配置是共享的,复制后再隐藏密钥
+            config, _ = config_registry.load(config_path)
+            config = dict(config)
             
             print(f"\n配置文件: {config_name}")
             print("=" * 40)
@@ -155,7 +261,8 @@ class Command_handler :
             print(f"配置目录不存在: {config_dir}")
             return
         
-        config_files = [f for f in os.listdir(config_dir) if f.endswith('.json')]
+        # 元数据来自目录索引,只有新增或修改过的文件才会重新解析
+        config_files = config_registry.list_directory(config_dir)
         
         if not config_files:
             print("暂无配置文件")
@@ -164,17 +271,12 @@ class Command_handler :
         print(f"\nAI配置目录: {config_dir}")
         print("=" * 40)
         
-        for i, file in enumerate(config_files, 1):
-            config_path = os.path.join(config_dir, file)
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                model = config.get('model', '未知')
-                has_api_key = "True" if config.get('api_key') else "False"
-                print(f"  {i}. {file}")
-                print(f"     模型: {model}, API密钥: {has_api_key}")
-            except:
-                print(f"  {i}. {file} (读取失败)")
+        for i, meta in enumerate(config_files, 1):
+            if meta["error"]:
+                print(f"  {i}. {meta['file']} (读取失败)")
+                continue
+            print(f"  {i}. {meta['file']}")
+            print(f"     模型: {meta['model']}, API密钥: {meta['has_api_key']}")
         print("=" * 40)
         print(f"共 {len(config_files)} 个配置文件")
 
@@ -191,7 +293,17 @@ class Command_handler :
             print(f"正在加载AI客户端...")
             print(f"配置文件: {config_path}")
             
-            self.ai_client = AIClientService(config_path)
+            # 首次加载时才导入openai等依赖(后台预热完成时直接复用)
+            from AI_client_service import AIClientService
+            
+            if self.session_obj.busy:
+                print(f"会话 {self.current_session} 正在进行对话,请等待完成后再加载")
+                return False
+            if self.ai_client:
+                self.ai_client.close()
+            # 命名会话的对话历史保存到独立的文件
+            session_name = None if self.current_session == DEFAULT_SESSION else self.current_session
+            self.ai_client = AIClientService(config_path, session_name=session_name)
             self.current_config = config_path
             
             # 测试配置文件读取
@@ -203,6 +315,8 @@ class Command_handler :
             print("AI客户端加载成功!")
             print(f"模型: {config.get('model')}")
             print(f"API端点: {config.get('base_url')}")
+            if len(config.get('endpoints', [])) > 1:
+                print(f"端点池: 共{len(config['endpoints'])}个端点,按延迟和健康状态自动路由")
             print(f"流式模式: {'启用' if config.get('stream') else '禁用'}")
             
             return True
@@ -216,23 +330,32 @@ class Command_handler :
     def unload_ai_client(self):
         """unload当前AI客户端服务"""
         if self.ai_client:
-            print("正在卸载AI客户端...")
-            
-            # 保存对话历史
-            try:
-                config = self.ai_client.read_config()
-                if config.get("auto_save", False):
-                    print("自动保存对话历史...")
-                    self.ai_client.save_conversation_to_file()
-            except:
-                pass
-            
-            self.ai_client = None
-            self.current_config = None
-            print("AI客户端已卸载")
+            if self.session_obj.busy:
+                print(f"会话 {self.current_session} 正在进行对话,请等待完成后再卸载")
+                return
+            self._unload_session_client(self.session_obj)
         else:
             print("当前没有加载的AI客户端")
     
+    def _unload_session_client(self, session: Session):
+        print("正在卸载AI客户端...")
+        
+        # 保存对话历史
+        try:
+            config = session.client.read_config()
+            if config.get("auto_save", False):
+                print("自动保存对话历史...")
+                # JSONL日志和归档只追加尚未写入的消息; save_conversation 才重写整个文件
+                session.client.save_on_unload()
+        except:
+            pass
+        
+        # 释放复用的连接池
+        session.client.close()
+        session.client = None
+        session.config_path = None
+        print("AI客户端已卸载")
+    
     def chat(self, *args):
         """与AI进行对话"""
         if not self.ai_client:
@@ -241,18 +364,21 @@ class Command_handler :
         
         if not args:
             print("请提供要发送的消息")
-            print("用法: chat <message> [--stream/--no-stream]")
+            print("用法: chat <message> [--stream/--no-stream] [--bg]")
             return
         
         # 解析参数
         message = ""
         use_stream = None  # None 表示使用配置文件中的设置
+        background = False
         
         for arg in args:
             if arg == "--stream":
                 use_stream = True
             elif arg == "--no-stream":
                 use_stream = False
+            elif arg == "--bg":
+                background = True
             else:
                 if message:
                     message += " " + arg
@@ -263,19 +389,73 @@ class Command_handler :
             print("请提供要发送的消息")
             return
         
+        # 后台自动保存失败时在下一次对话前提示
+        save_error = self.ai_client.pop_save_error()
+        if save_error:
+            print(f"警告: 后台自动保存对话历史失败: {save_error} (使用 save_status 查看详情)")
+        
+        session = self.session_obj
+        if session.busy:
+            print(f"会话 {session.name} 正在进行对话,请等待完成或使用 session use 切换到其他会话")
+            return
+        # 对话在会话的工作线程中进行,输出经缓冲区显示,转入后台时继续运行
+        session.submit(self._run_chat, self.ai_client, message, use_stream)
+        if background:
+            print(f"已在后台发送,使用 session use {session.name} 查看输出")
+        else:
+            self._attach_session(session, cancel_on_interrupt=True)
+    
+    def _attach_session(self, session: Session, cancel_on_interrupt: bool = False):
+        """实时显示会话的输出直到对话结束
+
+        cancel_on_interrupt 为 True 时第一次 Ctrl+C 取消流式请求(保留已收到的部分),
+        否则或再次按 Ctrl+C 时转入后台,对话继续运行。
+        """
+        renderer = self._stream_renderer(session)
+        try:
+            while True:
+                try:
+                    # 有待刷新的内容时最多等到刷新时间
+                    due = renderer.time_until_flush()
+                    text, running = session.read(timeout=0.1 if due is None else min(due, 0.1))
+                    renderer.write(text)
+                    if not running:
+                        break
+                except KeyboardInterrupt:
+                    renderer.flush()
+                    if cancel_on_interrupt and session.client is not None and session.client.cancel_streams():
+                        cancel_on_interrupt = False
+                        print("\n\n正在取消请求... (再按 Ctrl+C 转入后台)")
+                        continue
+                    print(f"\n\n会话 {session.name} 已转入后台继续运行,输出将被缓存,使用 session use {session.name} 查看")
+                    break
+        finally:
+            renderer.flush()
+    
+    @staticmethod
+    def _stream_renderer(session: Session) -> StreamRenderer:
+        """按会话的配置创建终端渲染器,未加载客户端时使用默认设置"""
+        if session.client is None:
+            return StreamRenderer()
+        config = session.client.read_config()
+        return StreamRenderer(interval=config["stream_render_interval_ms"] / 1000,
+                              enabled=config["stream_render_buffer"])
+    
+    def _run_chat(self, ai_client, message: str, use_stream):
+        """发送一条消息并输出结果,在会话的工作线程中执行"""
         print(f"发送消息: {message}")
         print("-" * 40)
         
         try:
             # 获取配置以确定是否使用流式
-            config = self.ai_client.read_config()
+            config = ai_client.read_config()
             stream_mode = use_stream if use_stream is not None else config.get("stream", False)
             
             if stream_mode:
                 print("流式输出模式:")
                 print("-" * 40)
                 
-                response_generator = self.ai_client.usr_request(message)
+                response_generator = ai_client.usr_request(message, stream=True)
                 
                 for chunk in response_generator:
                     if chunk["success"]:
@@ -285,6 +465,17 @@ class Command_handler :
                             print()  # 换行
                             print("-" * 40)
                             print(f"完整响应已接收,共{len(chunk['full_response'])}字符")
+                        elif chunk["type"] == "truncated":
+                            print()
+                            print("-" * 40)
+                            reasons = {
+                                "cancelled": "用户取消",
+                                "timeout": f"超过 max_request_seconds={config['max_request_seconds']:g}秒",
+                                "max_output_chars": f"超过 max_output_chars={config['max_output_chars']}"
+                            }
+                            saved = config["save_partial_reply"] and chunk["full_response"]
+                            print(f"响应已中断({reasons.get(chunk['reason'], chunk['reason'])}),"
+                                  f"已接收{len(chunk['full_response'])}字符" + (",部分回复已保存" if saved else ""))
                     else:
                         print(f"\n错误: {chunk.get('error', chunk.get('content', '未知错误'))}")
                         break
@@ -292,7 +483,7 @@ class Command_handler :
                 print("非流式模式...")
                 print("-" * 40)
                 
-                response = self.ai_client.usr_request(message)
+                response = ai_client.usr_request(message, stream=False)
                 
                 if isinstance(response, dict):
                     if response["success"]:
@@ -302,14 +493,275 @@ class Command_handler :
                     else:
                         print(f"错误: {response['error']}")
             # 显示对话摘要
-            summary = self.ai_client.get_conversation_summary()
+            summary = ai_client.get_conversation_summary()
             print(f"对话统计: {summary['total_turns']}轮对话, {summary['total_characters']}字符")
             
-        except KeyboardInterrupt:
-            print("\n\n用户中断操作")
         except Exception as e:
             print(f"对话过程中发生错误: {str(e)}")
     
+    def session(self, *args):
+        """管理多个命名会话"""
+        usage = "用法: session new <name> [config_name] | session use <name> | session list | session close <name>"
+        action = args[0] if args else "list"
+        if action == "new" and len(args) in (2, 3):
+            self._session_new(args[1], args[2] if len(args) == 3 else None)
+        elif action == "use" and len(args) == 2:
+            self._session_use(args[1])
+        elif action == "list" and len(args) <= 1:
+            self._session_list()
+        elif action == "close" and len(args) == 2:
+            self._session_close(args[1])
+        else:
+            print(usage)
+    
+    def _session_new(self, name: str, config_name: str = None):
+        if not re.fullmatch(r"[\w-]+", name):
+            print("会话名只能包含字母、数字、下划线和连字符")
+            return
+        if name in self.sessions:
+            print(f"会话已存在: {name},使用 session use {name} 切换")
+            return
+        if config_name is None:
+            # 默认沿用当前会话的配置文件
+            config_name = os.path.basename(self.current_config) if self.current_config else "config.json"
+        previous = self.current_session
+        self.sessions[name] = Session(name)
+        self.current_session = name
+        if not self.load_ai_client(config_name):
+            del self.sessions[name]
+            self.current_session = previous
+            print(f"会话 {name} 创建失败,仍在会话 {previous}")
+            return
+        print(f"已创建并切换到会话: {name}")
+    
+    def _session_use(self, name: str):
+        session = self.sessions.get(name)
+        if session is None:
+            print(f"会话不存在: {name},使用 session list 查看所有会话")
+            return
+        self.current_session = name
+        config = os.path.basename(session.config_path) if session.config_path else "未加载客户端"
+        print(f"已切换到会话: {name} ({config})")
+        if session.busy or session.pending_chars:
+            print(f"---- 会话 {name} 的输出 ----")
+            self._attach_session(session)
+    
+    def _session_list(self):
+        print("\n会话列表:")
+        print("=" * 40)
+        for name, session in self.sessions.items():
+            marker = "*" if name == self.current_session else " "
+            config = os.path.basename(session.config_path) if session.config_path else "未加载客户端"
+            state = "对话中" if session.busy else "空闲"
+            line = f" {marker} {name} ({config}) - {state}"
+            if session.client is not None:
+                line += f", {session.client.get_conversation_summary()['total_turns']}轮对话"
+            if session.pending_chars:
+                line += f", {session.pending_chars}字符未读"
+            print(line)
+        print("=" * 40)
+        print("* 为当前会话")
+    
+    def _session_close(self, name: str):
+        session = self.sessions.get(name)
+        if session is None:
+            print(f"会话不存在: {name}")
+            return
+        if name == DEFAULT_SESSION:
+            print("默认会话不能关闭,可使用 unload_ai_client 卸载其客户端")
+            return
+        if session.busy:
+            print(f"会话 {name} 正在进行对话,请等待完成后再关闭")
+            return
+        if session.client is not None:
+            self._unload_session_client(session)
+        del self.sessions[name]
+        if self.current_session == name:
+            self.current_session = DEFAULT_SESSION
+            print(f"已切换到会话: {DEFAULT_SESSION}")
+        print(f"会话已关闭: {name}")
+    
+    def batch_chat(self, *args):
+        """从JSONL文件批量并发执行对话"""
+        if not self.ai_client:
+            print("请先加载AI客户端: load_ai_client [config_name]")
+            return
+        
+        usage = "用法: batch_chat <input.jsonl> <output.jsonl> [--concurrency N]"
+        paths = []
+        concurrency = 4
+        arg_iter = iter(args)
+        for arg in arg_iter:
+            if arg == "--concurrency":
+                value = next(arg_iter, None)
+                if value is None or not value.isdigit() or int(value) < 1:
+                    print("--concurrency 需要一个正整数")
+                    print(usage)
+                    return
+                concurrency = int(value)
+            else:
+                paths.append(arg)
+        
+        if len(paths) != 2:
+            print(usage)
+            return
+        input_path, output_path = paths
+        if not os.path.exists(input_path):
+            print(f"输入文件不存在: {input_path}")
+            return
+        
+        config = self.ai_client.read_config()
+        if concurrency > config.get("max_connections", 10):
+            print(f"提示: 并发数 {concurrency} 大于连接池上限 max_connections={config.get('max_connections')},多余的请求会排队等待连接")
+        
+        print(f"开始批量对话: {input_path} -> {output_path} (并发数: {concurrency})")
+        print("-" * 40)
+        from batch_runner import run_batch_chat
+        try:
+            stats = run_batch_chat(self.ai_client, input_path, output_path, concurrency)
+        except KeyboardInterrupt:
+            print("\n\n用户中断操作,已完成和进行中的请求结果已写入输出文件,重新运行可继续")
+            return
+        except Exception as e:
+            print(f"批量对话过程中发生错误: {str(e)}")
+            return
+        
+        print("-" * 40)
+        print(f"批量对话完成: 共{stats['total']}条, 跳过{stats['skipped']}条, 成功{stats['succeeded']}条, 失败{stats['failed']}条")
+        print(f"耗时: {stats['elapsed']:.2f}秒, 吞吐量: {stats['throughput']:.2f}条/秒")
+    
+    def cache_stats(self):
+        """显示响应缓存命中统计"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        try:
+            stats = self.ai_client.get_response_cache_stats()
+            if stats is None:
+                print("响应缓存未启用,请在配置文件中设置 \"response_cache\": true")
+                return
+            
+            print("\n响应缓存统计:")
+            print("=" * 40)
+            print(f"命中: {stats['hits']} (内存 {stats['memory_hits']}, 磁盘 {stats['disk_hits']})")
+            print(f"未命中: {stats['misses']}")
+            print(f"命中率: {stats['hit_rate']:.1%}")
+            print(f"写入: {stats['stores']}, 淘汰: {stats['evictions']}")
+            print(f"内存条目: {stats['memory_entries']}, 磁盘条目: {stats['disk_entries']}")
+            print(f"磁盘占用: {stats['disk_bytes'] / 1024:.1f} KB ({stats['path']})")
+            print("=" * 40)
+        except Exception as e:
+            print(f"获取缓存统计时出错: {str(e)}")
+    
+    def cache_clear(self):
+        """清空响应缓存"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        try:
+            if self.ai_client.clear_response_cache():
+                print("响应缓存已清空")
+            else:
+                print("响应缓存未启用")
+        except Exception as e:
+            print(f"清空响应缓存时出错: {str(e)}")
+    
+    def retry_stats(self):
+        """显示限流与重试统计"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        stats = self.ai_client.get_retry_stats()
+        config = self.ai_client.read_config()
+        rpm = config.get("requests_per_minute", 0)
+        tpm = config.get("tokens_per_minute", 0)
+        
+        print("\n限流与重试统计:")
+        print("=" * 40)
+        print(f"限流配置: RPM {rpm or '不限'}, TPM {tpm or '不限'}")
+        print(f"请求数: {stats['requests']}, 重试次数: {stats['retries']}")
+        print(f"服务端限流(429): {stats['rate_limited']}次")
+        print(f"客户端排队: {stats['limiter_waits']}次, 共{stats['limiter_wait_seconds']:.2f}秒")
+        print(f"退避等待: 共{stats['backoff_seconds']:.2f}秒")
+        print(f"超过总时限: {stats['deadline_exceeded']}次")
+        print("=" * 40)
+    
+    def show_endpoints(self):
+        """显示各端点的实时延迟和健康状态"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        try:
+            endpoints = self.ai_client.get_endpoint_status()
+            states = {"closed": "正常", "open": "熔断", "half-open": "半开"}
+            
+            print("\n端点状态:")
+            print("=" * 40)
+            for i, ep in enumerate(endpoints, 1):
+                ttft = f"{ep['ewma_ttft'] * 1000:.0f}ms" if ep['ewma_ttft'] is not None else "暂无数据"
+                print(f"  {i}. {ep['base_url']} (权重 {ep['weight']:g})")
+                print(f"     状态: {states[ep['state']]}, 首token延迟(EWMA): {ttft}, 错误率(EWMA): {ep['error_rate']:.1%}")
+                print(f"     请求: {ep['requests']}, 失败: {ep['failures']}")
+                if ep['state'] == "open":
+                    print(f"     剩余冷却: {ep['cooldown_left']:.1f}秒")
+                if ep['last_error']:
+                    print(f"     最近错误: {ep['last_error'][:80]}")
+            print("=" * 40)
+        except Exception as e:
+            print(f"获取端点状态时出错: {str(e)}")
+    
+    def stats(self, *args):
+        """显示请求延迟与吞吐指标"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        if args:
+            if len(args) != 2 or args[0] != "--export":
+                print("用法: stats [--export <path>]")
+                return
+            try:
+                fmt = self.ai_client.export_metrics(args[1])
+                print(f"请求指标已导出到 {args[1]} ({fmt})")
+            except Exception as e:
+                print(f"导出请求指标时出错: {str(e)}")
+            return
+        
+        groups = self.ai_client.get_metrics_summary()
+        if not groups:
+            print("暂无请求指标,请先进行对话")
+            return
+        
+        # (指标名, 显示名, 单位换算, 单位)
+        rows = [
+            ("connect_time", "建连耗时", 1000, "ms"),
+            ("ttft", "首token时间", 1000, "ms"),
+            ("inter_chunk_gap", "chunk间隔", 1000, "ms"),
+            ("duration", "总耗时", 1000, "ms"),
+            ("prompt_tokens", "提示词token", 1, ""),
+            ("prompt_cache_hit_tokens", "缓存命中token", 1, ""),
+            ("completion_tokens", "回复token", 1, ""),
+            ("tokens_per_sec", "生成速度", 1, "token/s"),
+        ]
+        print("\n请求指标:")
+        print("=" * 60)
+        for group in groups:
+            requests = group["requests"]
+            print(f"模型: {group['model']}  端点: {group['endpoint']}")
+            print(f"  请求: 成功 {requests['success']}, 失败 {requests['error']}")
+            print(f"  {'指标':<12}{'p50':>10}{'p95':>10}{'p99':>10}  单位")
+            for name, label, scale, unit in rows:
+                series = group["metrics"][name]
+                if not series["count"]:
+                    continue
+                values = "".join(f"{series[q] * scale:>10.1f}" for q in ("p50", "p95", "p99"))
+                print(f"  {label:<12}{values}  {unit}")
+            print("-" * 60)
+    
     def load_conversation(self, filename: str = ""):
         """加载对话历史"""
         if not self.ai_client:
@@ -340,6 +792,91 @@ class Command_handler :
         except Exception as e:
             print(f"保存对话历史时出错: {str(e)}")
     
+    def compact_conversation(self, filename: str = ""):
+        """压缩JSONL对话日志"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        try:
+            success = self.ai_client.compact_conversation_file(filename)
+            if not success:
+                print("对话日志压缩失败")
+        except Exception as e:
+            print(f"压缩对话日志时出错: {str(e)}")
+    
+    def save_status(self):
+        """显示后台自动保存的状态"""
+        if not self.ai_client:
+            print("请先加载AI客户端")
+            return
+        
+        config = self.ai_client.read_config()
+        status = self.ai_client.get_save_status()
+        print("\n自动保存状态:")
+        print("=" * 40)
+        print(f"自动保存: {'开启' if config['auto_save'] else '关闭'}, "
+              f"{'后台合并写入' if config['async_save'] else '同步写入'}")
+        print(f"保存文件: Chat_history/{config['log_file']}")
+        if status is None:
+            print("尚未进行后台保存")
+        else:
+            print(f"保存请求: {status['submitted']}次, 实际写入: {status['writes']}次, "
+                  f"合并: {status['coalesced']}次, 待写入: {status['pending']}")
+            if status["last_write_time"]:
+                print(f"最近写入: {status['last_write_time']} (耗时 {status['last_write_seconds'] * 1000:.1f}ms)")
+            print(f"写入失败: {status['failures']}次")
+            if status["last_error"]:
+                print(f"最近错误: {status['last_error']} ({status['last_error_time']})")
+        print("=" * 40)
+    
+    def search_conversation(self, *args):
+        """全文搜索 Chat_history 下的所有对话历史"""
+        usage = "用法: search_conversation <关键词...> [--limit N]"
+        terms = []
+        limit = 10
+        arg_iter = iter(args)
+        for arg in arg_iter:
+            if arg == "--limit":
+                value = next(arg_iter, None)
+                if value is None or not value.isdigit() or int(value) < 1:
+                    print("--limit 需要一个正整数")
+                    print(usage)
+                    return
+                limit = int(value)
+            else:
+                terms.append(arg)
+        if not terms:
+            print(usage)
+            return
+        
+        # 不需要加载AI客户端; 与客户端服务共用同一个索引
+        from history_search import get_search_index
+        try:
+            index = get_search_index()
+            start = time.perf_counter()
+            rebuilt = index.refresh()
+            if rebuilt:
+                print(f"已更新 {rebuilt} 个文件的搜索索引")
+            if not index.uses_index(" ".join(terms)):
+                print("关键词都少于3个字符,无法使用全文索引,从最近的消息开始逐条扫描")
+            results = index.search(" ".join(terms), limit, refresh=False)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print(f"搜索对话历史时出错: {str(e)}")
+            return
+        
+        if not results:
+            print(f"未找到包含 \"{' '.join(terms)}\" 的对话 ({elapsed * 1000:.0f}ms)")
+            return
+        roles = {"user": "用户", "assistant": "AI"}
+        print(f"\n搜索结果 (共{len(results)}条, {elapsed * 1000:.0f}ms):")
+        print("=" * 40)
+        for i, item in enumerate(results, 1):
+            print(f"  {i}. {item['file']} 第{item['turn']}轮 [{roles.get(item['role'], item['role'])}]")
+            print(f"     {item['snippet']}")
+        print("=" * 40)
+    
     def clear_conversation(self):
         """清空当前对话历史"""
         if not self.ai_client:
@@ -369,6 +906,37 @@ class Command_handler :
             print(f"总对话轮数: {summary['total_turns']}")
             print(f"总消息数: {summary['total_messages']}")
             print(f"总字符数: {summary['total_characters']}")
+            on_disk = summary['total_messages'] - summary.get('messages_in_memory', summary['total_messages'])
+            if on_disk > 0:
+                print(f"内存中消息: {summary['messages_in_memory']}条 (较早的{on_disk}条留在磁盘上按需读取)")
+            roles = summary.get('roles', {})
+            if roles:
+                print("按角色: " + ", ".join(
+                    f"{role} {stats['messages']}条/{stats['characters']}字符" for role, stats in roles.items()
+                ))
+            if summary.get('requests'):
+                print(f"本次会话请求: {summary['requests']}次, "
+                      f"token用量: 提示词 {summary['prompt_tokens']}, 回复 {summary['completion_tokens']}, 合计 {summary['total_tokens']}")
+                speed = summary['avg_tokens_per_sec']
+                print(f"平均首token时间: {summary['avg_ttft'] * 1000:.0f}ms, 平均耗时: {summary['avg_duration'] * 1000:.0f}ms"
+                      + (f", 平均生成速度: {speed:.1f} token/s" if speed else ""))
+                if summary['prompt_cache_hit_ratio'] is not None:
+                    print(f"前缀缓存命中率: {summary['prompt_cache_hit_ratio']:.1%} "
+                          f"(命中 {summary['prompt_cache_hit_tokens']} / 未命中 {summary['prompt_cache_miss_tokens']} token"
+                          f", 最近一次 {summary['last_prompt_cache_hit_ratio'] or 0:.1%})")
+            
+            history_summary = self.ai_client.get_history_summary()
+            if history_summary is not None:
+                state = "更新中" if history_summary['updating'] else f"已更新{history_summary['updates']}次"
+                print(f"历史摘要: 覆盖前{history_summary['covered_messages']}条消息, "
+                      f"{history_summary['summary_characters']}字符, {state}")
+                if summary['summary_turns']:
+                    print(f"摘要节省提示词: 本轮约 {summary['last_summary_saved_tokens']} token, "
+                          f"累计约 {summary['summary_saved_tokens']} token "
+                          f"(平均每轮 {summary['summary_saved_tokens'] / summary['summary_turns']:.0f})")
+                if history_summary['last_error']:
+                    retry = history_summary['retry_in_seconds']
+                    print(f"摘要更新失败: {history_summary['last_error']}" + (f" ({retry:.0f}秒后重试)" if retry else ""))
             
             last_message = summary.get('last_user_message')
             if last_message:
@@ -387,9 +955,8 @@ class Command_handler :
             return
         
         try:
-            # 清除配置缓存
-            self.ai_client._config_cache = None
-            config = self.ai_client.read_config()
+            # 清除配置缓存,连接相关配置变化时下次请求自动重建客户端
+            config = self.ai_client.reload_config()
             print("配置文件重新加载成功")
             print(f"模型: {config.get('model')}")
             print(f"API端点: {config.get('base_url')}")
@@ -398,8 +965,16 @@ class Command_handler :
     
     def exit(self):
         """退出程序"""
-        if self.ai_client:
-            self.unload_ai_client()
+        for session in self.sessions.values():
+            if session.busy:
+                print(f"等待会话 {session.name} 的对话完成...")
+                session.join()
+            text, _ = session.read(timeout=0)
+            if text and session.name != self.current_session:
+                print(f"---- 会话 {session.name} 未读的输出 ----")
+            print(text, end="")
+            if session.client is not None:
+                self._unload_session_client(session)
         
         print("Exiting ...")
         self.IsLoop = False
@@ -427,12 +1002,15 @@ class Command_handler :
                 print(f"ERROR : {e}")
 
 def main (Script_name = 'DeepMiniClient' ):#命名脚本
+    Current_handler = Command_handler()
     try:
-        Current_handler = Command_handler()
+        if os.environ.get(NO_WARMUP_ENV) != "1":
+            warm_up_imports()
         print(f"Wellcome to {Script_name}!\nInput 'help' to check commands.")
 
         while Current_handler.IsLoop:
-            print("Please input your command \n> ",end = "")
+            prompt = "> " if Current_handler.current_session == DEFAULT_SESSION else f"[{Current_handler.current_session}]> "
+            print(f"Please input your command \n{prompt}",end = "")
             usr_Input = input().strip()
 
             if not usr_Input :
@@ -442,17 +1020,26 @@ def main (Script_name = 'DeepMiniClient' ):#命名脚本
             command = cmd_parts[0]
             args = cmd_parts[1:]
             
+            Target_handler = Current_handler.commands.get(command)
+            if Target_handler is None:
+                print(f"Unknown command : '{command}' !\n")
+                continue
             try:
-                Target_handler = getattr(Current_handler,command)
                 Target_handler(*args)
-            except AttributeError:
-                print(f"Unknown command : '{command}' !\n")
             except ValueError as e:
                 print(f"ValueError : '{e}'")
             except Exception as e:
                 print(f"Except : '{e}'")
     except KeyboardInterrupt:
         print("KeyboardInterrupted,exiting...")
+        # 写完各会话尚未保存的对话历史
+        for session in Current_handler.sessions.values():
+            if session.client is not None:
+                session.client.flush_history()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # --daemon / --oneshot 等参数: 守护进程或单次调用,不进入交互命令行
+        from client_daemon import main as daemon_main
+        sys.exit(daemon_main())
     main()
\ No newline at end of file
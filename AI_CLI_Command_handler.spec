@@ -5,7 +5,7 @@ a = Analysis(
     ['AI_CLI_Command_handler.py'],
     pathex=[],
     binaries=[],
-    datas=[('init_ai_config.py', '.'), ('AI_client_service.py', '.')],
+    datas=[('init_ai_config.py', '.'), ('AI_client_service.py', '.'), ('conversation_journal.py', '.'), ('stream_events.py', '.'), ('async_client_service.py', '.'), ('batch_runner.py', '.'), ('token_estimator.py', '.'), ('response_cache.py', '.'), ('rate_limiter.py', '.'), ('endpoint_pool.py', '.'), ('request_metrics.py', '.'), ('config_registry.py', '.'), ('conversation_stats.py', '.'), ('history_store.py', '.'), ('history_search.py', '.'), ('client_pool.py', '.'), ('sessions.py', '.'), ('history_writer.py', '.'), ('stream_renderer.py', '.'), ('history_summarizer.py', '.'), ('history_index.py', '.'), ('history_archive.py', '.'), ('client_daemon.py', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
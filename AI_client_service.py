@@ -1,49 +1,347 @@
+import email.utils
 import json
 import os
+import random
+import threading
+import time
+import httpx
 import openai
 from openai._exceptions import (
     AuthenticationError,
     APIConnectionError,
     RateLimitError,
+    InternalServerError,
     APIError
 )
-from typing import Any, Dict, List, Union, Generator
+from typing import Any, Dict, List, Optional, Tuple, Union, Generator
 from datetime import datetime
+from client_pool import shared_clients
+from config_registry import file_signature, registry as config_registry
+from conversation_journal import ConversationJournal, is_journal_file, mkstemp_beside
+from conversation_stats import ConversationStats
+from endpoint_pool import Endpoint, EndpointPool
+from history_archive import (CompressedWriter, HistoryArchive, compression_of, is_archive,
+                             read_compressed_history, split_extension, strip_compression)
+from history_index import open_history
+from history_search import get_search_index
+from history_store import HistoryStore
+from history_summarizer import RollingSummary, build_summary_request, summary_message
+from history_writer import HistoryWriter
+from rate_limiter import RateLimiter, RequestDeadlineExceeded
+from request_metrics import MetricsStore, RequestContext, ainstall_trace, current_request, install_trace
+from response_cache import ResponseCache
+from stream_events import StreamEvent, StreamHandle
+from token_estimator import estimate_message_tokens, estimate_tokens
 
 class AIClientService:
     """AI客户端服务类,用于处理与OpenAI兼容API的交互"""
+
+    # 这些配置项(以及端点的 base_url/api_key)变化时需要重建客户端
+    _TRANSPORT_KEYS = (
+        "timeout", "connect_timeout", "read_timeout",
+        "max_connections", "max_keepalive_connections", "keepalive_expiry", "http2"
+    )
+    # 可以安全重试的错误: 限流、连接失败/超时、服务端5xx
+    _RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
     
-    def __init__(self, config_name):
+    def __init__(self, config_name, session_name: str = None):
         self.config_name = config_name
-        self.conversation_history = []
+        # 命名会话使用独立的对话历史文件
+        self.session_name = session_name
+        # 列式存储的对话历史,同时维护token估算的前缀和
+        self.conversation_history = HistoryStore()
+        # 对话历史的累计统计,随历史增量更新
+        self._conversation_stats = ConversationStats()
         self._config_cache = None
+        # 缓存对应的配置文件签名 (mtime, size),文件变化后自动重新解析
+        self._config_signature = None
+        # 每个端点一个长期复用的客户端, 键为连接参数签名
+        self._clients = {}
+        self._client_lock = threading.Lock()
+        self._endpoint_pool = None
+        self._endpoint_pool_key = None
+        self._journal = None
+        # 日志文件中与内存一致的消息数, None 表示下次需要写入完整快照
+        self._journal_synced = None
+        # (文件路径, 已写入搜索索引的消息数), 同一文件再次保存时只索引新消息
+        self._search_synced = None
+        # 自动保存在后台线程中合并写入; 文件读写(日志、快照、索引)由该锁串行化
+        self._history_writer = None
+        self._history_io_lock = threading.RLock()
+        # 较早对话的滚动摘要,以及本轮请求用摘要节省的token数(保存本轮时计入统计)
+        self._summary = None
+        self._pending_summary_saving = None
+        # (对话历史, 窗口起点): 按token预算截取时窗口起点保持不变,超出预算才按步长前进
+        self._window_anchor = None
+        self._window_step_warned = False
+        self._response_cache = None
+        self._rate_limiter = None
+        self._metrics = None
+        self._stats_lock = threading.Lock()
+        # 进行中的流式响应 -> 超时计时器(未设置 max_request_seconds 时为 None)
+        self._active_streams = {}
+        self._retry_stats = {
+            "requests": 0,            # 发出的请求数
+            "retries": 0,             # 重试次数
+            "rate_limited": 0,        # 收到429的次数
+            "limiter_waits": 0,       # 客户端限流器排队次数
+            "limiter_wait_seconds": 0.0,
+            "backoff_seconds": 0.0,
+            "deadline_exceeded": 0
+        }
     def read_config(self) -> Dict[str, Any]:
         if self._config_cache is not None:
-            return self._config_cache
+            try:
+                if file_signature(self.config_name) == self._config_signature:
+                    return self._config_cache
+            except OSError:
+                # 配置文件被删除或暂时不可读时继续使用已加载的配置
+                return self._config_cache
         
-        with open(f'{self.config_name}', 'r', encoding="utf-8") as f:
-            AI_config_data = json.load(f)
+        AI_config_data, signature = config_registry.load(self.config_name)
+        endpoints = self._parse_endpoints(AI_config_data)
         AI_config_dict = {
-            "api_key": AI_config_data.get('api_key', ''),
-            "base_url": AI_config_data.get('base_url', 'https://api.openai.com/v1'),
+            "api_key": AI_config_data.get('api_key', endpoints[0]["api_key"]),
+            "base_url": AI_config_data.get('base_url', endpoints[0]["base_url"]),
+            "endpoints": endpoints,
+            "endpoint_failure_threshold": int(AI_config_data.get('endpoint_failure_threshold', 3)),
+            "endpoint_cooldown": float(AI_config_data.get('endpoint_cooldown', 30)),
+            "endpoint_ewma_alpha": float(AI_config_data.get('endpoint_ewma_alpha', 0.3)),
             "model": AI_config_data.get('model', 'gpt-3.5-turbo'),
             "temperature": float(AI_config_data.get('temperature', 0.7)),
             "max_tokens": int(AI_config_data.get('max_tokens', 2048)),
             "timeout": float(AI_config_data.get('timeout', 30)),
+            "connect_timeout": float(AI_config_data.get('connect_timeout', 10)),
+            "read_timeout": float(AI_config_data.get('read_timeout', AI_config_data.get('timeout', 30))),
+            "max_connections": int(AI_config_data.get('max_connections', 10)),
+            "max_keepalive_connections": int(AI_config_data.get('max_keepalive_connections', 5)),
+            "keepalive_expiry": float(AI_config_data.get('keepalive_expiry', 60)),
+            "http2": bool(AI_config_data.get('http2', False)),
             "stream": bool(AI_config_data.get('stream', False)),
+            "stream_render_buffer": bool(AI_config_data.get('stream_render_buffer', True)),
+            "stream_render_interval_ms": float(AI_config_data.get('stream_render_interval_ms', 16)),
             "top_p": float(AI_config_data.get('top_p', 1.0)),
             "frequency_penalty": float(AI_config_data.get('frequency_penalty', 0.0)),
             "presence_penalty": float(AI_config_data.get('presence_penalty', 0.0)),
             "history_size": int(AI_config_data.get('history_size', 0)),
+            "context_token_budget": int(AI_config_data.get('context_token_budget', 0)),
+            "history_memory_messages": int(AI_config_data.get('history_memory_messages', 2000)),
+            "history_window_step": int(AI_config_data.get('history_window_step', 0)),
+            "summarize_history": bool(AI_config_data.get('summarize_history', False)),
+            "summary_model": AI_config_data.get('summary_model') or AI_config_data.get('model', 'gpt-3.5-turbo'),
+            "summary_keep_messages": int(AI_config_data.get('summary_keep_messages', 6)),
+            "summary_trigger_tokens": int(AI_config_data.get('summary_trigger_tokens', 1000)),
+            "summary_max_tokens": int(AI_config_data.get('summary_max_tokens', 512)),
+            "summary_batch_tokens": int(AI_config_data.get('summary_batch_tokens', 8000)),
             "system_prompt": AI_config_data.get('system_prompt', 'You are a helpful assistant.'),
             "log_file": AI_config_data.get('log_file', 'conversation_history.json'),
-            "auto_save": bool(AI_config_data.get('auto_save', False))
+            "auto_save": bool(AI_config_data.get('auto_save', False)),
+            "async_save": bool(AI_config_data.get('async_save', True)),
+            "save_coalesce_delay": float(AI_config_data.get('save_coalesce_delay', 0.2)),
+            "save_max_delay": float(AI_config_data.get('save_max_delay', 2.0)),
+            "journal_fsync_turns": int(AI_config_data.get('journal_fsync_turns', 8)),
+            "journal_fsync_interval": float(AI_config_data.get('journal_fsync_interval', 5.0)),
+            "archive_compression": AI_config_data.get('archive_compression', 'zstd'),
+            "archive_segment_mb": float(AI_config_data.get('archive_segment_mb', 8)),
+            "archive_segment_days": float(AI_config_data.get('archive_segment_days', 7)),
+            "response_cache": bool(AI_config_data.get('response_cache', False)),
+            "response_cache_path": AI_config_data.get('response_cache_path', os.path.join("Chat_history", "response_cache.sqlite3")),
+            "response_cache_ttl": float(AI_config_data.get('response_cache_ttl', 7 * 86400)),
+            "response_cache_max_mb": float(AI_config_data.get('response_cache_max_mb', 64)),
+            "response_cache_memory_entries": int(AI_config_data.get('response_cache_memory_entries', 256)),
+            "requests_per_minute": float(AI_config_data.get('requests_per_minute', 0)),
+            "tokens_per_minute": float(AI_config_data.get('tokens_per_minute', 0)),
+            "max_retries": int(AI_config_data.get('max_retries', 2)),
+            "retry_base_delay": float(AI_config_data.get('retry_base_delay', 1.0)),
+            "retry_max_delay": float(AI_config_data.get('retry_max_delay', 30.0)),
+            "request_deadline": float(AI_config_data.get('request_deadline', 120.0)),
+            "metrics_max_samples": int(AI_config_data.get('metrics_max_samples', 1024)),
+            "stream_include_usage": bool(AI_config_data.get('stream_include_usage', True)),
+            "max_request_seconds": float(AI_config_data.get('max_request_seconds', 0)),
+            "max_output_chars": int(AI_config_data.get('max_output_chars', 0)),
+            "save_partial_reply": bool(AI_config_data.get('save_partial_reply', True)),
+            "search_index": bool(AI_config_data.get('search_index', True))
         }
+        if self.session_name:
+            # 会话名插在完整扩展名之前: chat.jsonl.gz -> chat.work.jsonl.gz
+            root, ext = split_extension(AI_config_dict["log_file"] or "conversation_history.json")
+            AI_config_dict["log_file"] = f"{root}.{self.session_name}{ext}"
         self._config_cache = AI_config_dict
+        self._config_signature = signature
         return self._config_cache
-    def usr_request(self, content: str) -> Union[Dict[str, Any], Generator[Dict[str, Any], None, None]]:
+
+    @staticmethod
+    def _parse_endpoints(AI_config_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """解析端点列表: endpoints 中每项为 {url, key, weight},未配置时使用 base_url/api_key"""
+        default_key = AI_config_data.get('api_key', '')
+        endpoints = []
+        for item in AI_config_data.get('endpoints') or []:
+            endpoints.append({
+                "base_url": item.get('url', item.get('base_url', '')),
+                "api_key": item.get('key', item.get('api_key', default_key)),
+                "weight": float(item.get('weight', 1.0))
+            })
+        if not endpoints:
+            endpoints.append({
+                "base_url": AI_config_data.get('base_url', 'https://api.openai.com/v1'),
+                "api_key": default_key,
+                "weight": 1.0
+            })
+        return endpoints
+
+    def reload_config(self) -> Dict[str, Any]:
+        """清除配置缓存并重新读取,连接相关配置变化时下次请求会重建客户端"""
+        self._config_cache = None
+        config_registry.invalidate(self.config_name)
+        return self.read_config()
+
+    def _get_client(self, config_dict: Dict, endpoint: Endpoint) -> openai.OpenAI:
+        """返回端点对应的长期复用客户端,仅在端点或连接相关配置变化时重建
+
+        客户端从进程内的共享池取得,连接参数相同的其他服务(会话)共用同一个连接池。
+        """
+        signature = self._transport_signature(config_dict, endpoint.base_url, endpoint.api_key)
+        with self._client_lock:
+            client = self._clients.get(signature)
+            if client is None:
+                self._prune_clients(config_dict)
+
+                def create_client():
+                    timeout = self._build_timeout(config_dict)
+                    return openai.OpenAI(
+                        api_key=endpoint.api_key,
+                        base_url=endpoint.base_url,
+                        timeout=timeout,
+                        # 重试由 _create_completion 统一处理
+                        max_retries=0,
+                        http_client=self._build_http_client(config_dict, timeout)
+                    )
+                client = shared_clients.acquire(signature, create_client)
+                self._clients[signature] = client
+            return client
+
+    def _transport_signature(self, config_dict: Dict, base_url: str, api_key: str) -> tuple:
+        return (base_url, api_key) + tuple(config_dict.get(key) for key in self._TRANSPORT_KEYS)
+
+    def _prune_clients(self, config_dict: Dict):
+        """释放已不在当前配置中的端点/连接参数对应的客户端"""
+        valid = set(
+            self._transport_signature(config_dict, ep["base_url"], ep["api_key"])
+            for ep in config_dict["endpoints"]
+        )
+        for signature in [sig for sig in self._clients if sig not in valid]:
+            del self._clients[signature]
+            shared_clients.release(signature)
+
+    def _get_endpoint_pool(self, config_dict: Dict) -> EndpointPool:
+        """返回端点池,端点列表或熔断参数变化时重建"""
+        key = (
+            tuple((ep["base_url"], ep["api_key"], ep["weight"]) for ep in config_dict["endpoints"]),
+            config_dict["endpoint_failure_threshold"],
+            config_dict["endpoint_cooldown"],
+            config_dict["endpoint_ewma_alpha"]
+        )
+        if self._endpoint_pool is None or key != self._endpoint_pool_key:
+            self._endpoint_pool = EndpointPool(
+                config_dict["endpoints"],
+                alpha=config_dict["endpoint_ewma_alpha"],
+                failure_threshold=config_dict["endpoint_failure_threshold"],
+                cooldown=config_dict["endpoint_cooldown"]
+            )
+            self._endpoint_pool_key = key
+        return self._endpoint_pool
+
+    def get_endpoint_status(self) -> List[Dict[str, Any]]:
+        """返回各端点的实时延迟与健康状态"""
+        return self._get_endpoint_pool(self.read_config()).snapshot()
+
+    def _build_timeout(self, config_dict: Dict) -> httpx.Timeout:
+        return httpx.Timeout(
+            config_dict.get("timeout", 30),
+            connect=config_dict.get("connect_timeout", 10),
+            read=config_dict.get("read_timeout", 30)
+        )
+
+    def _build_http_client(self, config_dict: Dict, timeout: httpx.Timeout, client_class=httpx.Client):
+        """按配置构建带连接池和keep-alive的HTTP客户端(同步或异步)"""
+        limits = httpx.Limits(
+            max_connections=config_dict.get("max_connections", 10),
+            max_keepalive_connections=config_dict.get("max_keepalive_connections", 5),
+            keepalive_expiry=config_dict.get("keepalive_expiry", 60)
+        )
+        # 请求钩子在每个请求上挂载trace回调,用于记录建连耗时
+        hook = ainstall_trace if issubclass(client_class, httpx.AsyncClient) else install_trace
+        event_hooks = {"request": [hook]}
+        if config_dict.get("http2", False):
+            try:
+                return client_class(limits=limits, timeout=timeout, http2=True, event_hooks=event_hooks)
+            except ImportError:
+                print("警告: 未安装h2包,HTTP/2不可用,已回退到HTTP/1.1 (pip install httpx[http2])")
+        return client_class(limits=limits, timeout=timeout, event_hooks=event_hooks)
+
+    def close(self):
+        """写完待保存的对话历史,释放复用的客户端(没有其他会话使用时关闭连接池),并刷新对话日志"""
+        if self._history_writer is not None:
+            self._history_writer.close()
+            self._history_writer = None
+        self._close_journal()
+        if self._response_cache is not None:
+            self._response_cache.close()
+            self._response_cache = None
+        self._close_clients()
+
+    def _close_clients(self):
+        with self._client_lock:
+            for signature in self._clients:
+                shared_clients.release(signature)
+            self._clients = {}
+
+    def _completion_params(self, config_dict: Dict, messages: List[Dict], stream: bool) -> Dict[str, Any]:
+        """构造 chat.completions.create 的参数,同步与异步客户端共用"""
+        params = {
+            "model": config_dict["model"],
+            "messages": messages,
+            "temperature": config_dict["temperature"],
+            "max_tokens": config_dict["max_tokens"],
+            "stream": stream,
+            "top_p": config_dict["top_p"],
+            "frequency_penalty": config_dict["frequency_penalty"],
+            "presence_penalty": config_dict["presence_penalty"]
+        }
+        if stream and config_dict.get("stream_include_usage", True):
+            # 让服务端在流末尾返回token用量,供请求指标使用
+            params["stream_options"] = {"include_usage": True}
+        return params
+
+    def _describe_error(self, e: Exception) -> str:
+        """将API异常转换为用户可读的错误信息"""
+        if isinstance(e, RequestDeadlineExceeded):
+            return f"请求超时：{str(e)}"
+        if isinstance(e, AuthenticationError):
+            return f"认证失败：{e.message},请检查API Key"
+        if isinstance(e, APIConnectionError):
+            return f"连接服务失败：{e.message}，请检查接口地址和网络"
+        if isinstance(e, RateLimitError):
+            return f"限流触发：{e.message}，请降低请求频率或提升配额"
+        if isinstance(e, APIError):
+            return f"服务接口异常：{e.message}，请检查参数或联系服务提供商"
+        return f"未知错误：{str(e)}"
+
+    def _error_response(self, error_msg: str, stream: bool) -> Union[Dict[str, Any], Generator[StreamEvent, None, None]]:
+        if stream:
+            return self._stream_error(error_msg)
+        return {
+            "success": False,
+            "data": "",
+            "error": error_msg,
+            "type": "error"
+        }
+
+    def usr_request(self, content: str, stream: bool = None, use_history: bool = True) -> Union[Dict[str, Any], Generator[StreamEvent, None, None]]:
         """处理用户请求
-        非流式模式返回字典，流式模式返回生成器
+        非流式模式返回字典，流式模式返回 StreamEvent 生成器(可按字典访问)
+        stream 为 None 时使用配置文件中的设置
+        use_history 为 False 时不携带也不记录对话历史(用于批量等独立请求)
         字典结构: {
             "success": bool,           # 是否成功
             "data": str,               # 成功时的响应内容
@@ -52,203 +350,810 @@ class AIClientService:
         }
         """
         config_dict = self.read_config()
-        messages = self._prepare_messages(content, config_dict)
+        if stream is None:
+            stream = config_dict["stream"]
+        messages = self._prepare_messages(content, config_dict, use_history)
+        params = self._completion_params(config_dict, messages, stream)
         try:
-            client = openai.OpenAI(
-                api_key=config_dict["api_key"],
-                base_url=config_dict["base_url"],
-                timeout=config_dict.get("timeout", 30)
-            )
-            response = client.chat.completions.create(
-                model=config_dict["model"],
-                messages=messages,
-                temperature=config_dict["temperature"],
-                max_tokens=config_dict["max_tokens"],
-                stream=config_dict["stream"],
-                top_p=config_dict["top_p"],
-                frequency_penalty=config_dict["frequency_penalty"],
-                presence_penalty=config_dict["presence_penalty"]
-            )
-            if config_dict["stream"]:
-                return self._handle_stream_response(response, content, config_dict)
-            else:
-                return self._handle_normal_response(response, content, config_dict)
+            # 只缓存确定性(temperature 为 0)的请求
+            cache = self._get_response_cache(config_dict) if config_dict["temperature"] == 0 else None
+            cache_key = None
+            if cache is not None:
+                cache_key = self._response_cache_key(params)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    return self._replay_cached_response(cached, content, config_dict, stream, use_history)
 
-        except AuthenticationError as e:
-            error_msg = f"认证失败：{e.message},请检查API Key"
-            print(error_msg)
-            if config_dict["stream"]:
-                return self._stream_error(error_msg)
+            response, ctx = self._create_completion(params, config_dict)
+            if stream:
+                events = self._handle_stream_response(response, content, config_dict, use_history, ctx)
+                if cache is not None:
+                    return self._cache_stream(events, cache, cache_key, params["model"])
+                return events
             else:
-                return {
-                    "success": False,
-                    "data": "",
-                    "error": error_msg,
-                    "type": "error"
-                }
-        except APIConnectionError as e:
-            error_msg = f"连接服务失败：{e.message}，请检查接口地址和网络"
-            print(error_msg)
-            if config_dict["stream"]:
-                return self._stream_error(error_msg)
-            else:
-                return {
-                    "success": False,
-                    "data": "",
-                    "error": error_msg,
-                    "type": "error"
-                }
-        except RateLimitError as e:
-            error_msg = f"限流触发：{e.message}，请降低请求频率或提升配额"
-            print(error_msg)
-            if config_dict["stream"]:
-                return self._stream_error(error_msg)
-            else:
-                return {
-                    "success": False,
-                    "data": "",
-                    "error": error_msg,
-                    "type": "error"
-                }
-        except APIError as e:
-            error_msg = f"服务接口异常：{e.message}，请检查参数或联系服务提供商"
-            print(error_msg)
-            if config_dict["stream"]:
-                return self._stream_error(error_msg)
-            else:
-                return {
-                    "success": False,
-                    "data": "",
-                    "error": error_msg,
-                    "type": "error"
-                }
+                result = self._handle_normal_response(response, content, config_dict, use_history, ctx)
+                if cache is not None and result["success"]:
+                    cache.put(cache_key, result["data"], params["model"])
+                return result
+
         except Exception as e:
-            error_msg = f"未知错误：{str(e)}"
+            error_msg = self._describe_error(e)
             print(error_msg)
-            if config_dict["stream"]:
-                return self._stream_error(error_msg)
-            else:
-                return {
-                    "success": False,
-                    "data": "",
-                    "error": error_msg,
-                    "type": "error"
-                }
-    def _handle_stream_response(self, response, user_content: str, config_dict: Dict) -> Generator[Dict[str, Any], None, None]:
-        """处理流式响应"""
+            return self._error_response(error_msg, stream)
+    def _handle_stream_response(self, response, user_content: str, config_dict: Dict, save_turn: bool = True,
+                                ctx: RequestContext = None) -> Generator[StreamEvent, None, None]:
+        """处理流式响应
+        增量先存入缓冲区,完成时只拼接一次; chunk事件只携带增量。
+        调用 cancel_streams()、关闭生成器或超出 max_request_seconds / max_output_chars 时
+        立即关闭响应流并释放连接,已收到的部分作为截断的回复保存"""
+        handle = self._register_stream(response, config_dict, ctx)
+        parts = []
+        handled = False  # 本轮已按完成或截断处理
         try:
-            full_response = ""
+            max_chars = config_dict["max_output_chars"]
+            received = 0
             for chunk in response:
                 if chunk.choices and chunk.choices[0].delta.content is not None:
                     content = chunk.choices[0].delta.content
-                    full_response += content
-                    yield {
-                        "success": True,
-                        "type": "chunk",
-                        "content": content,
-                        "full_response": full_response,
-                        "done": False
-                    }
+                    if ctx is not None:
+                        ctx.mark_chunk()
+                    parts.append(content)
+                    received += len(content)
+                    yield StreamEvent.chunk(content, parts)
+                    if max_chars and received >= max_chars:
+                        handle.cancel("max_output_chars")
+                elif ctx is not None and getattr(chunk, "usage", None) is not None:
+                    # include_usage 时最后一个chunk的choices为空,只携带用量
+                    ctx.set_usage(chunk.usage)
+                if handle.reason is not None:
+                    break
+            
+            if handle.reason is not None:
+                handled = True
+                partial = self._finish_truncated_stream(parts, handle.reason, user_content, config_dict, save_turn, ctx)
+                yield StreamEvent.truncated(partial, handle.reason)
+                return
             
             # 完成消息
-            yield {
-                "success": True,
-                "type": "complete",
-                "content": full_response,
-                "full_response": full_response,
-                "done": True
-            }
+            full_response = "".join(parts)
+            sample = ctx.finish(full_response) if ctx is not None else None
+            handled = True
+            yield StreamEvent.complete(full_response)
             # 保存对话
-            self._save_conversation_turn(user_content, full_response, config_dict)
+            if save_turn:
+                self._save_conversation_turn(user_content, full_response, config_dict, sample)
             
+        except GeneratorExit:
+            # 调用方提前关闭了生成器,视为取消
+            if not handled:
+                handle.cancel("cancelled")
+                self._finish_truncated_stream(parts, handle.reason, user_content, config_dict, save_turn, ctx)
+            raise
         except Exception as e:
-            yield {
-                "success": False,
-                "type": "error",
-                "content": f"流式处理错误: {str(e)}",
-                "full_response": "",
-                "done": True
-            }
-    def _handle_normal_response(self, response, user_content: str, config_dict: Dict) -> Dict[str, Any]:
+            if handle.reason is not None and not handled:
+                # 取消时关闭了连接,读取因此中断
+                partial = self._finish_truncated_stream(parts, handle.reason, user_content, config_dict, save_turn, ctx)
+                yield StreamEvent.truncated(partial, handle.reason)
+                return
+            if ctx is not None:
+                ctx.mark_failure(str(e))
+            yield StreamEvent.error(f"流式处理错误: {str(e)}")
+        finally:
+            self._unregister_stream(handle)
+            # 未读完的响应关闭后连接不会放回连接池,而是直接断开; HTTP/2 只关闭这一个流
+            response.close()
+
+    def _register_stream(self, response, config_dict: Dict, ctx: RequestContext = None) -> StreamHandle:
+        handle = StreamHandle(response)
+        timer = None
+        limit = config_dict["max_request_seconds"]
+        if limit > 0:
+            # 从发出请求开始计时
+            elapsed = time.perf_counter() - ctx.start if ctx is not None else 0.0
+            timer = threading.Timer(max(0.0, limit - elapsed), handle.cancel, args=("timeout",))
+            timer.daemon = True
+            timer.start()
+        with self._stats_lock:
+            self._active_streams[handle] = timer
+        return handle
+
+    def _unregister_stream(self, handle: StreamHandle):
+        with self._stats_lock:
+            timer = self._active_streams.pop(handle, None)
+        if timer is not None:
+            timer.cancel()
+
+    def cancel_streams(self, reason: str = "cancelled") -> int:
+        """取消所有进行中的流式响应(可从其他线程调用),返回取消的数量
+
+        读取线程会立即停止,收到 truncated 事件; 非流式请求无法中途取消。
+        """
+        with self._stats_lock:
+            handles = list(self._active_streams)
+        return sum(1 for handle in handles if handle.cancel(reason))
+
+    def _finish_truncated_stream(self, parts: List[str], reason: str, user_content: str, config_dict: Dict,
+                                 save_turn: bool, ctx: RequestContext = None) -> str:
+        """记录被截断的请求,按配置把已收到的部分回复(标记 truncated)存入历史"""
+        partial = "".join(parts)
+        sample = ctx.finish(partial) if ctx is not None else None
+        if save_turn and partial and config_dict["save_partial_reply"]:
+            self._save_conversation_turn(user_content, partial, config_dict, sample, truncated=reason)
+        return partial
+    def _handle_normal_response(self, response, user_content: str, config_dict: Dict, save_turn: bool = True,
+                                ctx: RequestContext = None) -> Dict[str, Any]:
         """处理非流式响应"""
         if response.choices and response.choices[0].message.content:
             ai_response = response.choices[0].message.content
-            self._save_conversation_turn(user_content, ai_response, config_dict)
+            sample = None
+            if ctx is not None:
+                ctx.set_usage(getattr(response, "usage", None))
+                sample = ctx.finish(ai_response)
+            if save_turn:
+                self._save_conversation_turn(user_content, ai_response, config_dict, sample)
             return {
                 "success": True,
                 "data": ai_response,
                 "error": "",
                 "type": "normal"
             }
+        if ctx is not None:
+            ctx.mark_failure("未收到有效响应", count_endpoint=False)
         return {
             "success": False,
             "data": "",
             "error": "未收到有效响应",
             "type": "error"
         }
-    def _stream_error(self, error_message: str) -> Generator[Dict[str, Any], None, None]:
-        """返回流式错误信息的生成器"""
-        yield {
-            "success": False,
-            "type": "error",
-            "content": error_message,
-            "full_response": "",
-            "done": True
+    def _create_completion(self, params: Dict[str, Any], config_dict: Dict):
+        """发送请求,返回 (response, RequestContext)
+
+        先经过客户端限流器,再由端点池选择最快最健康的端点;
+        端点失败时优先立即切换到其他端点,否则按指数退避加抖动重试。
+        流式请求在收到响应头后、交付第一个chunk之前就返回,
+        因此重试只会发生在任何内容输出之前; request_deadline 也只限制到这里为止,
+        之后读取响应流的时间由 max_request_seconds 限制。
+        """
+        deadline = self._request_deadline(config_dict)
+        pool = self._get_endpoint_pool(config_dict)
+        tried = []
+        attempt = 0
+        self._add_retry_stat("requests", 1)
+        while True:
+            wait = self._reserve_rate_limit(params, config_dict, deadline)
+            if wait > 0:
+                time.sleep(wait)
+            endpoint = pool.select(tried)
+            client = self._get_client(config_dict, endpoint)
+            ctx = RequestContext(pool, endpoint, params["model"], self._get_metrics(config_dict))
+            token = current_request.set(ctx)
+            try:
+                response = client.chat.completions.create(**params, **self._deadline_options(config_dict, deadline))
+            except Exception as e:
+                tried.append(endpoint)
+                delay, failover = self._handle_attempt_failure(e, ctx, tried, attempt, config_dict, deadline)
+                if delay is None:
+                    raise
+                if delay > 0:
+                    time.sleep(delay)
+                if not failover:
+                    # 切换端点不占用 max_retries,也不增加退避时间
+                    attempt += 1
+                continue
+            finally:
+                current_request.reset(token)
+            if not params["stream"]:
+                ctx.mark_first_token()
+            return response, ctx
+
+    def _handle_attempt_failure(self, error: Exception, ctx: RequestContext, tried: List[Endpoint],
+                                attempt: int, config_dict: Dict, deadline: Optional[float]) -> Tuple[Optional[float], bool]:
+        """记录端点失败并决定是否重试
+
+        返回 (等待秒数, 是否切换到其他端点); 不重试时等待秒数为 None。
+        """
+        # 只有可重试错误和认证失败才归咎于端点,参数错误等不影响端点健康度
+        ctx.mark_failure(self._describe_error(error),
+                         count_endpoint=isinstance(error, self._RETRYABLE_ERRORS + (AuthenticationError,)))
+        pool = ctx.pool
+        failover = len(pool.endpoints) > 1 and pool.has_alternative(tried)
+        delay = self._next_retry_delay(error, attempt, config_dict, deadline, failover)
+        return delay, failover and delay is not None
+
+    def _get_metrics(self, config_dict: Dict) -> MetricsStore:
+        if self._metrics is None:
+            with self._stats_lock:
+                if self._metrics is None:
+                    self._metrics = MetricsStore(config_dict.get("metrics_max_samples", 1024))
+        return self._metrics
+
+    def get_metrics_summary(self) -> List[Dict[str, Any]]:
+        """返回按 (模型, 端点) 分组的请求指标分位数"""
+        return self._metrics.summary() if self._metrics is not None else []
+
+    def export_metrics(self, path: str) -> str:
+        """导出请求指标到文件, .prom 为Prometheus文本格式,其他为JSON; 返回导出格式"""
+        return self._get_metrics(self.read_config()).export(path)
+
+    def _request_deadline(self, config_dict: Dict) -> Optional[float]:
+        seconds = config_dict.get("request_deadline", 0)
+        return time.monotonic() + seconds if seconds > 0 else None
+
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._add_retry_stat("deadline_exceeded", 1)
+            raise RequestDeadlineExceeded("已超过请求总时限 request_deadline")
+        return remaining
+
+    def _deadline_options(self, config_dict: Dict, deadline: Optional[float]) -> Dict[str, Any]:
+        """把单次调用的超时收紧到剩余时限以内"""
+        remaining = self._remaining(deadline)
+        if remaining is None:
+            return {}
+        return {"timeout": httpx.Timeout(
+            min(config_dict.get("timeout", 30), remaining),
+            connect=min(config_dict.get("connect_timeout", 10), remaining),
+            read=min(config_dict.get("read_timeout", 30), remaining)
+        )}
+
+    def _get_rate_limiter(self, config_dict: Dict) -> RateLimiter:
+        rpm = config_dict.get("requests_per_minute", 0)
+        tpm = config_dict.get("tokens_per_minute", 0)
+        limiter = self._rate_limiter
+        if limiter is None or (limiter.requests_per_minute, limiter.tokens_per_minute) != (rpm, tpm):
+            limiter = self._rate_limiter = RateLimiter(rpm, tpm)
+        return limiter
+
+    def _reserve_rate_limit(self, params: Dict[str, Any], config_dict: Dict, deadline: Optional[float]) -> float:
+        """在限流器中预占配额,返回需要等待的秒数; TPM按估算的提示词token加 max_tokens 计"""
+        limiter = self._get_rate_limiter(config_dict)
+        if not limiter.enabled:
+            return 0.0
+        tokens = sum(estimate_message_tokens(msg) for msg in params["messages"]) + params["max_tokens"]
+        try:
+            wait = limiter.reserve(tokens, self._remaining(deadline))
+        except RequestDeadlineExceeded:
+            self._add_retry_stat("deadline_exceeded", 1)
+            raise
+        if wait > 0:
+            self._add_retry_stat("limiter_waits", 1)
+            self._add_retry_stat("limiter_wait_seconds", wait)
+        return wait
+
+    def _next_retry_delay(self, error: Exception, attempt: int, config_dict: Dict,
+                          deadline: Optional[float], failover: bool = False) -> Optional[float]:
+        """返回重试前需要等待的秒数,不应重试时返回 None
+
+        failover 为 True 时还有其他健康端点可用: 认证失败也会切换端点,
+        且立即切换而不退避(切换次数受端点数量限制,不占用 max_retries)。
+        否则优先遵循服务端的 Retry-After,再退而使用指数退避加随机抖动。
+        """
+        if isinstance(error, RateLimitError):
+            self._add_retry_stat("rate_limited", 1)
+        if failover and isinstance(error, self._RETRYABLE_ERRORS + (AuthenticationError,)):
+            self._add_retry_stat("retries", 1)
+            return 0.0
+        if not isinstance(error, self._RETRYABLE_ERRORS) or attempt >= config_dict.get("max_retries", 2):
+            return None
+        delay = self._parse_retry_after(error)
+        if delay is None:
+            ceiling = min(config_dict.get("retry_max_delay", 30.0),
+                          config_dict.get("retry_base_delay", 1.0) * (2 ** attempt))
+            delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            self._add_retry_stat("deadline_exceeded", 1)
+            return None
+        self._add_retry_stat("retries", 1)
+        self._add_retry_stat("backoff_seconds", delay)
+        return delay
+
+    @staticmethod
+    def _parse_retry_after(error: Exception) -> Optional[float]:
+        """解析 Retry-After(秒数或HTTP日期)和 retry-after-ms 响应头"""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return max(0.0, float(headers["retry-after-ms"]) / 1000)
+            value = headers.get("retry-after")
+            if not value:
+                return None
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                retry_time = email.utils.parsedate_to_datetime(value)
+                return max(0.0, retry_time.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _add_retry_stat(self, key: str, value: float):
+        with self._stats_lock:
+            self._retry_stats[key] += value
+
+    def get_retry_stats(self) -> Dict[str, Any]:
+        """返回限流与重试统计,供监控使用"""
+        with self._stats_lock:
+            return dict(self._retry_stats)
+
+    def _get_response_cache(self, config_dict: Dict):
+        """返回响应缓存,未启用时返回 None; 缓存路径变化时重新打开"""
+        if not config_dict.get("response_cache", False):
+            return None
+        path = config_dict["response_cache_path"]
+        if self._response_cache is None or self._response_cache.path != path:
+            if self._response_cache is not None:
+                self._response_cache.close()
+            self._response_cache = ResponseCache(
+                path,
+                memory_entries=config_dict.get("response_cache_memory_entries", 256),
+                ttl=config_dict.get("response_cache_ttl", 7 * 86400),
+                max_bytes=int(config_dict.get("response_cache_max_mb", 64) * 1024 * 1024)
+            )
+        return self._response_cache
+
+    def _response_cache_key(self, params: Dict[str, Any]) -> str:
+        """缓存键: 模型、完整消息和采样参数,与是否流式无关"""
+        return ResponseCache.make_key({
+            key: params[key] for key in (
+                "model", "messages", "temperature", "max_tokens",
+                "top_p", "frequency_penalty", "presence_penalty"
+            )
+        })
+
+    def _replay_cached_response(self, cached: str, user_content: str, config_dict: Dict, stream: bool,
+                                save_turn: bool) -> Union[Dict[str, Any], Generator[StreamEvent, None, None]]:
+        if stream:
+            return self._replay_stream(cached, user_content, config_dict, save_turn)
+        if save_turn:
+            self._save_conversation_turn(user_content, cached, config_dict)
+        return {
+            "success": True,
+            "data": cached,
+            "error": "",
+            "type": "normal",
+            "cached": True
         }
+
+    def _replay_stream(self, cached: str, user_content: str, config_dict: Dict, save_turn: bool,
+                       chunk_size: int = 32) -> Generator[StreamEvent, None, None]:
+        """把缓存的回复重放为合成的流式事件"""
+        parts = []
+        for i in range(0, len(cached), chunk_size):
+            parts.append(cached[i:i + chunk_size])
+            yield StreamEvent.chunk(parts[-1], parts)
+        yield StreamEvent.complete(cached)
+        if save_turn:
+            self._save_conversation_turn(user_content, cached, config_dict)
+
+    def _cache_stream(self, events, cache: ResponseCache, cache_key: str, model: str) -> Generator[StreamEvent, None, None]:
+        """透传流式事件,完整接收后写入缓存"""
+        for event in events:
+            if event.type == "complete":
+                cache.put(cache_key, event.content, model)
+            yield event
+
+    def get_response_cache_stats(self) -> Union[Dict[str, Any], None]:
+        """返回响应缓存的命中统计,未启用时返回 None"""
+        cache = self._get_response_cache(self.read_config())
+        return cache.stats() if cache is not None else None
+
+    def clear_response_cache(self) -> bool:
+        cache = self._get_response_cache(self.read_config())
+        if cache is None:
+            return False
+        cache.clear()
+        return True
+
+    def _stream_error(self, error_message: str) -> Generator[StreamEvent, None, None]:
+        """返回流式错误信息的生成器"""
+        yield StreamEvent.error(error_message)
     
-    def _prepare_messages(self, content: str, config_dict: Dict) -> List[Dict]:
+    def _prepare_messages(self, content: str, config_dict: Dict, use_history: bool = True) -> List[Dict]:
         messages = [{"role": "system", "content": config_dict["system_prompt"]}]
+        history = self.conversation_history
         history_size = config_dict.get("history_size", 0)
-        if history_size > 0 and self.conversation_history:
-            recent_history = self.conversation_history[-history_size:]
-            messages.extend(recent_history)
+        token_budget = config_dict.get("context_token_budget", 0)
+        start = len(history)
+        if use_history and token_budget > 0 and history:
+            available = token_budget - estimate_tokens(messages[0]["content"]) - estimate_tokens(content)
+            start = history.token_window_start(available, history_size)
+        elif use_history and history_size > 0 and history:
+            start = max(0, len(history) - history_size)
+        step = config_dict.get("history_window_step", 0)
+        if step > 0 and 0 < start < len(history):
+            if token_budget > 0:
+                start = self._budget_window_start(start, step, len(history))
+            else:
+                start = self._step_window_start(start, step)
+        if use_history and config_dict.get("summarize_history", False):
+            summary_text, covered = self._get_summary().snapshot()
+            if covered > 0:
+                # 摘要代替已覆盖的较早消息,只发送之后的原文
+                summary = summary_message(summary_text)
+                sent_start = max(start, covered)
+                self._pending_summary_saving = (history.token_count(start) - history.token_count(sent_start)
+                                                - estimate_message_tokens(summary))
+                messages.append(summary)
+                start = sent_start
+        messages.extend(history.chat_messages(start))
         messages.append({"role": "user", "content": content})
         return messages
-    
-    def _save_conversation_turn(self, user_content: str, ai_content: str, config_dict: Dict):
-        self.conversation_history.extend([
+
+    @staticmethod
+    def _step_window_start(start: int, step: int) -> int:
+        """把窗口起点向前对齐到 step 条消息的整数倍
+
+        窗口逐轮滑动时每次请求的消息前缀都不同,服务端的前缀缓存(如DeepSeek的上下文硬盘缓存)
+        几乎无法命中。对齐后起点每 step 条消息才前进一次,其间发送的系统提示词和较早的消息
+        逐字节不变,只有末尾新增的对话需要重新计算。
+        只按条数限制时仍保留最近的 history_size 条,最多多发送 step-2 条消息。
+        """
+        step += step % 2  # 按整轮前进
+        return start // step * step
+
+    def _budget_window_start(self, start: int, step: int, length: int) -> int:
+        """按 token 预算截取时的窗口起点,start 为预算允许的最早起点
+
+        上次的起点仍在预算内时保持不变; 超出预算后按完整的 step 前进到对齐的位置,
+        发送的消息只会少于预算,不会超出。消息长短不一,预算能容纳的消息数每轮都在变化,
+        因此起点不能每轮重新对齐,否则几乎每轮都会移动。
+        预算能容纳的消息不超过 step 条时,前进一步后可能一轮历史都不剩,提示后改为逐轮滑动。
+        """
+        step += step % 2  # 按整轮前进
+        if length - start < step + 2:
+            if not self._window_step_warned:
+                self._window_step_warned = True
+                print(f"警告: history_window_step ({step}) 不小于预算能容纳的消息数,窗口改为逐轮滑动")
+            return start
+        anchor = self._window_anchor
+        if anchor is not None and anchor[0] is self.conversation_history and start <= anchor[1] <= length:
+            return anchor[1]
+        aligned = -(-start // step) * step
+        self._window_anchor = (self.conversation_history, aligned)
+        return aligned
+
+    def _get_summary(self) -> RollingSummary:
+        """当前对话历史的滚动摘要,历史被清空或重新加载后重新开始"""
+        if self._summary is None or self._summary.history is not self.conversation_history:
+            self._summary = RollingSummary(self.conversation_history)
+            self._pending_summary_saving = None
+        return self._summary
+
+    def _summarize_messages(self, previous: str, messages: List[Dict[str, Any]], config_dict: Dict) -> str:
+        """请求模型把新增的对话合并进已有摘要,在后台线程中调用"""
+        params = self._completion_params(config_dict, build_summary_request(previous, messages), stream=False)
+        params.update(model=config_dict["summary_model"], max_tokens=config_dict["summary_max_tokens"], temperature=0.3)
+        response, ctx = self._create_completion(params, config_dict)
+        result = self._handle_normal_response(response, "", config_dict, save_turn=False, ctx=ctx)
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+        return result["data"]
+
+    def get_history_summary(self) -> Optional[Dict[str, Any]]:
+        """滚动摘要的状态(覆盖的消息数、摘要长度、更新次数、是否正在更新、最近的错误),未开启时返回 None"""
+        config_dict = self.read_config()
+        if not config_dict.get("summarize_history", False):
+            return None
+        return self._get_summary().status()
+
+    def _save_conversation_turn(self, user_content: str, ai_content: str, config_dict: Dict,
+                                sample: Optional[Dict[str, float]] = None, truncated: Optional[str] = None):
+        turn = [
             {"role": "user", "content": user_content},
             {"role": "assistant", "content": ai_content}
-        ])
+        ]
+        if truncated:
+            # 回复不完整,记录截断原因
+            turn[1]["truncated"] = truncated
+        self.conversation_history.extend(turn)
+        for message in turn:
+            self._conversation_stats.add_message(message)
+        self._conversation_stats.add_request(sample)
+        memory_messages = config_dict.get("history_memory_messages", 0)
+        if memory_messages > 0 and self.conversation_history.in_memory > memory_messages + max(2, memory_messages // 4):
+            # 超出上限一定数量后才批量移出,避免每轮都写溢出文件
+            try:
+                self.conversation_history.spill(memory_messages)
+            except OSError as e:
+                print(f"较早的对话移出内存失败: {str(e)}")
+        if config_dict.get("summarize_history", False):
+            if self._pending_summary_saving is not None:
+                self._conversation_stats.add_summary_saving(self._pending_summary_saving)
+                self._pending_summary_saving = None
+            # 较早的对话超过阈值时在后台合并进摘要
+            self._get_summary().maybe_update(
+                config_dict["summary_keep_messages"], config_dict["summary_trigger_tokens"],
+                lambda previous, messages: self._summarize_messages(previous, messages, config_dict),
+                config_dict["summary_batch_tokens"]
+            )
         if config_dict.get("auto_save", False):
-            # 直接传递 log_file，让 save_conversation_to_file 处理空字符串
-            self.save_conversation_to_file(config_dict.get("log_file"))
+            filename = self._resolve_history_filename(config_dict.get("log_file"))
+            # 历史只会追加或整体替换,视图在提交时固定,之后的对话不影响本次写入的内容
+            history = self.conversation_history.view()
+            if config_dict.get("async_save", True):
+                # 交给后台线程,同一文件的连续保存合并为一次写入
+                self._get_history_writer(config_dict).submit(
+                    filename, lambda: self._write_history(filename, history, config_dict, append=True)
+                )
+                return
+            try:
+                self._write_history(filename, history, config_dict, append=True)
+                if not self._is_appendable(filename):
+                    print(f"对话历史已保存到: {os.path.join('Chat_history', filename)}")
+            except Exception as e:
+                print(f"自动保存对话历史失败: {str(e)}")
 
-    
-    def save_conversation_to_file(self, filename: str = None):
+    def _get_history_writer(self, config_dict: Dict) -> HistoryWriter:
+        if self._history_writer is None:
+            self._history_writer = HistoryWriter(config_dict["save_coalesce_delay"], config_dict["save_max_delay"])
+        else:
+            self._history_writer.coalesce_delay = config_dict["save_coalesce_delay"]
+            self._history_writer.max_delay = max(config_dict["save_coalesce_delay"], config_dict["save_max_delay"])
+        return self._history_writer
+
+    def flush_history(self, timeout: float = None) -> bool:
+        """等待后台写入器写完所有待保存的对话历史,超时返回 False"""
+        if self._history_writer is None:
+            return True
+        return self._history_writer.flush(timeout)
+
+    def get_save_status(self) -> Optional[Dict[str, Any]]:
+        """后台保存的统计(提交/写入/合并/失败次数、待写数、最近一次写入和错误),尚未保存过时返回 None"""
+        if self._history_writer is None:
+            return None
+        return self._history_writer.status()
+
+    def pop_save_error(self) -> Optional[str]:
+        """返回尚未提示过的后台保存错误"""
+        if self._history_writer is None:
+            return None
+        return self._history_writer.pop_error()
+
+    def _resolve_history_filename(self, filename: str = None) -> str:
         if not filename:
             config_dict = self.read_config()
             filename = config_dict.get("log_file", "conversation_history.json")
         if not filename or filename.strip() == "":
             filename = "conversation_history.json"
+        return filename
+
+    def _history_metadata(self, history=None) -> Dict[str, Any]:
+        history = self.conversation_history if history is None else history
+        return {
+            "save_time": datetime.now().isoformat(),
+            "config_file": self.config_name,
+            "total_turns": len(history) // 2
+        }
+
+    @staticmethod
+    def _is_appendable(filename: str) -> bool:
+        """JSONL日志和分段归档每轮只追加新消息,其余格式每次重写整个文件"""
+        return is_archive(filename) or is_journal_file(filename)
+
+    def _get_journal(self, full_path: str, config_dict: Dict) -> Union[ConversationJournal, HistoryArchive]:
+        """返回指向 full_path 的日志对象(JSONL日志或分段归档),切换文件时关闭旧日志"""
+        if self._journal is not None and self._journal.path == full_path:
+            return self._journal
+        self._close_journal()
+        if is_archive(full_path):
+            self._journal = self._open_archive(full_path, config_dict)
+        else:
+            self._journal = ConversationJournal(
+                full_path,
+                fsync_turns=config_dict.get("journal_fsync_turns", 8),
+                fsync_interval=config_dict.get("journal_fsync_interval", 5.0)
+            )
+        self._journal_synced = None
+        return self._journal
+
+    @staticmethod
+    def _open_archive(full_path: str, config_dict: Dict) -> HistoryArchive:
+        return HistoryArchive(
+            full_path,
+            compression=config_dict.get("archive_compression", "zstd"),
+            segment_max_bytes=int(config_dict.get("archive_segment_mb", 8) * (1 << 20)),
+            segment_max_age=config_dict.get("archive_segment_days", 7) * 86400,
+            fsync_turns=config_dict.get("journal_fsync_turns", 8),
+            fsync_interval=config_dict.get("journal_fsync_interval", 5.0)
+        )
+
+    def _close_journal(self):
+        if self._journal is not None:
+            try:
+                self._journal.close()
+            except Exception as e:
+                print(f"关闭对话日志失败: {str(e)}")
+            self._journal = None
+
+    def _write_history(self, filename: str, history, config_dict: Dict, append: bool = False):
+        """把 history (消息视图) 写入 Chat_history/filename 并更新搜索索引,失败时抛出异常
+
+        JSON文件和JSONL快照都先写临时文件再rename,不会留下写了一半的文件;
+        append 为 True 时JSONL日志和分段归档只追加尚未写入的消息。
+        .gz/.zst 结尾的文件压缩后整体重写。
+        """
+        full_path = os.path.join("Chat_history", filename)
+        with self._history_io_lock:
+            directory = os.path.dirname(full_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            if self._is_appendable(filename):
+                journal = self._get_journal(full_path, config_dict)
+                synced = self._journal_synced
+                try:
+                    if not append or synced is None or synced > len(history):
+                        # 首次写入或历史被清空/重新加载,先写入完整快照
+                        history.release_file(full_path)
+                        journal.write_snapshot(self._history_metadata(history), history)
+                    elif synced < len(history):
+                        journal.append(history.view(synced))
+                except Exception:
+                    self._journal_synced = None
+                    raise
+                self._journal_synced = len(history)
+            else:
+                # 较早的消息可能还留在要被替换的文件中按需读取
+                history.release_file(full_path)
+                fd, temp_path = mkstemp_beside(full_path)
+                compression = compression_of(filename)
+                try:
+                    if compression:
+                        with os.fdopen(fd, 'wb') as f:
+                            writer = CompressedWriter(f, compression)
+                            if is_journal_file(strip_compression(filename)):
+                                writer.write(json.dumps({"metadata": self._history_metadata(history)}, ensure_ascii=False) + "\n")
+                                for msg in history:
+                                    writer.write(json.dumps(msg, ensure_ascii=False) + "\n")
+                            else:
+                                self._write_json_history(writer, self._history_metadata(history), history)
+                            writer.finish()
+                    else:
+                        with os.fdopen(fd, 'w', encoding="utf-8") as f:
+                            self._write_json_history(f, self._history_metadata(history), history)
+                    os.replace(temp_path, full_path)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+            self._update_search_index(full_path, config_dict, history)
+
+    def compact_conversation_file(self, filename: str = None) -> bool:
+        """压缩JSONL对话日志: 修复残缺尾部并重写为单个快照; 分段归档则立即压缩封存当前段"""
+        self.flush_history()
+        filename = self._resolve_history_filename(filename)
+        if is_archive(filename):
+            return self._seal_archive(filename)
+        if not is_journal_file(filename):
+            print(f"仅支持压缩 .jsonl 格式的对话日志: {filename}")
+            return False
+        full_path = os.path.join("Chat_history", filename)
+        if not os.path.exists(full_path):
+            print(f"对话历史文件不存在: {full_path}")
+            return False
+        try:
+            is_active = self._journal is not None and self._journal.path == full_path
+            if is_active:
+                self._journal.close()
+            journal = self._journal if is_active else ConversationJournal(full_path)
+            metadata, messages, truncated = ConversationJournal.read(full_path)
+            if truncated:
+                print(f"已修复日志残缺尾部 ({truncated} 字节)")
+            metadata.update({
+                "save_time": datetime.now().isoformat(),
+                "total_turns": len(messages) // 2
+            })
+            size_before = os.path.getsize(full_path)
+            with self._history_io_lock:
+                self.conversation_history.release_file(full_path)
+                journal.write_snapshot(metadata, messages)
+            print(f"对话日志已压缩: {full_path} ({size_before} -> {os.path.getsize(full_path)} 字节)")
+            return True
+        except Exception as e:
+            print(f"压缩对话日志失败: {str(e)}")
+            return False
+
+    def _seal_archive(self, filename: str) -> bool:
+        full_path = os.path.join("Chat_history", filename)
+        if not os.path.exists(full_path):
+            print(f"对话历史归档不存在: {full_path}")
+            return False
+        try:
+            is_active = self._journal is not None and self._journal.path == full_path
+            archive = self._journal if is_active else self._open_archive(full_path, self.read_config())
+            with self._history_io_lock:
+                sealed = archive.rotate()
+            stats = archive.stats()
+            if sealed:
+                print(f"归档当前段已压缩封存: {full_path} (共{stats['segments']}段, "
+                      f"{stats['raw_bytes']} -> {stats['bytes']} 字节)")
+            else:
+                print("归档当前段为空,无需封存")
+            return True
+        except Exception as e:
+            print(f"封存归档当前段失败: {str(e)}")
+            return False
+
+    def save_conversation_to_file(self, filename: str = None):
+        # 先写完后台待保存的内容,避免与之后的写入交错
+        self.flush_history()
+        filename = self._resolve_history_filename(filename)
         try:
             full_path = os.path.join("Chat_history", filename)
             directory = os.path.dirname(full_path)
             if directory and not os.path.exists(directory):
                 os.makedirs(directory, exist_ok=True)
                 print(f"已创建目录: {directory}")
-            conversation_data = {
-                "metadata": {
-                    "save_time": datetime.now().isoformat(),
-                    "config_file": self.config_name,
-                    "total_turns": len(self.conversation_history) // 2
-                },
-                "conversation": self.conversation_history
-            }
-            with open(full_path, 'w', encoding="utf-8") as f:
-                json.dump(conversation_data, f, ensure_ascii=False, indent=2)
+            self._write_history(filename, self.conversation_history.view(), self.read_config())
             print(f"对话历史已保存到: {full_path}")
             return True
         except Exception as e:
             print(f"保存对话历史失败: {str(e)}")
             return False
     
+    def save_on_unload(self) -> bool:
+        """卸载客户端或退出前保存对话历史到配置的 log_file
+
+        JSONL日志和分段归档已由自动保存逐轮追加,只写完待保存的内容和尚未追加的消息,
+        不重写整个文件(归档不重新压缩已封存的段); 其他格式写入完整的文件。
+        本次没有从该日志加载也没有写入过时,已有的日志保持不变,不会被内存中的历史覆盖。
+        """
+        self.flush_history()
+        config_dict = self.read_config()
+        filename = self._resolve_history_filename(config_dict.get("log_file"))
+        if not self._is_appendable(filename):
+            return self.save_conversation_to_file(filename)
+        full_path = os.path.join("Chat_history", filename)
+        synced = self._journal_synced if self._journal is not None and self._journal.path == full_path else None
+        if synced is None and (os.path.exists(full_path) or not len(self.conversation_history)):
+            if len(self.conversation_history):
+                print(f"对话历史未与 {full_path} 同步,未写入; 需要覆盖时请使用 save_conversation")
+            return True
+        try:
+            self._write_history(filename, self.conversation_history.view(), config_dict, append=True)
+            print(f"对话历史已保存到: {os.path.join('Chat_history', filename)}")
+            return True
+        except Exception as e:
+            print(f"保存对话历史失败: {str(e)}")
+            return False
+
+    def _update_search_index(self, full_path: str, config_dict: Dict, history=None):
+        """文件写入后更新全文索引: 同一文件连续保存时只索引新增的消息"""
+        if not config_dict.get("search_index", True):
+            return
+        history = self.conversation_history if history is None else history
+        synced = self._search_synced
+        start = synced[1] if synced is not None and synced[0] == full_path and synced[1] <= len(history) else 0
+        try:
+            get_search_index().index_messages(full_path, history.view(start), start)
+            self._search_synced = (full_path, len(history))
+        except Exception as e:
+            # 索引只用于搜索,失败不影响保存; 下次搜索时会按文件签名重建
+            self._search_synced = None
+            print(f"更新搜索索引失败: {str(e)}")
+
+    def search_conversations(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """全文搜索 Chat_history 下的所有对话历史"""
+        return get_search_index().search(query, limit)
+
+    @staticmethod
+    def _write_json_history(f, metadata: Dict[str, Any], messages):
+        """逐条写出JSON格式的对话历史,格式与 json.dump(indent=2) 相同,但不需要先构造完整的列表"""
+        f.write('{\n  "metadata": ')
+        f.write(json.dumps(metadata, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+        f.write(',\n  "conversation": [')
+        separator = "\n    "
+        for msg in messages:
+            f.write(separator + json.dumps(msg, ensure_ascii=False, indent=2).replace("\n", "\n    "))
+            separator = ",\n    "
+        f.write("\n  ]\n}" if separator != "\n    " else "]\n}")
+
     def load_conversation_from_file(self, filename: str = None) -> bool:
-        if not filename:
-            config_dict = self.read_config()
-            filename = config_dict.get("log_file", "conversation_history.json")
-        if not filename or filename.strip() == "":
-            filename = "conversation_history.json"
+        self.flush_history()
+        filename = self._resolve_history_filename(filename)
 
         try:
             full_path = os.path.join("Chat_history", filename)
@@ -257,14 +1162,53 @@ class AIClientService:
                 print(f"对话历史文件不存在: {full_path}")
                 return False
 
-            with open(full_path, 'r', encoding="utf-8") as f:
-                conversation_data = json.load(f)
-
-            self.conversation_history = conversation_data.get("conversation", [])
-
-            metadata = conversation_data.get("metadata", {})
+            config_dict = self.read_config()
+            previous = self.conversation_history
+            memory_messages = config_dict.get("history_memory_messages", 0)
+            if self._is_appendable(filename):
+                journal = self._get_journal(full_path, config_dict)
+                journal.close()
+            if is_archive(filename):
+                # 读取清单和当前段,较早的压缩段只读取补足最近消息所需的部分
+                metadata, parts, cold, tail, role_stats, truncated = journal.load(memory_messages)
+                if truncated:
+                    print(f"检测到未写完的归档当前段尾部,已截断 {truncated} 字节")
+                self.conversation_history = HistoryStore.from_segments(parts, cold, tail)
+                self._conversation_stats.rebuild_counts(role_stats, self._last_user_message(tail))
+            elif compression_of(filename):
+                metadata, messages = read_compressed_history(full_path)
+                self.conversation_history = HistoryStore(messages)
+                self._conversation_stats.rebuild(messages)
+            elif memory_messages > 0:
+                # 读取(或建立)偏移索引,只把最近的消息载入内存,较早的留在文件中按需读取
+                index, tail, truncated = open_history(full_path, memory_messages)
+                if truncated:
+                    print(f"检测到未写完的日志尾部,已截断 {truncated} 字节")
+                self.conversation_history = HistoryStore.from_index(full_path, index, tail)
+                self._conversation_stats.rebuild_counts(index.role_stats(), self._last_user_message(tail))
+                metadata = index.metadata
+            elif is_journal_file(filename):
+                metadata, messages, truncated = ConversationJournal.read(full_path)
+                if truncated:
+                    print(f"检测到未写完的日志尾部,已截断 {truncated} 字节")
+                self.conversation_history = HistoryStore(messages)
+                self._conversation_stats.rebuild(messages)
+            else:
+                with open(full_path, 'r', encoding="utf-8") as f:
+                    conversation_data = json.load(f)
+                self.conversation_history = HistoryStore(conversation_data.get("conversation", []))
+                self._conversation_stats.rebuild(self.conversation_history)
+                metadata = conversation_data.get("metadata", {})
+            previous.close()
+            self._search_synced = None
+            if self._is_appendable(filename):
+                # 日志内容与内存一致,后续可直接追加
+                self._journal_synced = len(self.conversation_history)
+                total_turns = len(self.conversation_history) // 2
+            else:
+                self._journal_synced = None
+                total_turns = metadata.get("total_turns", 0)
             save_time = metadata.get("save_time", "未知时间")
-            total_turns = metadata.get("total_turns", 0)
 
             print(f"已加载对话历史 (保存于: {save_time}, 共{total_turns}轮对话)")
             return True
@@ -276,20 +1220,27 @@ class AIClientService:
             print(f"加载对话历史失败: {str(e)}")
             return False
     
+    @staticmethod
+    def _last_user_message(messages: List[Dict[str, Any]]) -> Optional[str]:
+        return next((m.get("content") for m in reversed(messages) if m.get("role") == "user"), None)
+
     def clear_conversation_history(self):
-        self.conversation_history = []
+        self.flush_history()
+        self.conversation_history.close()
+        self.conversation_history = HistoryStore()
+        self._search_synced = None
+        self._conversation_stats.reset()
+        self._journal_synced = None
         print("对话历史已清空")
     
     def get_conversation_summary(self) -> Dict:
-        total_turns = len(self.conversation_history) // 2
-        total_chars = sum(len(msg.get("content", "")) for msg in self.conversation_history)
-        
-        return {
-            "total_turns": total_turns,
-            "total_messages": len(self.conversation_history),
-            "total_characters": total_chars,
-            "last_user_message": next(
-                (msg["content"] for msg in reversed(self.conversation_history) if msg["role"] == "user"),
-                None
-            )
-        }
\ No newline at end of file
+        """返回对话摘要,由累计统计直接得出,耗时与历史长度无关
+
+        除轮数、消息数、字符数和最后一条用户消息外,还包括各角色的消息数/字符数、
+        本次会话的token用量 (prompt/completion/total_tokens) 和平均延迟
+        (avg_ttft、avg_duration 秒, avg_tokens_per_sec),没有数据时为 None;
+        messages_in_memory 为内容在内存中的消息数,其余的留在磁盘上按需读取。
+        """
+        summary = self._conversation_stats.summary()
+        summary["messages_in_memory"] = self.conversation_history.in_memory
+        return summary
\ No newline at end of file
@@ -0,0 +1,154 @@
+import asyncio
+import httpx
+import openai
+from typing import Any, AsyncGenerator, Dict, Union
+from AI_client_service import AIClientService
+from endpoint_pool import Endpoint
+from request_metrics import RequestContext, current_request
+from stream_events import StreamEvent
+
+
+class AsyncAIClientService(AIClientService):
+    """基于asyncio和openai.AsyncOpenAI的异步AI客户端服务
+
+    配置解析(read_config)、消息构造(_prepare_messages)和对话历史持久化
+    与同步的 AIClientService 共用,文件写入在线程池中执行,不阻塞事件循环。
+    """
+
+    def __init__(self, config_name):
+        super().__init__(config_name)
+        self._async_clients = {}
+
+    def _get_async_client(self, config_dict: Dict, endpoint: Endpoint) -> openai.AsyncOpenAI:
+        """返回端点对应的长期复用异步客户端,仅在端点或连接相关配置变化时重建"""
+        signature = self._transport_signature(config_dict, endpoint.base_url, endpoint.api_key)
+        client = self._async_clients.get(signature)
+        if client is not None:
+            return client
+        valid = set(
+            self._transport_signature(config_dict, ep["base_url"], ep["api_key"])
+            for ep in config_dict["endpoints"]
+        )
+        for stale in [sig for sig in self._async_clients if sig not in valid]:
+            # 旧连接池在后台关闭,不阻塞当前请求
+            asyncio.ensure_future(self._async_clients.pop(stale).close())
+        timeout = self._build_timeout(config_dict)
+        client = openai.AsyncOpenAI(
+            api_key=endpoint.api_key,
+            base_url=endpoint.base_url,
+            timeout=timeout,
+            # 重试由 _acreate_completion 统一处理
+            max_retries=0,
+            http_client=self._build_http_client(config_dict, timeout, client_class=httpx.AsyncClient)
+        )
+        self._async_clients[signature] = client
+        return client
+
+    async def aclose(self):
+        """关闭异步客户端的连接池,并刷新对话日志"""
+        for client in self._async_clients.values():
+            try:
+                await client.close()
+            except Exception:
+                pass
+        self._async_clients = {}
+        await asyncio.to_thread(self.close)
+
+    async def usr_request(self, content: str, stream: bool = None, use_history: bool = True) -> Union[Dict[str, Any], AsyncGenerator[StreamEvent, None]]:
+        """异步处理用户请求
+        非流式模式返回与同步版本相同的字典,流式模式返回 StreamEvent 异步迭代器。
+        取消正在消费流的任务或调用迭代器的 aclose() 会立即关闭底层HTTP流。
+        """
+        config_dict = self.read_config()
+        if stream is None:
+            stream = config_dict["stream"]
+        messages = self._prepare_messages(content, config_dict, use_history)
+        try:
+            response, ctx = await self._acreate_completion(
+                self._completion_params(config_dict, messages, stream), config_dict
+            )
+            if stream:
+                return self._handle_stream_response_async(response, content, config_dict, use_history, ctx)
+            else:
+                return await asyncio.to_thread(self._handle_normal_response, response, content, config_dict, use_history, ctx)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error_msg = self._describe_error(e)
+            print(error_msg)
+            if stream:
+                return self._async_stream_error(error_msg)
+            return self._error_response(error_msg, stream)
+
+    async def _acreate_completion(self, params: Dict[str, Any], config_dict: Dict):
+        """异步发送请求,限流、端点选择与重试策略与同步版本的 _create_completion 相同"""
+        deadline = self._request_deadline(config_dict)
+        pool = self._get_endpoint_pool(config_dict)
+        tried = []
+        attempt = 0
+        self._add_retry_stat("requests", 1)
+        while True:
+            wait = self._reserve_rate_limit(params, config_dict, deadline)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            endpoint = pool.select(tried)
+            client = self._get_async_client(config_dict, endpoint)
+            ctx = RequestContext(pool, endpoint, params["model"], self._get_metrics(config_dict))
+            token = current_request.set(ctx)
+            try:
+                response = await client.chat.completions.create(**params, **self._deadline_options(config_dict, deadline))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tried.append(endpoint)
+                delay, failover = self._handle_attempt_failure(e, ctx, tried, attempt, config_dict, deadline)
+                if delay is None:
+                    raise
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if not failover:
+                    # 切换端点不占用 max_retries,也不增加退避时间
+                    attempt += 1
+                continue
+            finally:
+                current_request.reset(token)
+            if not params["stream"]:
+                ctx.mark_first_token()
+            return response, ctx
+
+    async def _handle_stream_response_async(self, response, user_content: str, config_dict: Dict, save_turn: bool = True,
+                                            ctx: RequestContext = None) -> AsyncGenerator[StreamEvent, None]:
+        """处理异步流式响应,退出时(完成、出错或被取消)都会关闭HTTP流"""
+        try:
+            parts = []
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    content = chunk.choices[0].delta.content
+                    if ctx is not None:
+                        ctx.mark_chunk()
+                    parts.append(content)
+                    yield StreamEvent.chunk(content, parts)
+                elif ctx is not None and getattr(chunk, "usage", None) is not None:
+                    ctx.set_usage(chunk.usage)
+
+            # 完成消息
+            full_response = "".join(parts)
+            sample = ctx.finish(full_response) if ctx is not None else None
+            yield StreamEvent.complete(full_response)
+            # 保存对话
+            if save_turn:
+                await asyncio.to_thread(self._save_conversation_turn, user_content, full_response, config_dict, sample)
+
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as e:
+            if ctx is not None:
+                ctx.mark_failure(str(e))
+            yield StreamEvent.error(f"流式处理错误: {str(e)}")
+        finally:
+            await response.close()
+
+    async def _async_stream_error(self, error_message: str) -> AsyncGenerator[StreamEvent, None]:
+        """返回流式错误信息的异步生成器"""
+        yield StreamEvent.error(error_message)
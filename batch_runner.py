@@ -0,0 +1,129 @@
+#batch_runner
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+
+def _iter_prompts(input_path: str) -> Iterator[Tuple[int, Any, str, Optional[str]]]:
+    """逐行读取输入JSONL,产出 (行号, id, 提示词, 错误信息)
+
+    每行可以是 {"id": ..., "prompt": ...} (也接受 "content"/"message" 字段),
+    或者直接是一个JSON字符串; 没有 id 时使用行号。
+    无法解析或格式不对的行不中断批量任务,错误信息不为 None,作为该行的失败结果写出。
+    """
+    with open(input_path, 'r', encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield index, index, "", f"无效的输入行: {e}"
+                continue
+            if isinstance(record, str):
+                yield index, index, record, None
+                continue
+            if not isinstance(record, dict):
+                yield index, index, "", "输入行必须是JSON对象或字符串"
+                continue
+            prompt = record.get("prompt", record.get("content", record.get("message", "")))
+            if not isinstance(prompt, str):
+                yield index, record.get("id", index), "", "提示词必须是字符串"
+                continue
+            yield index, record.get("id", index), prompt, None
+
+
+def _load_finished_ids(output_path: str) -> Set[str]:
+    """读取已有输出文件中成功完成的id,用于断点续跑"""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'r', encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上次中断时写了一半的行
+                continue
+            if record.get("success"):
+                finished.add(json.dumps(record.get("id")))
+    return finished
+
+
+def run_batch_chat(service, input_path: str, output_path: str, concurrency: int = 4) -> Dict[str, Any]:
+    """并发执行批量对话,每条结果完成后立即追加到输出JSONL
+
+    每个请求都是独立的(不携带、不记录对话历史)。输出中已经成功的id
+    在重新运行时会被跳过,失败的id会重新执行。中断(Ctrl+C)时不再发送新的请求,
+    已在进行中的请求完成后结果照常写出。返回统计信息字典。
+    """
+    concurrency = max(1, int(concurrency))
+    finished = _load_finished_ids(output_path)
+    stats = {"total": 0, "skipped": 0, "succeeded": 0, "failed": 0, "elapsed": 0.0, "throughput": 0.0}
+
+    def run_one(index: int, item_id: Any, prompt: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            response = service.usr_request(prompt, stream=False, use_history=False)
+        except Exception as e:
+            response = {"success": False, "data": "", "error": str(e)}
+        return {
+            "index": index,
+            "id": item_id,
+            "success": response["success"],
+            "data": response.get("data", ""),
+            "error": response.get("error", ""),
+            "elapsed": round(time.perf_counter() - start, 3)
+        }
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    # 输出文件在线程池之后关闭: 中断时仍在进行的请求完成后也能写出结果
+    with open(output_path, 'a', encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        write_lock = threading.Lock()
+
+        def write_result(result: Dict[str, Any]):
+            with write_lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["succeeded" if result["success"] else "failed"] += 1
+
+        def on_done(future: Future):
+            # 在完成请求的工作线程中调用
+            if not future.cancelled():
+                write_result(future.result())
+
+        pending = set()
+        try:
+            for index, item_id, prompt, error in _iter_prompts(input_path):
+                stats["total"] += 1
+                if json.dumps(item_id) in finished:
+                    stats["skipped"] += 1
+                    continue
+                if error is not None:
+                    write_result({"index": index, "id": item_id, "success": False, "data": "",
+                                  "error": error, "elapsed": 0.0})
+                    continue
+                future = executor.submit(run_one, index, item_id, prompt)
+                future.add_done_callback(on_done)
+                pending.add(future)
+                # 限制在途任务数量,避免一次性提交上千个请求
+                if len(pending) >= concurrency * 2:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        except BaseException:
+            # 中断或出错时只取消尚未开始的请求,进行中的请求由线程池等待完成并写出
+            for future in pending:
+                future.cancel()
+            raise
+
+    stats["elapsed"] = time.perf_counter() - start
+    processed = stats["succeeded"] + stats["failed"]
+    stats["throughput"] = processed / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    return stats
@@ -0,0 +1,122 @@
+#bench_archive
+"""对话历史存储格式基准测试
+
+比较同一段对话以不同格式保存时的磁盘占用、保存耗时和加载耗时:
+  JSON (缩进快照)、JSONL 日志、单文件压缩 (.json.gz/.jsonl.gz)、分段压缩归档 (.archive, gzip/zstd)。
+加载分别测量全部载入 (history_memory_messages=0) 和只载入最近消息的情况;
+JSON/JSONL 只载入最近消息时使用已缓存的偏移索引,归档只读取清单、当前段和最后几段。
+所有文件写在临时目录中,不影响当前目录的配置和对话历史。
+
+用法: python benchmarks/bench_archive.py [--turns 50000] [--segment-mb 8] [--memory-messages 2000]
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_archive import zstandard  # noqa: E402
+
+_STDOUT = sys.stdout
+
+
+def report(*args):
+    print(*args, file=_STDOUT, flush=True)
+
+
+def write_config(**overrides) -> str:
+    config = {
+        "api_key": "sk-bench", "base_url": "http://127.0.0.1:9/v1", "model": "stub-model",
+        "history_size": 10, "auto_save": False, "max_retries": 0
+    }
+    config.update(overrides)
+    path = os.path.join("AI_configs", "archive.json")
+    with open(path, 'w', encoding="utf-8") as f:
+        json.dump(config, f)
+    return path
+
+
+def make_service(**overrides):
+    from AI_client_service import AIClientService
+    return AIClientService(write_config(**overrides))
+
+
+def disk_bytes(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def formats():
+    """(显示名称, 文件名, 压缩格式)"""
+    items = [("JSON", "bench.json", None), ("JSONL", "bench.jsonl", None),
+             ("JSON gzip", "bench.json.gz", None), ("JSONL gzip", "bench.jsonl.gz", None),
+             ("归档 gzip", "bench_gzip.archive", "gzip")]
+    if zstandard is not None:
+        items += [("JSONL zstd", "bench.jsonl.zst", None), ("归档 zstd", "bench_zstd.archive", "zstd")]
+    return items
+
+
+def timed_load(log_file: str, memory_messages: int, compression: str) -> float:
+    service = make_service(history_memory_messages=memory_messages, archive_compression=compression or "gzip")
+    start = time.perf_counter()
+    service.load_conversation_from_file(log_file)
+    elapsed = time.perf_counter() - start
+    service.close()
+    return elapsed * 1000
+
+
+def run(turns: int, segment_mb: float, memory_messages: int):
+    report(f"\n对话历史存储格式 ({turns} 轮, 归档每段 {segment_mb} MB)")
+    if zstandard is None:
+        report("  未安装zstandard包,跳过zstd格式")
+    messages = []
+    for i in range(turns):
+        messages += [
+            {"role": "user", "content": f"历史问题 {i} " + "内容" * 20},
+            {"role": "assistant", "content": f"历史回答 {i} " + "reply text " * 40}
+        ]
+    report(f"  {'':<14}{'磁盘(MB)':>10}{'保存(ms)':>10}{'全部载入(ms)':>14}{'最近消息(ms)':>14}")
+    for label, log_file, compression in formats():
+        service = make_service(archive_compression=compression or "gzip", archive_segment_mb=segment_mb)
+        service.conversation_history.extend(messages)
+        service._conversation_stats.rebuild(service.conversation_history)
+        start = time.perf_counter()
+        service.save_conversation_to_file(log_file)
+        save_ms = (time.perf_counter() - start) * 1000
+        service.close()
+        size = disk_bytes(os.path.join("Chat_history", log_file)) / 1e6
+        # 第一次加载建立偏移索引,不计入
+        timed_load(log_file, memory_messages, compression)
+        full_ms = timed_load(log_file, 0, compression)
+        recent_ms = timed_load(log_file, memory_messages, compression)
+        report(f"  {label:<14}{size:>10.2f}{save_ms:>10.0f}{full_ms:>14.0f}{recent_ms:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话历史存储格式基准")
+    parser.add_argument("--turns", type=int, default=50000, help="对话轮数")
+    parser.add_argument("--segment-mb", type=float, default=8, help="归档每段的大小(MB)")
+    parser.add_argument("--memory-messages", type=int, default=2000, help="只载入最近消息时保留的消息数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="deepmini-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs("AI_configs")
+    os.makedirs("Chat_history")
+    try:
+        with open(os.devnull, 'w', encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            run(args.turns, args.segment_mb, args.memory_messages)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
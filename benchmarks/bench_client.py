@@ -0,0 +1,261 @@
+#bench_client
+"""客户端开销基准测试
+
+在子进程中启动本地模拟服务 (stub_server.py),不调用真实API,
+只测量本客户端自身的开销,用于离线发现性能回退:
+  1. 每个token的客户端CPU时间 (usr_request 流式/非流式, Command_handler.chat)
+  2. 首个token延迟中客户端增加的部分 (观测到的首token时间 - 服务端设定的延迟)
+  3. 自动保存的耗时随历史长度的变化 (JSON快照 / JSONL日志,含搜索索引更新)
+  4. 每轮对话增加的内存
+  5. 加载大型对话历史的耗时和内存 (全部载入 / 偏移索引只载入最近的消息)
+所有文件写在临时目录中,不影响当前目录的配置和对话历史。
+
+用法: python benchmarks/bench_client.py [--requests 20] [--tokens 2000] [--history 100 1000 10000] [--load-turns 50000]
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STUB = os.path.join(ROOT, "benchmarks", "stub_server.py")
+# 测量期间标准输出被重定向,客户端服务的提示信息(如"对话历史已保存到")不显示
+_STDOUT = sys.stdout
+
+
+def report(*args):
+    print(*args, file=_STDOUT, flush=True)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def stub_server(**options):
+    """启动模拟服务子进程,返回其 base_url; 服务端的CPU不计入本进程"""
+    port = free_port()
+    args = [sys.executable, STUB, "--port", str(port)]
+    for name, value in options.items():
+        args += ["--" + name.replace("_", "-"), str(value)]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        proc.stdout.readline()  # 等待启动完成的提示
+        yield f"http://127.0.0.1:{port}/v1"
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def write_config(name: str, base_url: str, **overrides) -> str:
+    config = {
+        "api_key": "sk-bench", "base_url": base_url, "model": "stub-model",
+        "history_size": 10, "auto_save": False, "max_retries": 0
+    }
+    config.update(overrides)
+    path = os.path.join("AI_configs", name)
+    with open(path, 'w', encoding="utf-8") as f:
+        json.dump(config, f)
+    return path
+
+
+def make_service(config_path: str):
+    from AI_client_service import AIClientService
+    return AIClientService(config_path)
+
+
+def run_request(service, stream: bool, message: str = "benchmark"):
+    """发送一次请求并消费完整响应,返回 (首个内容到达的时刻, 回复文本)"""
+    if not stream:
+        result = service.usr_request(message, stream=False)
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+        return time.perf_counter(), result["data"]
+    first = None
+    for event in service.usr_request(message, stream=True):
+        if first is None:
+            first = time.perf_counter()
+        if not event["success"]:
+            raise RuntimeError(event["content"])
+    return first, event["content"]
+
+
+def bench_cpu_per_token(requests: int, tokens: int):
+    report(f"\n[1] 每个token的客户端CPU时间 ({requests} 次请求 x {tokens} token, 服务端不限速)")
+    from AI_CLI_Command_handler import Command_handler
+    with stub_server(tokens=tokens) as base_url:
+        config_path = write_config("cpu.json", base_url)
+        for label, stream in (("usr_request 非流式", False), ("usr_request 流式", True)):
+            service = make_service(config_path)
+            run_request(service, stream)  # 预热: 建立连接、导入模块
+            cpu, wall = time.process_time(), time.perf_counter()
+            for _ in range(requests):
+                run_request(service, stream)
+            cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+            service.close()
+            report(f"  {label:<28}{cpu / (requests * tokens) * 1e6:>8.2f} us/token CPU"
+                  f"{wall / requests * 1000:>10.1f} ms/请求")
+
+        handler = Command_handler()
+        handler.load_ai_client("cpu.json")
+        handler.chat("benchmark", "--stream")
+        cpu, wall = time.process_time(), time.perf_counter()
+        for _ in range(requests):
+            handler.chat("benchmark", "--stream")
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        handler.unload_ai_client()
+        report(f"  {'Command_handler.chat 流式':<28}{cpu / (requests * tokens) * 1e6:>8.2f} us/token CPU"
+              f"{wall / requests * 1000:>10.1f} ms/请求")
+
+
+def bench_ttft(requests: int, latency_ms: float):
+    report(f"\n[2] 首个token延迟的客户端开销 (服务端延迟 {latency_ms:.0f} ms, {requests} 次请求)")
+    with stub_server(latency=latency_ms, tokens=16) as base_url:
+        service = make_service(write_config("ttft.json", base_url))
+        run_request(service, True)
+        overheads = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            first, _ = run_request(service, True)
+            overheads.append((first - start) * 1000 - latency_ms)
+        service.close()
+    overheads.sort()
+    p95 = overheads[min(len(overheads) - 1, int(len(overheads) * 0.95))]
+    report(f"  客户端开销: 中位数 {statistics.median(overheads):.2f} ms, p95 {p95:.2f} ms, 最小 {overheads[0]:.2f} ms")
+
+
+def prefill(service, turns: int):
+    for i in range(turns):
+        service.conversation_history.extend([
+            {"role": "user", "content": f"历史问题 {i} " + "内容" * 20},
+            {"role": "assistant", "content": f"历史回答 {i} " + "reply text " * 40}
+        ])
+    service._conversation_stats.rebuild(service.conversation_history)
+
+
+def timed_save_turns(service):
+    """包装服务的 _save_conversation_turn,记录每轮保存(含自动保存)的耗时"""
+    timings = []
+    save_turn = service._save_conversation_turn
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        save_turn(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    service._save_conversation_turn = wrapper
+    return timings
+
+
+def bench_auto_save(requests: int, history_lengths):
+    report(f"\n[3] 自动保存耗时随历史长度的变化 (每个长度 {requests} 次非流式请求, 取中位数)")
+    report(f"  {'历史轮数':>8}{'JSON快照(ms)':>16}{'JSONL日志(ms)':>16}")
+    with stub_server(tokens=16) as base_url:
+        for turns in history_lengths:
+            costs = []
+            for log_file in ("bench_history.json", "bench_history.jsonl"):
+                service = make_service(write_config("save.json", base_url, auto_save=True, log_file=log_file))
+                prefill(service, turns)
+                # 第一次请求写入完整快照(JSONL之后只追加)并建立搜索索引,不计入
+                run_request(service, False)
+                timings = timed_save_turns(service)
+                for _ in range(requests):
+                    run_request(service, False)
+                service.close()
+                os.remove(os.path.join("Chat_history", log_file))
+                costs.append(statistics.median(timings) * 1000)
+            report(f"  {turns:>8}{costs[0]:>16.2f}{costs[1]:>16.2f}")
+
+
+def bench_memory(turns: int, tokens: int):
+    report(f"\n[4] 每轮对话增加的内存 ({turns} 轮, 每个回复 {tokens} token)")
+    with stub_server(tokens=tokens) as base_url:
+        service = make_service(write_config("memory.json", base_url))
+        run_request(service, True)
+        gc.collect()
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        for i in range(turns):
+            run_request(service, i % 2 == 0, f"问题 {i}")
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        reply_chars = len(service.conversation_history.content(-1))
+        service.close()
+    report(f"  {(after - before) / turns:.0f} B/轮 (回复约 {reply_chars} 字符)")
+
+
+def bench_load(turns: int):
+    report(f"\n[5] 加载大型对话历史 ({turns} 轮)")
+    base_url = "http://127.0.0.1:9/v1"  # 不发送请求
+    service = make_service(write_config("load.json", base_url))
+    prefill(service, turns)
+    for log_file in ("bench_load.json", "bench_load.jsonl"):
+        service.save_conversation_to_file(log_file)
+    service.close()
+    sizes = [os.path.getsize(os.path.join("Chat_history", name)) / 1e6 for name in ("bench_load.json", "bench_load.jsonl")]
+    report(f"  文件大小: JSON {sizes[0]:.1f} MB, JSONL {sizes[1]:.1f} MB")
+    report(f"  {'':<20}{'JSON(ms)':>10}{'JSONL(ms)':>11}{'内存(MB)':>10}")
+    for label, memory_messages, fresh in (("全部载入", 0, False), ("偏移索引 首次建立", 2000, True),
+                                          ("偏移索引 已缓存", 2000, False)):
+        if fresh:
+            shutil.rmtree(os.path.join("Chat_history", ".offsets"), ignore_errors=True)
+        service = make_service(write_config("load.json", base_url, history_memory_messages=memory_messages))
+        costs = []
+        for log_file in ("bench_load.json", "bench_load.jsonl"):
+            start = time.perf_counter()
+            service.load_conversation_from_file(log_file)
+            costs.append((time.perf_counter() - start) * 1000)
+        # 再加载一次,测量加载后留在内存中的对话历史
+        service.clear_conversation_history()
+        gc.collect()
+        tracemalloc.start()
+        service.load_conversation_from_file("bench_load.jsonl")
+        gc.collect()
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        service.close()
+        report(f"  {label:<20}{costs[0]:>10.0f}{costs[1]:>11.0f}{retained / 1e6:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="客户端开销基准")
+    parser.add_argument("--requests", type=int, default=20, help="每项测量的请求数")
+    parser.add_argument("--tokens", type=int, default=2000, help="CPU测量时每个回复的token数")
+    parser.add_argument("--latency", type=float, default=100, help="首token测量时服务端的延迟(毫秒)")
+    parser.add_argument("--history", type=int, nargs="+", default=[100, 1000, 10000], help="自动保存测量的历史轮数")
+    parser.add_argument("--turns", type=int, default=500, help="内存测量的对话轮数")
+    parser.add_argument("--load-turns", type=int, default=50000, help="加载测量的历史轮数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="deepmini-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs("AI_configs")
+    os.makedirs("Chat_history")
+    try:
+        with open(os.devnull, 'w', encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            bench_cpu_per_token(args.requests, args.tokens)
+            bench_ttft(args.requests, args.latency)
+            bench_auto_save(args.requests, args.history)
+            bench_memory(args.turns, 64)
+            bench_load(args.load_turns)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#bench_daemon
+"""守护进程单次调用基准测试
+
+在临时目录中启动本地模拟服务 (stub_server.py,首token延迟为0) 和守护进程,比较每次调用的耗时:
+  1. 冷启动: 启动交互命令行,load_ai_client 后发送一条消息再退出
+     (解释器启动、导入openai、读取配置、建立新连接)
+  2. --oneshot: 新进程通过守护进程发送一条消息
+  3. 进程内: 直接用 client_daemon.request 发送,只包含本地套接字和协议的开销
+所有文件写在临时目录中,不影响当前目录的配置和对话历史。
+
+用法: python benchmarks/bench_daemon.py [--runs 20]
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_client import stub_server  # noqa: E402
+from client_daemon import request  # noqa: E402
+
+HANDLER = os.path.join(ROOT, "AI_CLI_Command_handler.py")
+
+
+def write_config(base_url: str):
+    config = {
+        "api_key": "sk-bench", "base_url": base_url, "model": "stub-model",
+        "history_size": 10, "auto_save": False, "max_retries": 0, "stream": False
+    }
+    with open(os.path.join("AI_configs", "config.json"), 'w', encoding="utf-8") as f:
+        json.dump(config, f)
+
+
+def timed_run(args, env, stdin: bytes = b"") -> float:
+    start = time.perf_counter()
+    subprocess.run(args, input=stdin, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def timed_request(address: str) -> float:
+    start = time.perf_counter()
+    for _ in request({"op": "chat", "prompt": "benchmark", "stream": False}, address):
+        pass
+    return time.perf_counter() - start
+
+
+def summarize(label: str, samples):
+    print(f"  {label:<14}中位数 {statistics.median(samples) * 1000:>7.1f} ms, 最小 {min(samples) * 1000:>7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="守护进程单次调用基准")
+    parser.add_argument("--runs", type=int, default=20, help="每项测量的次数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="deepmini-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs("AI_configs")
+    address = os.path.join(workdir, "daemon.sock") if hasattr(socket, "AF_UNIX") else "127.0.0.1:8779"
+    env = dict(os.environ, DEEPMINI_DAEMON=address, DEEPMINI_NO_WARMUP="1")
+    daemon = None
+    try:
+        with stub_server(latency=0, tokens=20, token_rate=0) as base_url:
+            write_config(base_url)
+            daemon = subprocess.Popen([sys.executable, HANDLER, "--daemon"], env=env,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            # 等待"守护进程已启动"
+            while b"pid" not in daemon.stdout.readline():
+                pass
+            print(f"\n每次调用的耗时 ({args.runs}次, 模拟服务无延迟)")
+            cold = [timed_run([sys.executable, HANDLER], env, b"load_ai_client\nchat --no-stream benchmark\nexit\n")
+                    for _ in range(args.runs)]
+            summarize("冷启动", cold)
+            oneshot = [timed_run([sys.executable, HANDLER, "--oneshot", "benchmark", "--no-stream"], env)
+                       for _ in range(args.runs)]
+            summarize("--oneshot", oneshot)
+            in_process = [timed_request(address) for _ in range(args.runs)]
+            summarize("进程内请求", in_process)
+            interpreter = [timed_run([sys.executable, "-c", "pass"], env) for _ in range(args.runs)]
+            summarize("空解释器启动", interpreter)
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
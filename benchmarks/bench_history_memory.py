@@ -0,0 +1,108 @@
+#bench_history_memory
+"""对话历史内存占用基准测试
+
+比较原来的字典列表与 HistoryStore 在 10k / 100k 轮对话时的内存占用,
+以及截取最近N条、按token预算截取窗口和逐条序列化的耗时。
+消息从JSONL文本解析得到,与从日志文件加载历史的情况一致。
+
+用法: python benchmarks/bench_history_memory.py [--turns 10000 100000]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HistoryStore  # noqa: E402
+
+SAMPLE_TEXT = "这是一段用于测试的对话内容, with some English words mixed in. "
+
+
+def make_lines(turns: int):
+    """生成 turns 轮对话的JSONL行: 用户消息较短,回复较长"""
+    rng = random.Random(42)
+    lines = []
+    for i in range(turns):
+        user = f"问题{i}: " + SAMPLE_TEXT * rng.randint(1, 2)
+        reply = f"回答{i}: " + SAMPLE_TEXT * rng.randint(4, 12)
+        lines.append(json.dumps({"role": "user", "content": user}, ensure_ascii=False))
+        lines.append(json.dumps({"role": "assistant", "content": reply}, ensure_ascii=False))
+    return lines
+
+
+def measure(build):
+    """返回 (构建结果, 构建后新增的内存字节数, 耗时秒)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def timed(func, repeat: int = 20) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def token_window_list(history, available: int):
+    """原实现的等价逻辑: 从最近往前逐轮累加估算token(未缓存前缀和时的代价)"""
+    from token_estimator import estimate_message_tokens
+    start = len(history)
+    used = 0
+    while start >= 2:
+        cost = estimate_message_tokens(history[start - 2]) + estimate_message_tokens(history[start - 1])
+        if used + cost > available:
+            break
+        used += cost
+        start -= 2
+    return start
+
+
+def run(turns: int):
+    lines = make_lines(turns)
+    text_bytes = sum(sys.getsizeof(json.loads(line)["content"]) for line in lines[:2000]) * len(lines) / min(len(lines), 2000)
+
+    history, list_bytes, list_time = measure(lambda: [json.loads(line) for line in lines])
+    del history
+    store, store_bytes, store_time = measure(lambda: HistoryStore(json.loads(line) for line in lines))
+    history = [json.loads(line) for line in lines]
+
+    print(f"\n{turns} 轮对话 ({len(lines)} 条消息, 文本约 {text_bytes / 1024 / 1024:.1f} MB)")
+    print(f"  {'':<18}{'内存(MB)':>10}{'每条额外开销(B)':>18}{'加载(ms)':>10}")
+    for label, size, elapsed in (("字典列表", list_bytes, list_time), ("HistoryStore", store_bytes, store_time)):
+        overhead = (size - text_bytes) / len(lines)
+        print(f"  {label:<18}{size / 1024 / 1024:>10.1f}{overhead:>18.1f}{elapsed * 1000:>10.1f}")
+    print(f"  内存节省: {1 - store_bytes / list_bytes:.1%}")
+
+    print(f"  最近20条: 字典列表 {timed(lambda: history[-20:]) * 1e6:.1f} us, "
+          f"HistoryStore {timed(lambda: store.tail(20)) * 1e6:.1f} us")
+    store.token_window_start(4000)  # 首次调用计算前缀和
+    print(f"  4000 token窗口: 逐条估算 {timed(lambda: token_window_list(history, 4000)) * 1e6:.1f} us, "
+          f"HistoryStore前缀和 {timed(lambda: store.token_window_start(4000)) * 1e6:.1f} us")
+
+    def serialize(messages):
+        return sum(len(json.dumps(msg, ensure_ascii=False)) for msg in messages)
+    print(f"  逐条序列化: 字典列表 {timed(lambda: serialize(history), 3) * 1000:.1f} ms, "
+          f"HistoryStore视图 {timed(lambda: serialize(store.view()), 3) * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话历史内存占用基准")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10000, 100000], help="对话轮数")
+    args = parser.parse_args()
+    for turns in args.turns:
+        run(turns)
+
+
+if __name__ == "__main__":
+    main()
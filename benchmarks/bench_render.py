@@ -0,0 +1,115 @@
+#bench_render
+"""流式输出渲染基准测试
+
+比较逐个增量 print(..., flush=True) 与 StreamRenderer (按时间预算/换行批量刷新)
+每秒能渲染的chunk数和实际写出次数。输出写到伪终端 (pty) 中,
+另一线程持续读出,模拟真实终端; 没有pty的平台(Windows)写到临时文件并视为终端。
+分别测试普通文本(换行少)和代码(换行多)两种内容。
+
+用法: python benchmarks/bench_render.py [--chunks 20000] [--interval-ms 16]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stream_renderer import StreamRenderer  # noqa: E402
+
+
+class _FileAsTty:
+    """没有pty时把临时文件包装成终端"""
+
+    def __init__(self, f):
+        self._f = f
+
+    def write(self, text):
+        return self._f.write(text)
+
+    def flush(self):
+        self._f.flush()
+
+    def isatty(self):
+        return True
+
+
+def open_terminal():
+    """返回 (可写的终端流, 关闭函数)"""
+    try:
+        import pty
+    except ImportError:
+        f = tempfile.TemporaryFile('w+', encoding="utf-8")
+        return _FileAsTty(f), f.close
+    master, slave = pty.openpty()
+
+    def drain():
+        while True:
+            try:
+                if not os.read(master, 65536):
+                    break
+            except OSError:
+                break
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    stream = os.fdopen(slave, 'w', encoding="utf-8")
+
+    def close():
+        stream.close()
+        reader.join(timeout=1)
+        os.close(master)
+    return stream, close
+
+
+def make_chunks(count: int, newline_every: int):
+    words = ("流式", "输出", "token", " the", " quick", "渲染", " fox", "测试")
+    return [words[i % len(words)] + ("\n" if newline_every and i % newline_every == newline_every - 1 else "")
+            for i in range(count)]
+
+
+def render_print(stream, chunks):
+    for chunk in chunks:
+        print(chunk, end="", flush=True, file=stream)
+    return len(chunks)
+
+
+def render_buffered(stream, chunks, interval: float):
+    with StreamRenderer(stream, interval) as renderer:
+        for chunk in chunks:
+            renderer.write(chunk)
+    return renderer.flushes
+
+
+def run(label: str, chunks, interval: float):
+    stream, close = open_terminal()
+    try:
+        results = []
+        for name, render in (("逐chunk print+flush", lambda: render_print(stream, chunks)),
+                             ("StreamRenderer", lambda: render_buffered(stream, chunks, interval))):
+            start = time.perf_counter()
+            writes = render()
+            elapsed = time.perf_counter() - start
+            results.append((name, len(chunks) / elapsed, writes))
+    finally:
+        close()
+    print(f"\n{label} ({len(chunks)} 个chunk)")
+    print(f"  {'':<22}{'chunk/秒':>12}{'写出次数':>10}")
+    for name, rate, writes in results:
+        print(f"  {name:<22}{rate:>12.0f}{writes:>10}")
+    print(f"  提升: {results[1][1] / results[0][1]:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式输出渲染基准")
+    parser.add_argument("--chunks", type=int, default=20000, help="每种内容的chunk数")
+    parser.add_argument("--interval-ms", type=float, default=16, help="StreamRenderer 的刷新间隔(毫秒)")
+    args = parser.parse_args()
+    interval = args.interval_ms / 1000
+    run("普通文本 (每100个chunk换行)", make_chunks(args.chunks, 100), interval)
+    run("代码 (每8个chunk换行)", make_chunks(args.chunks, 8), interval)
+
+
+if __name__ == "__main__":
+    main()
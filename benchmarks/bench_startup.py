@@ -0,0 +1,81 @@
+#bench_startup
+"""启动耗时基准测试
+
+用 python -X importtime 分别测量:
+  1. 导入命令行入口 AI_CLI_Command_handler (到出现命令提示符前的导入开销)
+  2. 导入 AI_client_service (load_ai_client 时才需要的openai等依赖)
+并按累计耗时列出最慢的模块。另外测量从启动进程到打印命令提示符的实际时间。
+
+用法: python benchmarks/bench_startup.py [--runs N] [--top N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPT = b"Please input your command"
+
+
+def import_times(module: str):
+    """返回 (总耗时微秒, [(累计微秒, 自身微秒, 模块名), ...])"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    total = next(cumulative for cumulative, _, name in reversed(rows) if name.strip() == module)
+    return total, rows
+
+
+def time_to_prompt(env_extra=None) -> float:
+    """启动交互程序,返回打印出第一个命令提示符所用的秒数"""
+    env = dict(os.environ, **(env_extra or {}))
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "AI_CLI_Command_handler.py"],
+        cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    output = b""
+    while PROMPT not in output:
+        chunk = proc.stdout.read1(4096)
+        if not chunk:
+            break
+        output += chunk
+    elapsed = time.perf_counter() - start
+    proc.communicate(b"exit\n")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepMiniClient 启动耗时基准")
+    parser.add_argument("--runs", type=int, default=5, help="每项测量的次数,取中位数")
+    parser.add_argument("--top", type=int, default=15, help="列出累计耗时最长的模块数")
+    args = parser.parse_args()
+
+    for module in ("AI_CLI_Command_handler", "AI_client_service"):
+        totals = []
+        rows = []
+        for _ in range(args.runs):
+            total, rows = import_times(module)
+            totals.append(total)
+        print(f"\nimport {module}: 中位数 {statistics.median(totals) / 1000:.1f} ms ({args.runs}次)")
+        print(f"  {'累计(ms)':>10} {'自身(ms)':>10}  模块")
+        for cumulative, self_us, name in sorted(rows, reverse=True)[:args.top]:
+            print(f"  {cumulative / 1000:>10.1f} {self_us / 1000:>10.1f}  {name}")
+
+    print("\n启动到出现命令提示符:")
+    for label, env in (("后台预热", {}), ("不预热", {"DEEPMINI_NO_WARMUP": "1"})):
+        samples = [time_to_prompt(env) for _ in range(args.runs)]
+        print(f"  {label}: 中位数 {statistics.median(samples) * 1000:.1f} ms, 最小 {min(samples) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
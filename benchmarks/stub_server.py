@@ -0,0 +1,201 @@
+#stub_server
+"""本地 OpenAI 兼容的模拟服务
+
+实现 POST /v1/chat/completions 的非流式和SSE流式两种响应,不调用真实API,
+用于离线测量客户端自身的开销。可配置:
+  --latency        收到请求到发出第一个token前的延迟(毫秒)
+  --tokens         每个回复的token数(每个token是一个短词)
+  --token-rate     流式输出速度(token/秒),0 表示不限速
+  --error-rate     按比例随机返回错误
+  --error-status   注入错误的HTTP状态码(429时附带 Retry-After)
+响应带有 usage 字段;流式请求设置 stream_options.include_usage 时在 [DONE] 前发送用量块。
+
+用法: python benchmarks/stub_server.py [--port 8765] [--latency 200] [--token-rate 50] ...
+也可在进程内使用: with StubServer(latency=0.2) as server: ... server.base_url
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+WORDS = ("hello", "world", "模拟", "回复", "token", "stream", "测试", "client")
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出,不关闭Nagle算法时复用的连接上每个响应会等待对方的延迟确认(约40ms)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server: "StubServer" = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+        server.count_request()
+        if server.should_fail():
+            headers = {"Retry-After": "1"} if server.error_status == 429 else {}
+            self._send_json(server.error_status, {"error": {"message": "injected error", "type": "stub_error"}}, headers)
+            return
+        if server.latency > 0:
+            time.sleep(server.latency)
+        tokens = server.reply_tokens()
+        model = body.get("model", "stub-model")
+        usage = server.usage(body.get("messages") or [], len(tokens))
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            self._send_stream(model, tokens, usage if include_usage else None, server.token_rate)
+        else:
+            self._send_json(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_event(self, payload: Dict[str, Any]):
+        self._write_chunk(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+
+    def _send_stream(self, model: str, tokens, usage, token_rate: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        interval = 1.0 / token_rate if token_rate > 0 else 0
+        start = time.perf_counter()
+        try:
+            for i, token in enumerate(tokens):
+                if interval:
+                    # 按绝对时间排程,避免 sleep 误差累积
+                    delay = start + i * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                self._send_event(dict(chunk, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}]))
+            self._send_event(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            if usage is not None:
+                self._send_event(dict(chunk, choices=[], usage=usage))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前关闭了流
+            self.close_connection = True
+
+
+class StubServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, tokens: int = 64,
+                 token_rate: float = 0.0, error_rate: float = 0.0, error_status: int = 500, seed: int = 0):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def should_fail(self) -> bool:
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def reply_tokens(self):
+        return [WORDS[i % len(WORDS)] + " " for i in range(self.tokens)]
+
+    def usage(self, messages, completion_tokens: int) -> Dict[str, int]:
+        prompt_chars = sum(len(str(m.get("content") or "")) for m in messages)
+        prompt_tokens = max(1, prompt_chars // 4)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": 0,
+            "prompt_cache_miss_tokens": prompt_tokens
+        }
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程中运行,直到 KeyboardInterrupt"""
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="首个token前的延迟(毫秒)")
+    parser.add_argument("--tokens", type=int, default=64, help="每个回复的token数")
+    parser.add_argument("--token-rate", type=float, default=0, help="流式输出速度(token/秒),0为不限速")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回错误的比例(0-1)")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的HTTP状态码")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    server = StubServer(args.host, args.port, args.latency / 1000, args.tokens, args.token_rate,
+                        args.error_rate, args.error_status, args.seed)
+    print(f"模拟服务已启动: {server.base_url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+#client_daemon
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+# 客户端部分只使用标准库; AI_client_service (openai/httpx) 只在守护进程中导入,
+# 单次调用的开销只有解释器启动和一次本地连接
+
+# 守护进程地址,优先于默认地址
+DAEMON_ADDRESS_ENV = "DEEPMINI_DAEMON"
+DEFAULT_TCP_PORT = 8770
+# 表示一次请求结束的响应类型
+_FINAL_TYPES = ("complete", "truncated", "error", "status", "stopping")
+
+
+def user_dir() -> str:
+    """只有当前用户可以访问的目录,存放套接字文件和TCP令牌
+
+    POSIX 系统优先使用 $XDG_RUNTIME_DIR,否则在临时目录下创建 deepmini-<uid> (权限0700),
+    目录不属于当前用户或其他用户可以访问时拒绝使用,防止其他用户抢先创建同名的套接字;
+    Windows 使用 %LOCALAPPDATA% (用户目录本身只有当前用户可以访问)。
+    """
+    if not hasattr(os, "getuid"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        path = os.path.join(base, "DeepMiniClient")
+        os.makedirs(path, exist_ok=True)
+        return path
+    uid = os.getuid()
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        path = os.path.join(runtime_dir, "deepmini")
+    else:
+        path = os.path.join(tempfile.gettempdir(), f"deepmini-{uid}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid or st.st_mode & 0o077:
+        raise PermissionError(f"目录 {path} 不属于当前用户或其他用户可以访问,拒绝使用")
+    return path
+
+
+def default_address() -> str:
+    """守护进程的默认地址
+
+    支持Unix域套接字时为 user_dir() 下按当前工作目录区分的套接字文件
+    (配置和对话历史都相对工作目录),否则为本机TCP端口。
+    """
+    address = os.environ.get(DAEMON_ADDRESS_ENV)
+    if address:
+        return address
+    if hasattr(socket, "AF_UNIX"):
+        digest = hashlib.sha1(os.path.abspath(os.getcwd()).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(user_dir(), f"{digest}.sock")
+    return f"127.0.0.1:{DEFAULT_TCP_PORT}"
+
+
+def token_path(port: int) -> str:
+    """TCP监听时的访问令牌文件"""
+    return os.path.join(user_dir(), f"daemon-{port}.token")
+
+
+def read_token(port: int) -> str:
+    with open(token_path(port), 'r', encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def _check_socket_owner(path: str):
+    """套接字文件必须属于当前用户,否则可能是其他用户伪造的监听"""
+    if not hasattr(os, "getuid"):
+        return
+    st = os.lstat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{path} 不是当前用户的套接字,拒绝使用")
+
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """返回 (地址族, 套接字地址): "host:port" 为TCP,其余为Unix域套接字路径"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address and "\\" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError(f"当前平台不支持Unix域套接字,请使用 host:port 形式的地址: {address}")
+    return socket.AF_UNIX, address
+
+
+def connect(address: Optional[str] = None, timeout: Optional[float] = None) -> socket.socket:
+    family, sockaddr = parse_address(address or default_address())
+    if family != socket.AF_INET:
+        _check_socket_owner(sockaddr)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(sockaddr)
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def request(payload: Dict[str, Any], address: Optional[str] = None,
+            timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """向守护进程发送一个请求,逐个返回响应
+
+    协议为JSON Lines: 每行一个UTF-8编码的JSON对象。流式对话依次返回 chunk 事件
+    ({"type": "chunk", "content": 增量}),最后是 complete / truncated / error 之一。
+    TCP连接时附带守护进程写在 user_dir() 中的令牌。连接失败时抛出 OSError。
+    """
+    address = address or default_address()
+    family, sockaddr = parse_address(address)
+    if family == socket.AF_INET:
+        payload = dict(payload, token=read_token(sockaddr[1]))
+    with connect(address, timeout) as sock:
+        sock.sendall(json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n")
+        with sock.makefile('rb') as reader:
+            for line in reader:
+                response = json.loads(line)
+                yield response
+                if response.get("type") in _FINAL_TYPES:
+                    return
+    raise ConnectionError("守护进程在响应结束前关闭了连接")
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """处理一个连接上的请求,每行一个"""
+
+    def handle(self):
+        daemon: ClientDaemon = self.server.client_daemon
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                payload = json.loads(line)
+                if not isinstance(payload, dict):
+                    raise ValueError("请求必须是JSON对象")
+            except ValueError as e:
+                self.send({"type": "error", "content": f"无效的请求: {e}"})
+                continue
+            if not daemon.dispatch(payload, self.send):
+                break
+
+    def send(self, response: Dict[str, Any]):
+        self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+class ClientDaemon:
+    """常驻的客户端服务进程
+
+    按配置文件名保留 AIClientService (连接池、已读取的配置、内存中的对话历史),
+    在Unix域套接字或本机TCP端口上以JSON Lines协议接受请求。
+    同一配置的对话按到达顺序依次执行,不同配置之间互不等待。
+    """
+
+    def __init__(self, address: Optional[str] = None, default_config: str = "config.json"):
+        self.address = address or default_address()
+        self.default_config = default_config
+        self.started = time.time()
+        self.requests = 0
+        self._services: Dict[str, Tuple[Any, threading.Lock]] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.BaseServer] = None
+        # TCP监听时要求的访问令牌及其文件,Unix域套接字由文件权限限制访问
+        self._token: Optional[str] = None
+        self._token_path: Optional[str] = None
+
+    def _service(self, config_name: str) -> Tuple[Any, threading.Lock]:
+        """返回配置对应的 (客户端服务, 对话锁),首次使用时创建"""
+        if not config_name or os.path.basename(config_name) != config_name:
+            raise ValueError(f"配置文件名无效: {config_name}")
+        with self._lock:
+            entry = self._services.get(config_name)
+            if entry is None:
+                config_path = os.path.join("AI_configs", config_name)
+                if not os.path.exists(config_path):
+                    raise ValueError(f"配置文件不存在: {config_path}")
+                from AI_client_service import AIClientService
+                entry = self._services[config_name] = (AIClientService(config_path), threading.Lock())
+                print(f"已加载配置: {config_path}")
+            return entry
+
+    def dispatch(self, payload: Dict[str, Any], send) -> bool:
+        """执行一个请求,通过 send 返回响应; 返回是否继续读取该连接上的请求"""
+        if self._token is not None and not hmac.compare_digest(str(payload.get("token", "")), self._token):
+            try:
+                send({"type": "error", "content": "访问令牌无效"})
+            except OSError:
+                pass
+            return False
+        op = payload.get("op", "chat")
+        try:
+            if op == "chat":
+                return self._chat(payload, send)
+            if op == "status":
+                send(self.status())
+            elif op == "stop":
+                send({"type": "stopping"})
+                self.stop()
+                return False
+            else:
+                send({"type": "error", "content": f"未知的操作: {op}"})
+        except OSError:
+            # 客户端已断开
+            return False
+        except Exception as e:
+            send({"type": "error", "content": str(e)})
+        return True
+
+    def _chat(self, payload: Dict[str, Any], send) -> bool:
+        prompt = payload.get("prompt")
+        if not isinstance(prompt, str) or not prompt:
+            send({"type": "error", "content": "请提供要发送的消息 (prompt)"})
+            return True
+        service, lock = self._service(payload.get("config") or self.default_config)
+        use_history = payload.get("history", True)
+        with self._lock:
+            self.requests += 1
+        with lock:
+            stream = payload.get("stream")
+            if stream is None:
+                stream = service.read_config()["stream"]
+            if not stream:
+                result = service.usr_request(prompt, stream=False, use_history=use_history)
+                if result["success"]:
+                    send({"type": "complete", "content": result["data"]})
+                else:
+                    send({"type": "error", "content": result["error"]})
+                return True
+            events = service.usr_request(prompt, stream=True, use_history=use_history)
+            connected = True
+            try:
+                for event in events:
+                    if connected:
+                        response = {"type": event.type, "content": event.content}
+                        if event.reason is not None:
+                            response["reason"] = event.reason
+                        try:
+                            send(response)
+                        except OSError:
+                            connected = False
+                    # 客户端断开时取消请求(保留已收到的部分); 已是最后一个事件时继续执行,保存本轮对话
+                    if not connected and not event.done:
+                        break
+            finally:
+                events.close()
+            return connected
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            services = dict(self._services)
+        configs = {}
+        for name, (service, _) in services.items():
+            summary = service.get_conversation_summary()
+            configs[name] = {"total_turns": summary["total_turns"], "requests": summary.get("requests", 0)}
+        return {"type": "status", "pid": os.getpid(), "address": self.address,
+                "uptime": time.time() - self.started, "requests": self.requests, "configs": configs}
+
+    def _bind(self) -> socketserver.BaseServer:
+        family, sockaddr = parse_address(self.address)
+        if family == socket.AF_INET:
+            server = _TCPServer(sockaddr, _RequestHandler)
+            self._token = secrets.token_hex(32)
+            try:
+                # 按实际监听的端口命名(地址中端口为0时由系统分配)
+                self._token_path = token_path(server.server_address[1])
+                fd = os.open(self._token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w', encoding="utf-8") as f:
+                    f.write(self._token)
+            except BaseException:
+                server.server_close()
+                raise
+            host, port = server.server_address[:2]
+            self.address = f"{host}:{port}"
+        else:
+            if os.path.lexists(sockaddr):
+                # 不属于当前用户时抛出 PermissionError,不连接也不删除
+                _check_socket_owner(sockaddr)
+                try:
+                    connect(self.address, timeout=1).close()
+                except OSError:
+                    # 上次异常退出留下的套接字文件
+                    os.remove(sockaddr)
+                else:
+                    raise RuntimeError(f"守护进程已在运行: {self.address}")
+            server = _UnixServer(sockaddr, _RequestHandler)
+            # 只允许当前用户连接
+            os.chmod(sockaddr, 0o600)
+        server.client_daemon = self
+        return server
+
+    def serve_forever(self):
+        """在当前线程中运行,直到 stop()、SIGTERM 或 Ctrl+C"""
+        self._server = self._bind()
+        # 预先加载默认配置(导入openai等依赖),第一个请求不必等待
+        if os.path.exists(os.path.join("AI_configs", self.default_config)):
+            self._service(self.default_config)
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGTERM"):
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        print(f"守护进程已启动: {self.address} (pid {os.getpid()})", flush=True)
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def stop(self):
+        """停止接受请求,可从任意线程调用"""
+        server = self._server
+        if server is not None:
+            threading.Thread(target=server.shutdown, name="daemon-stop", daemon=True).start()
+
+    def close(self):
+        """关闭监听套接字,写完各配置的对话历史并释放连接"""
+        if self._server is not None:
+            self._server.server_close()
+            family, sockaddr = parse_address(self.address)
+            try:
+                os.remove(self._token_path if family == socket.AF_INET else sockaddr)
+            except OSError:
+                pass
+            self._server = None
+        with self._lock:
+            services, self._services = self._services, {}
+        for service, lock in services.values():
+            with lock:
+                service.close()
+        print("守护进程已停止")
+
+
+def oneshot(prompt: str, config: Optional[str] = None, stream: Optional[bool] = None,
+            use_history: bool = True, address: Optional[str] = None) -> int:
+    """通过守护进程发送一条消息,回复写到标准输出,返回退出码"""
+    from stream_renderer import StreamRenderer
+    payload = {"op": "chat", "prompt": prompt, "stream": stream, "history": use_history}
+    if config:
+        payload["config"] = config
+    streamed = False
+    try:
+        # 默认目录不安全时 default_address() 抛出 PermissionError
+        address = address or default_address()
+        with StreamRenderer(sys.stdout) as renderer:
+            for response in request(payload, address):
+                kind = response.get("type")
+                if kind == "chunk":
+                    streamed = True
+                    renderer.write(response["content"])
+                elif kind in ("complete", "truncated"):
+                    if not streamed:
+                        renderer.write(response["content"])
+                    renderer.write("\n")
+                    if kind == "truncated":
+                        print(f"响应已中断: {response.get('reason')}", file=sys.stderr)
+                        return 1
+                    return 0
+                elif kind == "error":
+                    print(f"错误: {response.get('content')}", file=sys.stderr)
+                    return 1
+    except OSError as e:
+        print(f"无法连接守护进程 ({address or '默认地址'}): {e}\n"
+              f"请先运行: python AI_CLI_Command_handler.py --daemon", file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        # 断开连接即取消请求
+        return 130
+    return 1
+
+
+def main(argv=None) -> int:
+    """命令行参数入口: --daemon / --oneshot / --daemon-status / --daemon-stop"""
+    parser = argparse.ArgumentParser(prog="AI_CLI_Command_handler.py", description="DeepMiniClient 守护进程与单次调用")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--daemon", action="store_true", help="启动常驻的守护进程")
+    mode.add_argument("--oneshot", metavar="PROMPT", help="通过守护进程发送一条消息,'-' 表示从标准输入读取")
+    mode.add_argument("--daemon-status", action="store_true", help="显示守护进程状态")
+    mode.add_argument("--daemon-stop", action="store_true", help="停止守护进程")
+    parser.add_argument("--config", help="配置文件名 (AI_configs/下),守护进程默认 config.json")
+    parser.add_argument("--address", help=f"Unix域套接字路径或 host:port,默认按当前目录生成,也可用环境变量 {DAEMON_ADDRESS_ENV} 指定")
+    stream = parser.add_mutually_exclusive_group()
+    stream.add_argument("--stream", dest="stream", action="store_true", default=None, help="流式输出")
+    stream.add_argument("--no-stream", dest="stream", action="store_false", help="非流式输出")
+    parser.add_argument("--no-history", action="store_true", help="不携带也不记录对话历史")
+    args = parser.parse_args(argv)
+
+    if args.daemon:
+        try:
+            ClientDaemon(args.address, args.config or "config.json").serve_forever()
+        except (RuntimeError, ValueError, OSError) as e:
+            print(f"守护进程启动失败: {e}", file=sys.stderr)
+            return 1
+        return 0
+    if args.oneshot is not None:
+        prompt = sys.stdin.read().rstrip("\r\n") if args.oneshot == "-" else args.oneshot
+        return oneshot(prompt, args.config, args.stream, not args.no_history, args.address)
+    address = args.address
+    try:
+        address = address or default_address()
+        response = next(request({"op": "status" if args.daemon_status else "stop"}, address, timeout=5))
+    except OSError as e:
+        print(f"无法连接守护进程 ({address or '默认地址'}): {e}", file=sys.stderr)
+        return 2
+    if args.daemon_status:
+        print(json.dumps(response, ensure_ascii=False, indent=2))
+    else:
+        print("守护进程正在停止")
+    return 0
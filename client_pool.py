@@ -0,0 +1,49 @@
+#client_pool
+import threading
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class SharedClientPool:
+    """进程内按连接签名共享的客户端池
+
+    签名由端点地址、API密钥和连接参数组成,签名相同的多个客户端服务
+    (例如同一进程中的多个会话)共用一个客户端及其HTTP连接池。
+    按引用计数管理,最后一个使用者释放时才关闭客户端。
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, List[Any]] = {}  # 签名 -> [客户端, 引用数]
+        self._lock = threading.Lock()
+
+    def acquire(self, signature: Hashable, factory: Callable[[], Any]) -> Any:
+        """取得签名对应的客户端(不存在时用 factory 创建),引用数加一"""
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None:
+                entry = self._entries[signature] = [factory(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, signature: Hashable):
+        """引用数减一,归零时关闭客户端"""
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._entries[signature]
+        try:
+            entry[0].close()
+        except Exception:
+            pass
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各共享客户端的端点地址和引用数"""
+        with self._lock:
+            return [{"base_url": signature[0], "refs": refs} for signature, (_, refs) in self._entries.items()]
+
+
+# 同步客户端在进程内共享; 异步客户端绑定事件循环,仍由各服务自行管理
+shared_clients = SharedClientPool()
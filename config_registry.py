@@ -0,0 +1,121 @@
+#config_registry
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# 配置目录下的元数据索引文件,以点开头,列出配置文件时会跳过
+INDEX_FILENAME = ".config_index.json"
+INDEX_VERSION = 1
+
+
+def file_signature(path: str) -> Tuple[int, int]:
+    """文件签名 (mtime纳秒, 大小),签名不变即认为内容未变"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def config_summary(config: Dict[str, Any]) -> Dict[str, Any]:
+    """列出配置时需要的元数据,不包含密钥本身"""
+    return {
+        "model": config.get("model", "未知"),
+        "has_api_key": bool(config.get("api_key") or any(ep.get("key") or ep.get("api_key")
+                                                           for ep in config.get("endpoints") or []
+                                                           if isinstance(ep, dict)))
+    }
+
+
+class ConfigRegistry:
+    """进程内共享的配置文件注册表
+
+    按绝对路径缓存解析后的配置,并记录 (mtime, size) 签名,
+    文件未变化时直接返回缓存,变化后才重新解析。
+    返回的字典由所有调用方共享,只能读取,需要修改时先复制。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> Tuple[Dict[str, Any], Tuple[int, int]]:
+        """返回 (配置内容, 文件签名); 文件不存在或JSON格式错误时抛出异常"""
+        key = os.path.abspath(path)
+        signature = file_signature(key)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == signature:
+            return entry[1], signature
+        with open(key, 'r', encoding="utf-8") as f:
+            data = json.load(f)
+        # 读取期间文件可能又被修改,以读取后的签名为准,下次调用会再次检查
+        signature = file_signature(key)
+        with self._lock:
+            self._entries[key] = (signature, data)
+        return data, signature
+
+    def invalidate(self, path: Optional[str] = None):
+        """丢弃指定文件(不指定时为全部)的缓存"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def list_directory(self, config_dir: str) -> List[Dict[str, Any]]:
+        """列出目录下的配置文件及其模型、密钥状态
+
+        元数据持久化在目录下的索引文件中,签名未变的文件直接使用索引,
+        只有新增或修改过的文件才会被解析,索引有变化时原子写回。
+        """
+        index_path = os.path.join(config_dir, INDEX_FILENAME)
+        index = self._read_index(index_path)
+        files = {}
+        result = []
+        changed = False
+        with os.scandir(config_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.name.startswith(".") or not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                signature = [st.st_mtime_ns, st.st_size]
+                meta = index.get(entry.name)
+                if meta is None or meta.get("signature") != signature:
+                    try:
+                        config, _ = self.load(entry.path)
+                        meta = dict(config_summary(config), signature=signature, error=False)
+                    except Exception:
+                        meta = {"signature": signature, "error": True}
+                    changed = True
+                files[entry.name] = meta
+                result.append(dict(meta, file=entry.name))
+        if changed or len(files) != len(index):
+            self._write_index(index_path, files)
+        return result
+
+    @staticmethod
+    def _read_index(index_path: str) -> Dict[str, Any]:
+        try:
+            with open(index_path, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                return data.get("files", {})
+        except (OSError, ValueError, AttributeError):
+            pass
+        return {}
+
+    @staticmethod
+    def _write_index(index_path: str, files: Dict[str, Any]):
+        try:
+            directory = os.path.dirname(index_path) or "."
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=INDEX_FILENAME + ".", suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "files": files}, f, ensure_ascii=False)
+            os.replace(temp_path, index_path)
+        except OSError:
+            # 索引只是加速手段,目录只读时下次重新解析即可
+            pass
+
+
+# 进程内共享的默认注册表
+registry = ConfigRegistry()
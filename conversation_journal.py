@@ -0,0 +1,151 @@
+#conversation_journal
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 进程的 umask 只能通过设置来读取,在导入时(尚未启动其他线程)读取一次
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def mkstemp_beside(path: str) -> Tuple[int, str]:
+    """在 path 所在目录创建临时文件,返回 (fd, 临时文件路径),写完后用 os.replace 替换 path
+
+    mkstemp 创建的文件权限为0600,改为普通新建文件的权限(0666去掉umask),
+    替换后其他用户(如以其他用户运行的指标采集程序)仍能像直接写入时一样读取。
+    """
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    if hasattr(os, "fchmod"):
+        os.fchmod(fd, 0o666 & ~_UMASK)
+    return fd, temp_path
+
+
+def is_journal_file(filename: str) -> bool:
+    """按扩展名判断是否为JSONL日志格式的对话文件"""
+    return bool(filename) and filename.lower().endswith(".jsonl")
+
+
+class ConversationJournal:
+    """追加写入的JSONL对话日志
+
+    文件格式: 第一行为 {"metadata": {...}} 快照头,之后每行一条消息。
+    每轮只追加新的user/assistant消息,fsync按轮数或时间间隔批量执行。
+    """
+
+    def __init__(self, path: str, fsync_turns: int = 8, fsync_interval: float = 5.0):
+        self.path = path
+        self.fsync_turns = max(1, int(fsync_turns))
+        self.fsync_interval = float(fsync_interval)
+        self._file = None
+        self._unsynced_turns = 0
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding="utf-8", newline="\n")
+        return self._file
+
+    def append(self, messages: List[Dict[str, Any]]):
+        """追加一组消息,一次write写入,按批次fsync"""
+        if not messages:
+            return
+        data = "".join(json.dumps(msg, ensure_ascii=False) + "\n" for msg in messages)
+        f = self._open()
+        f.write(data)
+        f.flush()
+        self._unsynced_turns += 1
+        if (self._unsynced_turns >= self.fsync_turns
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        """将已写入的内容fsync到磁盘"""
+        if self._file is not None and self._unsynced_turns:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced_turns = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self.sync()
+            finally:
+                self._file.close()
+                self._file = None
+
+    def write_snapshot(self, metadata: Dict[str, Any], messages: List[Dict[str, Any]]):
+        """压缩日志: 用完整快照原子地替换日志文件(临时文件 + rename)"""
+        self.close()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 临时文件名唯一,多个服务实例同时写同一文件时互不干扰
+        fd, temp_path = mkstemp_beside(self.path)
+        with os.fdopen(fd, 'w', encoding="utf-8", newline="\n") as f:
+            f.write(json.dumps({"metadata": metadata}, ensure_ascii=False) + "\n")
+            for msg in messages:
+                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def records(f, offset: int = 0) -> Iterator[Tuple[int, int, Optional[Dict[str, Any]]]]:
+        """从二进制文件 f 的当前位置(偏移 offset)逐行解析,产生 (行起始偏移, 行结束偏移, 记录)
+
+        空行的记录为 None; 遇到不完整或无法解析的行时停止。
+        """
+        for raw_line in f:
+            line_end = offset + len(raw_line)
+            if not raw_line.endswith(b"\n"):
+                return
+            line = raw_line.strip()
+            record = None
+            if line:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except (ValueError, UnicodeDecodeError):
+                    return
+            yield offset, line_end, record
+            offset = line_end
+
+    @staticmethod
+    def read(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]], int]:
+        """读取日志并修复崩溃留下的残缺尾部
+
+        返回 (metadata, messages, 截断的字节数)。最后一行不完整或无法解析、
+        以及末尾缺少回复的user消息都会被截掉,保证文件只包含完整的对话轮次。
+        """
+        metadata: Dict[str, Any] = {}
+        messages: List[Dict[str, Any]] = []
+        good_offset = 0
+        turn_offset = 0
+        with open(path, 'rb') as f:
+            for _, line_end, record in ConversationJournal.records(f):
+                if record is None:
+                    good_offset = line_end
+                    continue
+                if "metadata" in record and "role" not in record:
+                    metadata = record["metadata"]
+                else:
+                    messages.append(record)
+                good_offset = line_end
+                if record.get("role") != "user":
+                    turn_offset = line_end
+            file_size = os.fstat(f.fileno()).st_size
+        # 末尾只有user消息说明该轮的回复没有写完
+        if messages and messages[-1].get("role") == "user":
+            while messages and messages[-1].get("role") == "user":
+                messages.pop()
+            good_offset = turn_offset
+        truncated = file_size - good_offset
+        if truncated > 0:
+            os.truncate(path, good_offset)
+        return metadata, messages, truncated
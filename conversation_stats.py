@@ -0,0 +1,114 @@
+#conversation_stats
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class ConversationStats:
+    """对话历史的累计统计,随消息追加增量更新,查询为常数时间
+
+    消息数和字符数覆盖整个对话历史(加载文件时重建一次);
+    token用量和延迟只统计本次会话中实际发出的请求。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.messages = 0
+        self.characters = 0
+        self.roles: Dict[str, Dict[str, int]] = {}
+        self.last_user_message = None
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # 服务端前缀缓存命中的提示词token,只统计返回了缓存用量的请求
+        self.cache_hit_tokens = 0
+        self.cache_miss_tokens = 0
+        self.last_cache_hit_ratio = None
+        self.ttft_total = 0.0
+        self.duration_total = 0.0
+        self.generation_tokens = 0
+        self.generation_time = 0.0
+        # 滚动摘要节省的提示词token(估算)
+        self.summary_turns = 0
+        self.summary_saved_tokens = 0
+        self.last_summary_saved_tokens = None
+
+    def rebuild(self, messages: Iterable[Dict[str, Any]]):
+        """加载历史文件后从头统计消息,请求相关的累计值一并清零"""
+        self.reset()
+        for message in messages:
+            self.add_message(message)
+
+    def rebuild_counts(self, role_stats: Dict[str, Tuple[int, int]], last_user_message: Optional[str]):
+        """按各角色的 (消息数, 字符数) 重建消息统计,用于只加载了部分消息内容的历史(见 HistoryIndex.role_stats)"""
+        self.reset()
+        for role, (messages, characters) in role_stats.items():
+            self.messages += messages
+            self.characters += characters
+            self.roles[role] = {"messages": messages, "characters": characters}
+        self.last_user_message = last_user_message
+
+    def add_message(self, message: Dict[str, Any]):
+        role = message.get("role", "")
+        content = message.get("content") or ""
+        self.messages += 1
+        self.characters += len(content)
+        role_stats = self.roles.get(role)
+        if role_stats is None:
+            role_stats = self.roles[role] = {"messages": 0, "characters": 0}
+        role_stats["messages"] += 1
+        role_stats["characters"] += len(content)
+        if role == "user":
+            self.last_user_message = content
+
+    def add_request(self, sample: Optional[Dict[str, float]]):
+        """记录一次请求的指标(RequestContext.finish 的返回值),缓存命中等没有指标时为 None"""
+        if not sample:
+            return
+        self.requests += 1
+        self.prompt_tokens += int(sample.get("prompt_tokens", 0))
+        self.completion_tokens += int(sample.get("completion_tokens", 0))
+        if "prompt_cache_hit_tokens" in sample:
+            hit = int(sample["prompt_cache_hit_tokens"])
+            miss = int(sample.get("prompt_cache_miss_tokens", 0))
+            self.cache_hit_tokens += hit
+            self.cache_miss_tokens += miss
+            self.last_cache_hit_ratio = hit / (hit + miss) if hit + miss else None
+        self.ttft_total += sample.get("ttft") or 0.0
+        self.duration_total += sample.get("duration", 0.0)
+        tokens_per_sec = sample.get("tokens_per_sec", 0.0)
+        if tokens_per_sec > 0:
+            # 按总token数/总生成时间计算平均速度,避免短回复的速度权重过大
+            self.generation_tokens += int(sample.get("completion_tokens", 0))
+            self.generation_time += sample.get("completion_tokens", 0) / tokens_per_sec
+
+    def add_summary_saving(self, saved_tokens: int):
+        """记录一轮对话中用摘要代替原文节省的提示词token数(可能为负)"""
+        self.summary_turns += 1
+        self.summary_saved_tokens += saved_tokens
+        self.last_summary_saved_tokens = saved_tokens
+
+    def summary(self) -> Dict[str, Any]:
+        requests = self.requests
+        cached = self.cache_hit_tokens + self.cache_miss_tokens
+        return {
+            "total_turns": self.messages // 2,
+            "total_messages": self.messages,
+            "total_characters": self.characters,
+            "last_user_message": self.last_user_message,
+            "roles": {role: dict(stats) for role, stats in self.roles.items()},
+            "requests": requests,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "prompt_cache_hit_tokens": self.cache_hit_tokens,
+            "prompt_cache_miss_tokens": self.cache_miss_tokens,
+            "prompt_cache_hit_ratio": self.cache_hit_tokens / cached if cached else None,
+            "last_prompt_cache_hit_ratio": self.last_cache_hit_ratio,
+            "avg_ttft": self.ttft_total / requests if requests else None,
+            "avg_duration": self.duration_total / requests if requests else None,
+            "avg_tokens_per_sec": self.generation_tokens / self.generation_time if self.generation_time > 0 else None,
+            "summary_turns": self.summary_turns,
+            "summary_saved_tokens": self.summary_saved_tokens,
+            "last_summary_saved_tokens": self.last_summary_saved_tokens
+        }
@@ -0,0 +1,106 @@
+#endpoint_pool
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class Endpoint:
+    """单个API端点及其健康状态"""
+
+    def __init__(self, base_url: str, api_key: str, weight: float = 1.0):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.weight = max(float(weight), 0.01)
+        self.ewma_ttft = None          # 首token时间的指数加权平均(秒)
+        self.ewma_error = 0.0          # 错误率的指数加权平均
+        self.consecutive_failures = 0
+        self.open_until = 0.0          # 熔断打开到该时刻(monotonic)
+        self.requests = 0
+        self.failures = 0
+        self.last_error = ""
+
+    def is_open(self, now: float) -> bool:
+        return self.open_until > now
+
+    def score(self, default_ttft: float) -> float:
+        """分数越低越优先: 延迟按错误率放大,再按权重缩小"""
+        latency = self.ewma_ttft if self.ewma_ttft is not None else default_ttft
+        return latency * (1.0 + 4.0 * self.ewma_error) / self.weight
+
+
+class EndpointPool:
+    """多端点池: 按首token延迟和错误率的EWMA选择最快最健康的端点
+
+    连续失败达到阈值的端点会熔断,冷却时间过后重新参与选择(半开),
+    再次失败立即重新熔断,成功则恢复。
+    """
+
+    def __init__(self, endpoints: Iterable[Dict[str, Any]], alpha: float = 0.3,
+                 failure_threshold: int = 3, cooldown: float = 30.0, explore_ratio: float = 0.05):
+        self.endpoints = [Endpoint(ep["base_url"], ep["api_key"], ep.get("weight", 1.0)) for ep in endpoints]
+        self.alpha = alpha
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = cooldown
+        self.explore_ratio = explore_ratio
+        self._lock = threading.Lock()
+
+    def select(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """选择本次请求使用的端点, exclude 中是本次请求已失败的端点"""
+        with self._lock:
+            now = time.monotonic()
+            excluded = set(id(ep) for ep in exclude)
+            candidates = [ep for ep in self.endpoints if id(ep) not in excluded] or self.endpoints
+            healthy = [ep for ep in candidates if not ep.is_open(now)]
+            if not healthy:
+                # 全部熔断时选择最早恢复的端点,而不是直接失败
+                return min(candidates, key=lambda ep: ep.open_until)
+            if len(healthy) > 1 and random.random() < self.explore_ratio:
+                # 少量按权重随机探索,保持各端点的延迟统计不过时
+                return random.choices(healthy, weights=[ep.weight for ep in healthy])[0]
+            # 没有数据的端点按0延迟处理,保证每个端点都会被尝试一次
+            return min(healthy, key=lambda ep: ep.score(0.0))
+
+    def record_success(self, endpoint: Endpoint, ttft: float):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.consecutive_failures = 0
+            endpoint.open_until = 0.0
+            if endpoint.ewma_ttft is None:
+                endpoint.ewma_ttft = ttft
+            else:
+                endpoint.ewma_ttft += self.alpha * (ttft - endpoint.ewma_ttft)
+            endpoint.ewma_error *= (1.0 - self.alpha)
+
+    def record_failure(self, endpoint: Endpoint, error: str = "", new_request: bool = True):
+        with self._lock:
+            if new_request:
+                endpoint.requests += 1
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.last_error = error
+            endpoint.ewma_error += self.alpha * (1.0 - endpoint.ewma_error)
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+
+    def has_alternative(self, tried: Iterable[Endpoint]) -> bool:
+        """是否还有未尝试且未熔断的端点可以立即切换"""
+        now = time.monotonic()
+        tried_ids = set(id(ep) for ep in tried)
+        return any(id(ep) not in tried_ids and not ep.is_open(now) for ep in self.endpoints)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """返回各端点的实时延迟与健康状态"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "base_url": ep.base_url,
+                "weight": ep.weight,
+                "ewma_ttft": ep.ewma_ttft,
+                "error_rate": ep.ewma_error,
+                "requests": ep.requests,
+                "failures": ep.failures,
+                "state": "open" if ep.is_open(now) else ("half-open" if ep.consecutive_failures >= self.failure_threshold else "closed"),
+                "cooldown_left": max(0.0, ep.open_until - now),
+                "last_error": ep.last_error
+            } for ep in self.endpoints]
@@ -0,0 +1,389 @@
+#history_archive
+import gzip
+import json
+import os
+import time
+import zlib
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from conversation_journal import ConversationJournal, is_journal_file, mkstemp_beside
+from history_index import HistoryIndex, scan_journal
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_SUFFIX = ".archive"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# 扩展名 -> 压缩格式
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+_SEGMENT_SUFFIXES = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+_zstd_warned = False
+
+
+def is_archive(filename: str) -> bool:
+    """按扩展名判断是否为分段压缩归档(目录)"""
+    return bool(filename) and filename.rstrip("/\\").lower().endswith(ARCHIVE_SUFFIX)
+
+
+def compression_of(filename: str) -> Optional[str]:
+    """按扩展名判断单个对话文件的压缩格式 (如 chat.json.gz、chat.jsonl.zst),未压缩时为 None"""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename or "")[1].lower())
+
+
+def strip_compression(filename: str) -> str:
+    """去掉压缩扩展名,用于判断内容是JSON还是JSONL"""
+    root, ext = os.path.splitext(filename)
+    return root if ext.lower() in COMPRESSION_SUFFIXES else filename
+
+
+def split_extension(filename: str) -> Tuple[str, str]:
+    """把对话文件名拆成 (主名, 扩展名),扩展名包含压缩后缀,如 chat.jsonl.gz -> ("chat", ".jsonl.gz")"""
+    base = strip_compression(filename)
+    root, ext = os.path.splitext(base)
+    return root, ext + filename[len(base):]
+
+
+def resolve_compression(compression: str) -> str:
+    """配置的压缩格式; 未安装zstandard时zstd回退为gzip"""
+    global _zstd_warned
+    compression = (compression or "zstd").lower()
+    if compression not in _SEGMENT_SUFFIXES:
+        raise ValueError(f"不支持的压缩格式: {compression}")
+    if compression == "zstd" and zstandard is None:
+        if not _zstd_warned:
+            _zstd_warned = True
+            print("警告: 未安装zstandard包,归档改用gzip压缩 (pip install zstandard)")
+        return "gzip"
+    return compression
+
+
+def _zstd():
+    if zstandard is None:
+        raise RuntimeError("未安装zstandard包,无法读写zstd压缩的对话历史 (pip install zstandard)")
+    return zstandard
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(data)
+    # 流式写入的帧头中没有内容长度,不能用 ZstdDecompressor.decompress
+    return _zstd().ZstdDecompressor().decompressobj().decompress(data)
+
+
+def read_compressed(path: str, compression: str) -> bytes:
+    """读取并解压整个文件"""
+    with open(path, 'rb') as f:
+        return decompress(f.read(), compression)
+
+
+class CompressedWriter:
+    """把写入的文本/字节压缩后写入二进制文件 f,写完后调用 finish()"""
+
+    def __init__(self, f, compression: str):
+        self._file = f
+        if compression == "gzip":
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        else:
+            self._compressor = _zstd().ZstdCompressor(level=3).compressobj()
+        self.raw_bytes = 0  # 压缩前的字节数
+
+    def write(self, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.raw_bytes += len(data)
+        out = self._compressor.compress(data)
+        if out:
+            self._file.write(out)
+
+    def finish(self):
+        self._file.write(self._compressor.flush())
+
+
+def read_compressed_history(path: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """读取单个压缩的对话文件 (.json.gz/.jsonl.zst 等),返回 (metadata, messages)"""
+    data = read_compressed(path, compression_of(path))
+    if not is_journal_file(strip_compression(path)):
+        conversation_data = json.loads(data)
+        return conversation_data.get("metadata", {}), conversation_data.get("conversation", [])
+    metadata: Dict[str, Any] = {}
+    messages = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if "metadata" in record and "role" not in record:
+            metadata = record["metadata"]
+        else:
+            messages.append(record)
+    return metadata, messages
+
+
+def _write_atomic(path: str, data: bytes):
+    fd, temp_path = mkstemp_beside(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _message_line(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class HistoryArchive:
+    """分段压缩的对话历史归档 (目录 <名称>.archive/)
+
+    manifest.json 记录各段的文件名、消息数、大小和对话元数据。封存的段是压缩后不再改变的JSONL,
+    每段附带一个gzip压缩的偏移索引 (HistoryIndex,偏移相对于解压后的内容); 当前段是未压缩的JSONL,
+    每轮只追加新消息。当前段超过 segment_max_bytes 或创建超过 segment_max_age 秒后压缩封存,
+    开始新的一段。加载时只需读取清单、当前段和补足最近消息所需的最后几段。
+
+    接口与 ConversationJournal 相同 (append/write_snapshot/close/path),可作为自动保存的目标。
+    """
+
+    def __init__(self, path: str, compression: str = "zstd", segment_max_bytes: int = 8 << 20,
+                 segment_max_age: float = 7 * 86400, fsync_turns: int = 8, fsync_interval: float = 5.0):
+        self.path = path
+        self.compression = resolve_compression(compression)
+        self.segment_max_bytes = max(1, int(segment_max_bytes))
+        self.segment_max_age = float(segment_max_age)
+        self.fsync_turns = fsync_turns
+        self.fsync_interval = fsync_interval
+        self._manifest: Optional[Dict[str, Any]] = None
+        self._journal: Optional[ConversationJournal] = None
+
+    @staticmethod
+    def read_manifest(path: str) -> Dict[str, Any]:
+        """读取归档清单,归档不存在时返回空清单"""
+        try:
+            with open(os.path.join(path, MANIFEST_NAME), 'r', encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "metadata": {}, "next_id": 1,
+                    "active_created": time.time(), "segments": []}
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"不支持的归档版本: {manifest.get('version')}")
+        return manifest
+
+    @staticmethod
+    def signature(path: str) -> Tuple[int, int]:
+        """归档内容的签名 (mtime_ns, size): 清单和当前段任一变化时改变"""
+        mtime_ns = size = 0
+        manifest = HistoryArchive.read_manifest(path)
+        for name in (MANIFEST_NAME, f"{manifest['next_id']:06d}.jsonl"):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            mtime_ns = max(mtime_ns, st.st_mtime_ns)
+            size += st.st_size
+        return mtime_ns, size
+
+    def _get_manifest(self) -> Dict[str, Any]:
+        if self._manifest is None:
+            self._manifest = self.read_manifest(self.path)
+        return self._manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        os.makedirs(self.path, exist_ok=True)
+        _write_atomic(os.path.join(self.path, MANIFEST_NAME),
+                      json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+        self._manifest = manifest
+
+    def _active_path(self, manifest: Dict[str, Any]) -> str:
+        return os.path.join(self.path, f"{manifest['next_id']:06d}.jsonl")
+
+    def _active_journal(self) -> ConversationJournal:
+        active_path = self._active_path(self._get_manifest())
+        if self._journal is None or self._journal.path != active_path:
+            self.close()
+            self._journal = ConversationJournal(active_path, self.fsync_turns, self.fsync_interval)
+        return self._journal
+
+    def append(self, messages: Iterable[Dict[str, Any]]):
+        """把消息追加到当前段,需要时封存当前段"""
+        if not os.path.exists(os.path.join(self.path, MANIFEST_NAME)):
+            self._write_manifest(self._get_manifest())
+        journal = self._active_journal()
+        journal.append(messages)
+        manifest = self._get_manifest()
+        size = os.path.getsize(journal.path)
+        age = time.time() - manifest["active_created"]
+        if size >= self.segment_max_bytes or (self.segment_max_age > 0 and age >= self.segment_max_age):
+            self.rotate()
+
+    def rotate(self) -> bool:
+        """压缩封存当前段,返回是否封存了内容"""
+        manifest = self._get_manifest()
+        active_path = self._active_path(manifest)
+        self.close()
+        if not os.path.exists(active_path):
+            return False
+        index = HistoryIndex()
+        # 与加载JSONL日志相同,先修复崩溃留下的残缺尾部
+        scan_journal(active_path, index, deque(maxlen=0))
+        if not len(index):
+            return False
+        with open(active_path, 'rb') as f:
+            data = f.read(index.size)
+        manifest = dict(manifest, segments=list(manifest["segments"]))
+        manifest["segments"].append(self._seal(manifest["next_id"], [data], index))
+        manifest["next_id"] += 1
+        manifest["active_created"] = time.time()
+        self._write_manifest(manifest)
+        os.remove(active_path)
+        return True
+
+    def _seal(self, segment_id: int, chunks: List[bytes], index: HistoryIndex) -> Dict[str, Any]:
+        """把一段JSONL内容压缩写入段文件并保存偏移索引,返回清单中的段信息"""
+        os.makedirs(self.path, exist_ok=True)
+        name = f"{segment_id:06d}{_SEGMENT_SUFFIXES[self.compression]}"
+        index_name = f"{segment_id:06d}.idx.gz"
+        full_path = os.path.join(self.path, name)
+        fd, temp_path = mkstemp_beside(full_path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer = CompressedWriter(f, self.compression)
+                for chunk in chunks:
+                    writer.write(chunk)
+                writer.finish()
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        _write_atomic(os.path.join(self.path, index_name), gzip.compress(index.dumps(), 6))
+        return {
+            "id": segment_id, "file": name, "index": index_name, "compression": self.compression,
+            "messages": len(index), "raw_bytes": index.size, "bytes": os.path.getsize(full_path),
+            "sealed": time.time()
+        }
+
+    def write_snapshot(self, metadata: Dict[str, Any], messages: Iterable[Dict[str, Any]]):
+        """用 messages 重写整个归档: 按大小切分后全部压缩封存,之后的消息追加到新的当前段
+
+        新的段使用新的编号,清单原子替换后才删除旧文件,中途出错不影响原有归档。
+        """
+        self.close()
+        old = self.read_manifest(self.path)
+        manifest = {"version": MANIFEST_VERSION, "metadata": metadata, "next_id": old["next_id"],
+                    "active_created": time.time(), "segments": []}
+        os.makedirs(self.path, exist_ok=True)
+        chunks: List[bytes] = []
+        index = HistoryIndex()
+        for message in messages:
+            line = _message_line(message)
+            index.add(index.size, index.size + len(line), message)
+            index.size += len(line)
+            chunks.append(line)
+            if index.size >= self.segment_max_bytes:
+                manifest["segments"].append(self._seal(manifest["next_id"], chunks, index))
+                manifest["next_id"] += 1
+                chunks, index = [], HistoryIndex()
+        if chunks:
+            manifest["segments"].append(self._seal(manifest["next_id"], chunks, index))
+            manifest["next_id"] += 1
+        self._write_manifest(manifest)
+        self._remove_unreferenced(manifest)
+
+    def _remove_unreferenced(self, manifest: Dict[str, Any]):
+        keep = {MANIFEST_NAME, os.path.basename(self._active_path(manifest))}
+        for segment in manifest["segments"]:
+            keep.update((segment["file"], segment["index"]))
+        for name in os.listdir(self.path):
+            if name not in keep and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def load(self, keep: int) -> Tuple[Dict[str, Any], List[Tuple[str, str, HistoryIndex]], int,
+                                       List[Dict[str, Any]], Dict[str, Tuple[int, int]], int]:
+        """读取归档,返回 (metadata, 各段, 留在磁盘上的消息数, 载入内存的消息, 各角色统计, 修复截掉的字节数)
+
+        各段为 (段文件路径, 压缩格式, 偏移索引),按时间顺序排列; 前 cold 条消息留在这些段中按需读取,
+        之后的消息(当前段全部,以及补足 keep 条所需的最后几段)载入内存。keep 为 0 时全部载入。
+        """
+        self.close()
+        manifest = self.read_manifest(self.path)
+        self._manifest = manifest
+        active_path = self._active_path(manifest)
+        active: List[Dict[str, Any]] = []
+        truncated = 0
+        if os.path.exists(active_path):
+            _, active, truncated = ConversationJournal.read(active_path)
+        parts = []
+        role_stats: Dict[str, List[int]] = {}
+        for segment in manifest["segments"]:
+            with open(os.path.join(self.path, segment["index"]), 'rb') as f:
+                index, _ = HistoryIndex.loads(gzip.decompress(f.read()))
+            parts.append((os.path.join(self.path, segment["file"]), segment.get("compression", "gzip"), index))
+            for role, (count, chars) in index.role_stats().items():
+                totals = role_stats.setdefault(role, [0, 0])
+                totals[0] += count
+                totals[1] += chars
+        for message in active:
+            totals = role_stats.setdefault(message.get("role", ""), [0, 0])
+            totals[0] += 1
+            totals[1] += len(message.get("content") or "")
+        # 从最新的段往前补足 keep 条消息
+        need = max(0, keep - len(active)) if keep > 0 else sum(len(index) for _, _, index in parts)
+        blocks: List[List[Dict[str, Any]]] = []
+        cold = sum(len(index) for _, _, index in parts)
+        for segment_path, compression, index in reversed(parts):
+            if need <= 0:
+                break
+            take = min(need, len(index))
+            data = read_compressed(segment_path, compression)
+            blocks.append([json.loads(data[index.starts[i]:index.ends[i]]) for i in range(len(index) - take, len(index))])
+            need -= take
+            cold -= take
+        loaded = [message for block in reversed(blocks) for message in block]
+        return (manifest["metadata"], parts, cold, loaded + active,
+                {role: tuple(totals) for role, totals in role_stats.items()}, truncated)
+
+    def read_all(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """只读地读取全部消息,返回 (metadata, messages),不修复当前段"""
+        manifest = self.read_manifest(self.path)
+        messages: List[Dict[str, Any]] = []
+        for segment in manifest["segments"]:
+            data = read_compressed(os.path.join(self.path, segment["file"]), segment.get("compression", "gzip"))
+            messages.extend(json.loads(line) for line in data.splitlines() if line.strip())
+        try:
+            with open(self._active_path(manifest), 'rb') as f:
+                for _, _, record in ConversationJournal.records(f):
+                    if record is not None and "role" in record:
+                        messages.append(record)
+        except FileNotFoundError:
+            pass
+        return manifest["metadata"], messages
+
+    def stats(self) -> Dict[str, Any]:
+        """归档的段数、消息数、压缩前后的字节数"""
+        manifest = self.read_manifest(self.path)
+        segments = manifest["segments"]
+        try:
+            active_bytes = os.path.getsize(self._active_path(manifest))
+        except OSError:
+            active_bytes = 0
+        return {
+            "segments": len(segments),
+            "sealed_messages": sum(s["messages"] for s in segments),
+            "raw_bytes": sum(s["raw_bytes"] for s in segments) + active_bytes,
+            "bytes": sum(s["bytes"] for s in segments) + active_bytes,
+            "active_bytes": active_bytes
+        }
@@ -0,0 +1,289 @@
+#history_index
+import json
+import os
+import re
+import sys
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from conversation_journal import ConversationJournal, is_journal_file, mkstemp_beside
+from token_estimator import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+INDEX_DIRNAME = ".offsets"
+INDEX_VERSION = 1
+# 增量更新JSONL日志的索引前,核对已索引部分末尾的这些字节没有变化
+_CHECK_BYTES = 64
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class HistoryIndex:
+    """对话历史文件的消息偏移索引
+
+    第 i 条消息的JSON位于文件的 [starts[i], ends[i]) 字节,同时记录角色、字符数和估算token数,
+    不读取消息内容即可统计对话、计算上下文窗口,需要时再按偏移读取单条消息。
+    各角色的消息数和字符数随索引累计,加载时不必逐条统计。
+    """
+
+    def __init__(self):
+        self.metadata: Dict[str, Any] = {}
+        self.role_names: List[str] = []
+        self._role_codes: Dict[str, int] = {}
+        self.roles = array('B')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.chars = array('q')
+        self.tokens = array('q')
+        # 角色编码 -> [消息数, 字符数]
+        self.role_totals: List[List[int]] = []
+        self.size = 0  # 已索引的文件字节数
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, start: int, end: int, message: Dict[str, Any]):
+        role = message.get("role", "")
+        code = self._role_codes.get(role)
+        if code is None:
+            if len(self.role_names) >= 256:
+                raise ValueError("对话历史中的角色种类过多")
+            code = self._role_codes[role] = len(self.role_names)
+            self.role_names.append(role)
+            self.role_totals.append([0, 0])
+        content = message.get("content") or ""
+        totals = self.role_totals[code]
+        totals[0] += 1
+        totals[1] += len(content)
+        self.roles.append(code)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.chars.append(len(content))
+        self.tokens.append(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS)
+
+    def pop(self):
+        totals = self.role_totals[self.roles[-1]]
+        totals[0] -= 1
+        totals[1] -= self.chars[-1]
+        for column in (self.roles, self.starts, self.ends, self.chars, self.tokens):
+            column.pop()
+
+    def role(self, index: int) -> str:
+        return self.role_names[self.roles[index]]
+
+    def role_stats(self) -> Dict[str, Tuple[int, int]]:
+        """{角色: (消息数, 字符数)},用于重建统计"""
+        return {name: tuple(totals) for name, totals in zip(self.role_names, self.role_totals) if totals[0]}
+
+    def read_messages(self, path: str, start: int, stop: int) -> List[Dict[str, Any]]:
+        """按偏移读取 [start, stop) 区间的消息"""
+        if stop <= start:
+            return []
+        with open(path, 'rb') as f:
+            base = self.starts[start]
+            f.seek(base)
+            block = f.read(self.ends[stop - 1] - base)
+        return [json.loads(block[self.starts[i] - base:self.ends[i] - base]) for i in range(start, stop)]
+
+    def _columns(self):
+        return (self.roles, self.starts, self.ends, self.chars, self.tokens)
+
+    def dumps(self, check: bytes = b"", mtime_ns: int = 0) -> bytes:
+        """索引的二进制表示: 一行JSON文件头,之后是各列数组"""
+        header = {
+            "version": INDEX_VERSION, "byteorder": sys.byteorder, "count": len(self),
+            "size": self.size, "mtime_ns": mtime_ns, "check": check.hex(),
+            "role_names": self.role_names, "role_totals": self.role_totals, "metadata": self.metadata
+        }
+        return b"".join([json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n"]
+                        + [column.tobytes() for column in self._columns()])
+
+    def save(self, path: str, check: bytes, mtime_ns: int):
+        """写入索引文件(临时文件 + rename)"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = mkstemp_beside(path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.dumps(check, mtime_ns))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["HistoryIndex", Dict[str, Any]]:
+        """读取索引文件,返回 (索引, 文件头); 格式不符时抛出 ValueError"""
+        with open(path, 'rb') as f:
+            return cls.loads(f.read())
+
+    @classmethod
+    def loads(cls, data: bytes) -> Tuple["HistoryIndex", Dict[str, Any]]:
+        """从 dumps() 的结果恢复索引,返回 (索引, 文件头)"""
+        index = cls()
+        header_end = data.find(b"\n") + 1
+        header = json.loads(data[:header_end])
+        if header.get("version") != INDEX_VERSION or header.get("byteorder") != sys.byteorder:
+            raise ValueError("索引版本不符")
+        count = header["count"]
+        offset = header_end
+        for column in index._columns():
+            end = offset + count * column.itemsize
+            if end > len(data):
+                raise ValueError("索引文件不完整")
+            column.frombytes(data[offset:end])
+            offset = end
+        index.role_names = list(header["role_names"])
+        index._role_codes = {name: code for code, name in enumerate(index.role_names)}
+        index.role_totals = [list(totals) for totals in header["role_totals"]]
+        index.metadata = header.get("metadata") or {}
+        index.size = header["size"]
+        return index, header
+
+
+def index_path(path: str) -> str:
+    """path 的索引文件位置: 同目录下的 .offsets/ (搜索索引会跳过以点开头的目录)"""
+    return os.path.join(os.path.dirname(path), INDEX_DIRNAME, os.path.basename(path) + ".idx")
+
+
+def _read_check(path: str, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - _CHECK_BYTES))
+        return f.read(min(size, _CHECK_BYTES))
+
+
+def _cached_index(path: str, st: os.stat_result, journal: bool) -> Tuple[Optional[HistoryIndex], bool]:
+    """读取缓存的索引,返回 (索引, 是否与文件一致); 没有可用的缓存时索引为 None
+
+    JSONL日志在索引之后只追加了内容时返回不一致的索引,调用方只需解析新增的部分。
+    """
+    try:
+        index, header = HistoryIndex.load(index_path(path))
+    except (OSError, ValueError, KeyError):
+        return None, False
+    if st.st_size < index.size or _read_check(path, index.size).hex() != header["check"]:
+        return None, False
+    if st.st_size == index.size and header["mtime_ns"] == st.st_mtime_ns:
+        return index, True
+    return (index, False) if journal and st.st_size > index.size else (None, False)
+
+
+def scan_journal(path: str, index: HistoryIndex, tail: Deque[Dict[str, Any]]) -> int:
+    """从 index.size 处继续解析JSONL日志,返回修复残缺尾部时截掉的字节数
+
+    修复规则与 ConversationJournal.read 相同: 截掉不完整或无法解析的行,以及末尾缺少回复的user消息。
+    """
+    scanned_from = len(index)
+    good_offset = turn_offset = index.size
+    with open(path, 'rb') as f:
+        f.seek(index.size)
+        for start, line_end, record in ConversationJournal.records(f, index.size):
+            if record is None:
+                good_offset = line_end
+                continue
+            if "metadata" in record and "role" not in record:
+                index.metadata = record["metadata"]
+            else:
+                index.add(start, line_end, record)
+                tail.append(record)
+            good_offset = line_end
+            if record.get("role") != "user":
+                turn_offset = line_end
+        file_size = os.fstat(f.fileno()).st_size
+    if len(index) > scanned_from and index.role(-1) == "user":
+        while len(index) > scanned_from and index.role(-1) == "user":
+            index.pop()
+            if tail:
+                tail.pop()
+        good_offset = turn_offset
+    truncated = file_size - good_offset
+    if truncated > 0:
+        os.truncate(path, good_offset)
+    index.size = good_offset
+    return truncated
+
+
+def _scan_json(path: str, index: HistoryIndex, tail: Deque[Dict[str, Any]]):
+    """解析JSON格式的对话历史({"metadata": ..., "conversation": [...]}),逐条记录消息的字节偏移"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = data.decode("utf-8")
+    decoder = json.JSONDecoder()
+    ascii_only = len(text) == len(data)
+    position = [0, 0]  # 已换算到的 (字符位置, 字节位置)
+
+    def byte_offset(char_pos: int) -> int:
+        if ascii_only:
+            return char_pos
+        position[1] += len(text[position[0]:char_pos].encode("utf-8"))
+        position[0] = char_pos
+        return position[1]
+
+    def skip(pos: int) -> int:
+        return _WHITESPACE.match(text, pos).end()
+
+    def expect(pos: int, chars: str) -> str:
+        char = text[pos:pos + 1]
+        if not char or char not in chars:
+            raise ValueError(f"对话历史文件格式不正确 (位置 {pos})")
+        return char
+
+    pos = skip(0)
+    expect(pos, "{")
+    pos = skip(pos + 1)
+    if text[pos:pos + 1] != "}":
+        while True:
+            key, pos = decoder.raw_decode(text, pos)
+            pos = skip(pos)
+            expect(pos, ":")
+            pos = skip(pos + 1)
+            if key == "conversation" and text[pos:pos + 1] == "[":
+                pos = skip(pos + 1)
+                if text[pos:pos + 1] != "]":
+                    while True:
+                        message, end = decoder.raw_decode(text, pos)
+                        index.add(byte_offset(pos), byte_offset(end), message)
+                        tail.append(message)
+                        pos = skip(end)
+                        if expect(pos, ",]") == "]":
+                            break
+                        pos = skip(pos + 1)
+                pos += 1
+            else:
+                value, pos = decoder.raw_decode(text, pos)
+                if key == "metadata" and isinstance(value, dict):
+                    index.metadata = value
+            pos = skip(pos)
+            if expect(pos, ",}") == "}":
+                break
+            pos = skip(pos + 1)
+    index.size = len(data)
+
+
+def open_history(path: str, keep: int) -> Tuple[HistoryIndex, List[Dict[str, Any]], int]:
+    """读取或建立 path 的偏移索引,返回 (索引, 最后 keep 条消息, 修复日志时截掉的字节数)
+
+    索引缓存在同目录的 .offsets/ 下,按文件大小和修改时间判断是否过期;
+    JSONL日志只追加了内容时只解析新增的部分。建立索引时顺带保留最后 keep 条消息,
+    索引已是最新时只按偏移读取这几条,不解析整个文件。
+    """
+    journal = is_journal_file(path)
+    st = os.stat(path)
+    index, fresh = _cached_index(path, st, journal)
+    tail: Deque[Dict[str, Any]] = deque(maxlen=max(1, keep))
+    truncated = 0
+    if not fresh:
+        if index is None:
+            index = HistoryIndex()
+        if journal:
+            truncated = scan_journal(path, index, tail)
+        else:
+            _scan_json(path, index, tail)
+        try:
+            index.save(index_path(path), _read_check(path, index.size), os.stat(path).st_mtime_ns)
+        except OSError:
+            # 索引只是缓存,写不进去时下次重新建立
+            pass
+    count = min(keep, len(index))
+    if len(tail) > count:
+        tail = deque(list(tail)[len(tail) - count:])
+    messages = index.read_messages(path, len(index) - count, len(index) - len(tail)) + list(tail)
+    return index, messages, truncated
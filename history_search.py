@@ -0,0 +1,265 @@
+#history_search
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from history_archive import HistoryArchive, compression_of, is_archive, read_compressed_history
+
+INDEX_FILENAME = ".search_index.sqlite3"
+HISTORY_EXTENSIONS = (".json", ".jsonl", ".json.gz", ".jsonl.gz", ".json.zst", ".jsonl.zst")
+# trigram分词器只能匹配至少3个字符的词,更短的词在其他词的命中结果中过滤;
+# 全部是短词时只能逐行扫描,从最近写入索引的消息往前,找到 limit 条即停止
+MIN_FTS_TERM_CHARS = 3
+
+
+def _read_history_file(path: str) -> List[Dict[str, Any]]:
+    """只读地解析对话历史文件(.json、.jsonl、压缩文件或分段归档),跳过无法解析的行"""
+    if is_archive(path):
+        return HistoryArchive(path).read_all()[1]
+    if compression_of(path):
+        return read_compressed_history(path)[1]
+    if path.endswith(".jsonl"):
+        messages = []
+        with open(path, 'r', encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "role" in record:
+                    messages.append(record)
+        return messages
+    with open(path, 'r', encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("conversation", []) if isinstance(data, dict) else []
+
+
+def make_snippet(content: str, terms: Iterable[str], width: int = 80) -> str:
+    """截取第一个命中词附近的文本,命中词用 [] 标出"""
+    text = " ".join(content.split())
+    lowered = text.lower()
+    hits = [(lowered.find(term.lower()), term) for term in terms]
+    hits = sorted((pos, term) for pos, term in hits if pos >= 0)
+    if not hits:
+        return text[:width] + ("..." if len(text) > width else "")
+    first = hits[0][0]
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    snippet = text[start:end]
+    for term in sorted({term for _, term in hits}, key=len, reverse=True):
+        lowered_snippet = snippet.lower()
+        pos = lowered_snippet.find(term.lower())
+        if pos >= 0:
+            snippet = snippet[:pos] + "[" + snippet[pos:pos + len(term)] + "]" + snippet[pos + len(term):]
+    return ("..." if start > 0 else "") + snippet + ("..." if end < len(text) else "")
+
+
+class HistorySearchIndex:
+    """Chat_history 下所有对话历史的全文索引(SQLite)
+
+    SQLite支持FTS5时使用trigram分词的外部内容全文表,按bm25排序,中英文都能做子串匹配;
+    否则退化为逐行扫描。每个文件记录 (mtime, size) 签名,
+    保存对话时由 AIClientService 增量写入新消息,查询前只重建签名变化的文件。
+    """
+
+    def __init__(self, history_dir: str = "Chat_history", db_path: Optional[str] = None):
+        self.history_dir = os.path.abspath(history_dir)
+        self.db_path = db_path or os.path.join(self.history_dir, INDEX_FILENAME)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        # 保存对话可能发生在批量/异步的工作线程中,由 self._lock 串行化
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER, size INTEGER, messages INTEGER);"
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, file_id INTEGER, position INTEGER, role TEXT, content TEXT);"
+            "CREATE INDEX IF NOT EXISTS idx_entries_file ON entries(file_id, position);"
+        )
+        self.fts = self._create_fts_table()
+        self._db.commit()
+
+    def _create_fts_table(self) -> bool:
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5("
+                "content, content='entries', content_rowid='id', tokenize='trigram')"
+            )
+            return True
+        except sqlite3.OperationalError:
+            # 编译时未启用FTS5或版本过旧(trigram需要3.34+)
+            return False
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), self.history_dir).replace(os.sep, "/")
+
+    @staticmethod
+    def _signature(path: str) -> Tuple[int, int]:
+        """文件的 (mtime_ns, size); 分段归档按清单和当前段计算"""
+        if is_archive(path):
+            return HistoryArchive.signature(path)
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def _file_id(self, rel_path: str) -> int:
+        row = self._db.execute("SELECT id FROM files WHERE path = ?", (rel_path,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self._db.execute(
+            "INSERT INTO files (path, mtime_ns, size, messages) VALUES (?, 0, 0, 0)", (rel_path,)
+        ).lastrowid
+
+    def _delete_entries(self, file_id: int, start: int = 0):
+        if self.fts:
+            # 外部内容表需要用原内容发出删除命令
+            rows = self._db.execute(
+                "SELECT id, content FROM entries WHERE file_id = ? AND position >= ?", (file_id, start)
+            ).fetchall()
+            self._db.executemany(
+                "INSERT INTO entries_fts (entries_fts, rowid, content) VALUES ('delete', ?, ?)", rows
+            )
+        self._db.execute("DELETE FROM entries WHERE file_id = ? AND position >= ?", (file_id, start))
+
+    def _insert_entries(self, file_id: int, messages: Iterable[Dict[str, Any]], start: int) -> int:
+        position = start
+        for msg in messages:
+            content = msg.get("content") or ""
+            row_id = self._db.execute(
+                "INSERT INTO entries (file_id, position, role, content) VALUES (?, ?, ?, ?)",
+                (file_id, position, msg.get("role", ""), content)
+            ).lastrowid
+            if self.fts:
+                self._db.execute("INSERT INTO entries_fts (rowid, content) VALUES (?, ?)", (row_id, content))
+            position += 1
+        return position
+
+    def index_messages(self, path: str, messages: Iterable[Dict[str, Any]], start: int = 0):
+        """把文件 path 中从下标 start 开始的消息写入索引(替换原有的同位置条目)
+
+        调用方应在文件写入完成后调用,以便记录写入后的文件签名。
+        """
+        rel_path = self._relative(path)
+        try:
+            signature = self._signature(path)
+        except (OSError, ValueError):
+            signature = (0, 0)
+        with self._lock:
+            file_id = self._file_id(rel_path)
+            self._delete_entries(file_id, start)
+            count = self._insert_entries(file_id, messages, start)
+            self._db.execute(
+                "UPDATE files SET mtime_ns = ?, size = ?, messages = ? WHERE id = ?",
+                (signature[0], signature[1], count, file_id)
+            )
+            self._db.commit()
+
+    def _scan_files(self) -> Dict[str, Tuple[str, int, int]]:
+        """返回 {相对路径: (绝对路径, mtime_ns, size)},跳过以点开头的文件和目录
+
+        分段归档目录 (.archive) 作为一个整体,不进入其中。
+        """
+        found = {}
+        for root, dirs, files in os.walk(self.history_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            names = [name for name in files if not name.startswith(".") and name.endswith(HISTORY_EXTENSIONS)]
+            names += [d for d in dirs if is_archive(d)]
+            dirs[:] = [d for d in dirs if not is_archive(d)]
+            for name in names:
+                full_path = os.path.join(root, name)
+                try:
+                    mtime_ns, size = self._signature(full_path)
+                except (OSError, ValueError):
+                    continue
+                found[self._relative(full_path)] = (full_path, mtime_ns, size)
+        return found
+
+    def refresh(self) -> int:
+        """重建签名变化或新增的文件,删除已不存在的文件,返回重建的文件数"""
+        found = self._scan_files()
+        with self._lock:
+            known = {path: (file_id, mtime_ns, size) for file_id, path, mtime_ns, size in
+                     self._db.execute("SELECT id, path, mtime_ns, size FROM files")}
+        for rel_path, (file_id, _, _) in known.items():
+            if rel_path not in found:
+                with self._lock:
+                    self._delete_entries(file_id)
+                    self._db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+                    self._db.commit()
+        rebuilt = 0
+        for rel_path, (full_path, mtime_ns, size) in found.items():
+            entry = known.get(rel_path)
+            if entry is not None and (entry[1], entry[2]) == (mtime_ns, size):
+                continue
+            try:
+                messages = _read_history_file(full_path)
+            except (OSError, ValueError):
+                # 无法解析的文件也记录签名,文件不变时不再重试
+                messages = []
+            self.index_messages(full_path, messages)
+            rebuilt += 1
+        return rebuilt
+
+    def search(self, query: str, limit: int = 10, refresh: bool = True) -> List[Dict[str, Any]]:
+        """搜索所有对话历史,返回按相关度排序的结果
+
+        空格分隔的多个词须同时出现; 大小写不敏感。
+        每项结果包含 file、turn (从1开始的轮次)、role、snippet。
+        refresh 为 False 时不检查文件变化(调用方刚刚调用过 refresh())。
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        if refresh:
+            self.refresh()
+        fts_terms = [t for t in terms if len(t) >= MIN_FTS_TERM_CHARS] if self.fts else []
+        scan_terms = [t for t in terms if t not in fts_terms]
+        scan = "".join(" AND instr(lower(e.content), lower(?)) > 0" for _ in scan_terms)
+        if fts_terms:
+            # 每个词作为短语查询,双引号转义
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in fts_terms)
+            sql = ("SELECT f.path, e.position, e.role, e.content FROM entries_fts "
+                   "JOIN entries e ON e.id = entries_fts.rowid JOIN files f ON f.id = e.file_id "
+                   "WHERE entries_fts MATCH ?" + scan + " ORDER BY bm25(entries_fts) LIMIT ?")
+            args: List[Any] = [match] + scan_terms
+        else:
+            # 没有可用全文索引的词时逐行扫描: 按rowid从最近写入的消息往前,够 limit 条即停止,
+            # 常见的短词不必扫描整个索引; CROSS JOIN 固定以 entries 为外层循环
+            sql = ("SELECT f.path, e.position, e.role, e.content FROM entries e CROSS JOIN files f ON f.id = e.file_id "
+                   "WHERE 1 = 1" + scan + " ORDER BY e.id DESC LIMIT ?")
+            args = list(scan_terms)
+        with self._lock:
+            rows = self._db.execute(sql, args + [int(limit)]).fetchall()
+        return [{
+            "file": path,
+            "turn": position // 2 + 1,
+            "role": role,
+            "snippet": make_snippet(content, terms)
+        } for path, position, role, content in rows]
+
+    def uses_index(self, query: str) -> bool:
+        """查询中是否有可以使用全文索引的词; 否则 search() 需要逐行扫描"""
+        return self.fts and any(len(t) >= MIN_FTS_TERM_CHARS for t in query.split())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            files, messages = self._db.execute("SELECT COUNT(*), COALESCE(SUM(messages), 0) FROM files").fetchone()
+        return {"files": files, "messages": messages, "fts": self.fts, "path": self.db_path}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_indexes: Dict[str, HistorySearchIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(history_dir: str = "Chat_history") -> HistorySearchIndex:
+    """返回目录对应的共享索引对象,命令行和各个客户端服务共用同一个连接"""
+    key = os.path.abspath(history_dir)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = HistorySearchIndex(history_dir)
+        return index
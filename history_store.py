@@ -0,0 +1,397 @@
+#history_store
+import json
+import os
+import tempfile
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from history_archive import read_compressed
+from token_estimator import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+# 从磁盘连续读取消息时每次读取的条数
+_READ_BLOCK_MESSAGES = 256
+_COPY_CHUNK_BYTES = 1 << 20
+# 最近一次解压的归档段 (段文件, 内容); 只缓存一个,内存占用不超过一段
+_decompressed = [None, b""]
+_decompressed_lock = threading.Lock()
+
+
+class _SegmentFile:
+    """磁盘消息段所在的文件: 对话历史文件(只读,按需打开)、压缩的归档段(整段解压)或溢出临时文件(追加)"""
+
+    def __init__(self, path: Optional[str] = None, compression: Optional[str] = None):
+        self.path = path
+        self.compression = compression
+        self._file = None if path else tempfile.TemporaryFile(prefix="deepmini-history-", suffix=".jsonl")
+        self._lock = threading.Lock()
+
+    def read(self, start: int, end: int) -> bytes:
+        if self.compression:
+            with _decompressed_lock:
+                if _decompressed[0] is not self:
+                    _decompressed[:] = [self, read_compressed(self.path, self.compression)]
+                return _decompressed[1][start:end]
+        with self._lock:
+            if self._file is None:
+                if self.path is None:
+                    raise ValueError("溢出文件已关闭")
+                self._file = open(self.path, 'rb')
+            self._file.seek(start)
+            return self._file.read(end - start)
+
+    def append(self, data: bytes) -> int:
+        """追加数据,返回其起始偏移"""
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(data)
+            return offset
+
+    def close(self):
+        with _decompressed_lock:
+            if _decompressed[0] is self:
+                _decompressed[:] = [None, b""]
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _DiskSegment:
+    """磁盘上的一段连续消息: 第 i 条的JSON位于文件的 [starts[i], ends[i]) 字节"""
+    __slots__ = ("file", "starts", "ends")
+
+    def __init__(self, file: _SegmentFile, starts: array, ends: array):
+        self.file = file
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def read_block(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """一次读取 [start, stop) 区间的消息"""
+        starts, ends = self.starts, self.ends
+        base = starts[start]
+        block = self.file.read(base, ends[stop - 1])
+        return [json.loads(block[starts[i] - base:ends[i] - base]) for i in range(start, stop)]
+
+
+class HistoryView:
+    """历史消息某一区间的只读视图,不复制数据
+
+    迭代时逐条生成消息字典,用于序列化(写日志、保存文件)时
+    避免先把整段历史拼成列表。
+    """
+    __slots__ = ("_store", "_start", "_stop")
+
+    def __init__(self, store: "HistoryStore", start: int, stop: int):
+        self._store = store
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return max(0, self._stop - self._start)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self._store.iter_messages(self._start, self._stop)
+
+    def view(self, start: int = 0) -> "HistoryView":
+        """从本视图第 start 条开始的子视图"""
+        return HistoryView(self._store, min(self._start + start, self._stop), self._stop)
+
+    def release_file(self, path: str) -> bool:
+        """见 HistoryStore.release_file"""
+        return self._store.release_file(path)
+
+
+class HistoryStore:
+    """列式存储的对话历史
+
+    角色存为单字节编码(角色名只保存一份),内容为字符串列表,
+    每条消息的固定开销约为一个指针加一个字节,而不是一个字典。
+    少见的附加字段(如截断标记)稀疏存放。
+    同时维护每条消息估算token数的前缀和(按需增量计算),用于按token预算截取上下文。
+
+    较早的消息可以只留在磁盘上(内存中只有角色和token前缀和): 从偏移索引加载时留在原文件
+    (或压缩归档的段)中,长会话中由 spill() 移到溢出临时文件,访问时按偏移读取。内存中的消息为 [_hot_start, len)。
+
+    对外表现为消息字典的序列: 支持 len()、迭代、下标和切片,
+    下标/切片/迭代时才临时生成字典,切片返回新列表。
+    """
+    __slots__ = ("_role_names", "_role_codes", "_roles", "_contents", "_extras", "_token_prefix",
+                 "_hot_start", "_segments", "_segment_starts", "_spill", "_lock")
+
+    def __init__(self, messages: Iterable[Dict[str, Any]] = ()):
+        self._role_names: List[str] = []
+        self._role_codes: Dict[str, int] = {}
+        self._roles = array('B')
+        self._contents: List[str] = []
+        # 下标 -> 除 role/content 以外的字段
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        # _token_prefix[i] 为前 i 条消息的估算token数之和,只覆盖已计算的部分
+        self._token_prefix = array('q', [0])
+        self._hot_start = 0
+        self._segments: List[_DiskSegment] = []
+        self._segment_starts: List[int] = []
+        self._spill: Optional[_SegmentFile] = None
+        # 溢出到磁盘会移动内存中的消息,与后台线程(保存、摘要)的读取互斥
+        self._lock = threading.RLock()
+        self.extend(messages)
+
+    @classmethod
+    def from_index(cls, path: str, index, tail: List[Dict[str, Any]]) -> "HistoryStore":
+        """由偏移索引 (history_index.HistoryIndex) 构建: tail 为最后几条消息,载入内存;
+        之前的消息留在 path 中按需读取"""
+        return cls.from_segments([(path, None, index)], len(index) - len(tail), tail)
+
+    @classmethod
+    def from_segments(cls, parts: List[Tuple[str, Optional[str], Any]], cold: int,
+                      tail: List[Dict[str, Any]]) -> "HistoryStore":
+        """由按顺序排列的 (文件路径, 压缩格式, 偏移索引) 构建: 前 cold 条消息留在这些文件中按需读取,
+        之后的 tail 载入内存"""
+        store = cls()
+        remaining = cold
+        for path, compression, index in parts:
+            count = min(remaining, len(index))
+            if count <= 0:
+                break
+            # 各索引的角色编码换算为本对象的编码
+            codes = bytes(store._role_code(role) for role in index.role_names)
+            store._roles.frombytes(index.roles[:count].tobytes().translate(codes.ljust(256, b"\0")))
+            total = store._token_prefix[-1]
+            store._token_prefix.extend(total + tokens for tokens in accumulate(index.tokens[:count]))
+            store._add_segment(_DiskSegment(_SegmentFile(path, compression), index.starts[:count], index.ends[:count]))
+            store._hot_start += count
+            remaining -= count
+        store.extend(tail)
+        return store
+
+    def _role_code(self, role: str) -> int:
+        code = self._role_codes.get(role)
+        if code is None:
+            if len(self._role_names) >= 256:
+                raise ValueError("对话历史中的角色种类过多")
+            code = self._role_codes[role] = len(self._role_names)
+            self._role_names.append(role)
+        return code
+
+    def append(self, message: Dict[str, Any]):
+        self._roles.append(self._role_code(message.get("role", "")))
+        self._contents.append(message.get("content") or "")
+        if len(message) > 2 or "role" not in message or "content" not in message:
+            extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+            if extra:
+                self._extras[len(self) - 1] = extra
+
+    def extend(self, messages: Iterable[Dict[str, Any]]):
+        for message in messages:
+            self.append(message)
+
+    def clear(self):
+        self.close()
+        self._role_names.clear()
+        self._role_codes.clear()
+        self._roles = array('B')
+        self._contents = []
+        self._extras.clear()
+        self._token_prefix = array('q', [0])
+        self._hot_start = 0
+
+    def close(self):
+        """关闭磁盘上的消息段,之后不能再读取较早的消息; 历史被替换后调用"""
+        with self._lock:
+            for segment in self._segments:
+                segment.file.close()
+            self._segments = []
+            self._segment_starts = []
+            self._spill = None
+
+    def __len__(self) -> int:
+        return self._hot_start + len(self._contents)
+
+    @property
+    def in_memory(self) -> int:
+        """内容在内存中的消息数"""
+        return len(self._contents)
+
+    def _add_segment(self, segment: _DiskSegment):
+        last = self._segments[-1] if self._segments else None
+        if last is not None and last.file is segment.file and last.ends[-1] == segment.starts[0]:
+            # 与上一段在同一文件中首尾相接,合并
+            last.starts.extend(segment.starts)
+            last.ends.extend(segment.ends)
+            return
+        self._segment_starts.append(self._segment_starts[-1] + len(last) if last is not None else 0)
+        self._segments.append(segment)
+
+    def _iter_cold(self, start: int, stop: int) -> Iterator[Dict[str, Any]]:
+        """逐块读取磁盘上 [start, stop) 区间的消息; 每块在锁内定位,消息段被替换后读到的仍是新位置"""
+        while start < stop:
+            with self._lock:
+                k = bisect_right(self._segment_starts, start) - 1
+                segment, base = self._segments[k], self._segment_starts[k]
+                end = min(stop, base + len(segment), start + _READ_BLOCK_MESSAGES)
+                block = segment.read_block(start - base, end - base)
+            yield from block
+            start = end
+
+    def _message(self, index: int) -> Dict[str, Any]:
+        with self._lock:
+            if index < self._hot_start:
+                return next(self._iter_cold(index, index + 1))
+            message = {"role": self._role_names[self._roles[index]], "content": self._contents[index - self._hot_start]}
+            extra = self._extras.get(index)
+            if extra:
+                message.update(extra)
+            return message
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return list(self.iter_messages(start, stop))
+            return [self._message(i) for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self._message(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return self.iter_messages()
+
+    def iter_messages(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        with self._lock:
+            cold_stop = min(stop, self._hot_start)
+        if start < cold_stop:
+            # 磁盘上的消息只会增加不会减少,逐块读取,不在整个迭代期间持有锁
+            yield from self._iter_cold(start, cold_stop)
+            start = cold_stop
+        for i in range(start, stop):
+            yield self._message(i)
+
+    def view(self, start: int = 0, stop: Optional[int] = None) -> HistoryView:
+        """返回 [start, stop) 区间的只读视图,区间在创建时固定"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return HistoryView(self, start, stop)
+
+    def tail(self, count: int) -> List[Dict[str, Any]]:
+        """最近 count 条消息"""
+        return self[max(0, len(self) - count):] if count > 0 else []
+
+    def chat_messages(self, start: int = 0) -> List[Dict[str, str]]:
+        """从 start 开始的消息,只包含发送给API的 role/content 字段"""
+        start = max(0, start)
+        with self._lock:
+            hot_start = self._hot_start
+            messages = [{"role": m.get("role", ""), "content": m.get("content") or ""}
+                        for m in self._iter_cold(start, hot_start)] if start < hot_start else []
+            names, roles, contents = self._role_names, self._roles, self._contents
+            messages.extend({"role": names[roles[i]], "content": contents[i - hot_start]}
+                            for i in range(max(start, hot_start), len(self)))
+        return messages
+
+    def role(self, index: int) -> str:
+        return self._role_names[self._roles[index]]
+
+    def content(self, index: int) -> str:
+        with self._lock:
+            if index < 0:
+                index += len(self)
+            if index < self._hot_start:
+                return self._message(index).get("content") or ""
+            return self._contents[index - self._hot_start]
+
+    def spill(self, keep: int) -> int:
+        """内存中只保留最近 keep 条消息,更早的写入溢出临时文件,返回移出的条数"""
+        with self._lock:
+            count = len(self._contents) - max(0, keep)
+            if count <= 0:
+                return 0
+            self._sync_tokens()
+            if self._spill is None:
+                self._spill = _SegmentFile()
+            lines = [json.dumps(self._message(i), ensure_ascii=False).encode("utf-8") + b"\n"
+                     for i in range(self._hot_start, self._hot_start + count)]
+            base = self._spill.append(b"".join(lines))
+            starts, ends = array('q'), array('q')
+            for line in lines:
+                starts.append(base)
+                base += len(line)
+                ends.append(base)
+            self._add_segment(_DiskSegment(self._spill, starts, ends))
+            for i in range(self._hot_start, self._hot_start + count):
+                self._extras.pop(i, None)
+            del self._contents[:count]
+            self._hot_start += count
+            return count
+
+    def release_file(self, path: str) -> bool:
+        """path 即将被替换或重写: 把仍留在该文件中按需读取的消息复制到溢出文件
+
+        返回是否有消息被复制。只复制原始字节,不解析消息。
+        """
+        path = os.path.abspath(path)
+        released = False
+        with self._lock:
+            for k, segment in enumerate(self._segments):
+                source = segment.file
+                if source.path is None:
+                    continue
+                source_path = os.path.abspath(source.path)
+                # 归档目录被重写时其中的段文件都会被替换
+                if source_path != path and not source_path.startswith(path + os.sep):
+                    continue
+                if self._spill is None:
+                    self._spill = _SegmentFile()
+                position, end = segment.starts[0], segment.ends[-1]
+                shift = None
+                while position < end:
+                    chunk = source.read(position, min(end, position + _COPY_CHUNK_BYTES))
+                    offset = self._spill.append(chunk)
+                    if shift is None:
+                        shift = offset - segment.starts[0]
+                    position += len(chunk)
+                source.close()
+                self._segments[k] = _DiskSegment(self._spill, array('q', (s + shift for s in segment.starts)),
+                                                 array('q', (e + shift for e in segment.ends)))
+                released = True
+        return released
+
+    def _sync_tokens(self):
+        """为尚未计数的消息补充token估算,已计数的消息不再重复计算
+
+        磁盘上的消息在加载或溢出时已经计数,这里只会遇到内存中的消息。
+        """
+        with self._lock:
+            prefix = self._token_prefix
+            total = prefix[-1]
+            for i in range(len(prefix) - 1, len(self)):
+                total += estimate_tokens(self._contents[i - self._hot_start]) + MESSAGE_OVERHEAD_TOKENS
+                prefix.append(total)
+
+    def token_count(self, start: int = 0, stop: Optional[int] = None) -> int:
+        """[start, stop) 区间消息的估算token数(含每条消息的固定开销)"""
+        self._sync_tokens()
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, start)
+        return self._token_prefix[stop] - self._token_prefix[start] if stop > start else 0
+
+    def token_window_start(self, available: int, history_size: int = 0) -> int:
+        """在 available 个token内按整轮从最近往前装入历史,返回窗口起始下标
+
+        利用前缀和判断每一轮能否放入, 代价只与装入的轮数有关。
+        history_size > 0 时同时限制消息条数。
+        """
+        self._sync_tokens()
+        prefix = self._token_prefix
+        end = len(self)
+        lowest = max(0, end - history_size) if history_size > 0 else 0
+        start = end
+        while start - 2 >= lowest and prefix[end] - prefix[start - 2] <= available:
+            start -= 2
+        return start
@@ -0,0 +1,130 @@
+#history_summarizer
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SUMMARY_SYSTEM_PROMPT = (
+    "你负责维护一段对话的滚动摘要。把已有摘要和新增的对话合并成一份更新后的摘要,"
+    "保留事实、结论、做出的决定、用户的偏好和尚未解决的问题,省略寒暄和重复内容。"
+    "使用对话所用的语言,只输出摘要本身。"
+)
+SUMMARY_MESSAGE_PREFIX = "以下是此前对话的摘要:\n"
+_ROLE_LABELS = {"user": "用户", "assistant": "AI", "system": "系统"}
+# 摘要请求失败后的退避时间(秒),连续失败时翻倍
+RETRY_BASE_SECONDS = 30.0
+RETRY_MAX_SECONDS = 900.0
+
+
+def build_summary_request(previous: str, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """构造更新摘要的请求消息: 已有摘要 + 新增的对话"""
+    lines = [f"{_ROLE_LABELS.get(m.get('role'), m.get('role'))}: {m.get('content') or ''}" for m in messages]
+    prompt = (f"已有摘要:\n{previous or '(无)'}\n\n新增对话:\n" + "\n".join(lines)
+              + "\n\n请输出合并后的摘要。")
+    return [{"role": "system", "content": SUMMARY_SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+
+def summary_message(text: str) -> Dict[str, str]:
+    """发送给API的摘要消息"""
+    return {"role": "system", "content": SUMMARY_MESSAGE_PREFIX + text}
+
+
+class RollingSummary:
+    """对话历史较早部分的滚动摘要
+
+    摘要覆盖 history[0:covered]。最近 keep_messages 条之前尚未摘要的消息
+    估算token数超过阈值时,在后台线程中把它们与已有摘要合并成新摘要,
+    每次只处理新增的部分,不从头重新生成; 新增的部分很长时(如加载了很长的历史)
+    按 batch_tokens 分成多次请求依次合并,单次请求不会超出模型的上下文。
+    请求失败后按指数退避,退避期间不再重试。
+    摘要绑定创建它的 HistoryStore,历史被清空或重新加载(替换为新对象)后由调用方重建。
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.text = ""
+        self.covered = 0
+        self.updates = 0
+        self.last_error: Optional[str] = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def snapshot(self) -> Tuple[str, int]:
+        """返回一致的 (摘要文本, 覆盖的消息数)"""
+        with self._lock:
+            return self.text, self.covered
+
+    @property
+    def updating(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def maybe_update(self, keep_messages: int, trigger_tokens: int,
+                     summarize: Callable[[str, List[Dict[str, Any]]], str], batch_tokens: int = 0) -> bool:
+        """需要时在后台更新摘要,返回是否开始了更新
+
+        summarize(已有摘要, 新增消息) 返回合并后的摘要,在后台线程中调用;
+        batch_tokens > 0 时每次调用的新增消息不超过该估算token数(单轮超过时单独发送)。
+        """
+        with self._lock:
+            if self.updating or time.monotonic() < self._retry_at:
+                return False
+            start = self.covered
+            stop = len(self.history) - max(0, keep_messages)
+            # 按整轮摘要,不把一轮的提问和回答分开
+            stop -= (stop - start) % 2
+            if stop <= start or self.history.token_count(start, stop) < trigger_tokens:
+                return False
+            self._thread = threading.Thread(
+                target=self._update, args=(self.text, start, stop, batch_tokens, summarize),
+                name="history-summary", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _batch_stop(self, start: int, stop: int, batch_tokens: int) -> int:
+        """从 start 开始按整轮装入不超过 batch_tokens 的消息,至少一轮"""
+        if batch_tokens <= 0:
+            return stop
+        end = min(start + 2, stop)
+        while end + 2 <= stop and self.history.token_count(start, end + 2) <= batch_tokens:
+            end += 2
+        return end
+
+    def _update(self, previous: str, start: int, stop: int, batch_tokens: int, summarize: Callable):
+        while start < stop:
+            end = self._batch_stop(start, stop, batch_tokens)
+            try:
+                text = summarize(previous, self.history[start:end])
+                if not text:
+                    raise RuntimeError("摘要请求没有返回内容")
+            except Exception as e:
+                with self._lock:
+                    self.last_error = str(e)
+                    self._failures += 1
+                    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (self._failures - 1))
+                    self._retry_at = time.monotonic() + delay
+                return
+            # 每批完成后立即生效,之后失败时已合并的部分不必重做
+            with self._lock:
+                self.text = previous = text.strip()
+                self.covered = start = end
+                self.updates += 1
+                self.last_error = None
+                self._failures = 0
+
+    def join(self, timeout: Optional[float] = None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "covered_messages": self.covered,
+                "summary_characters": len(self.text),
+                "updates": self.updates,
+                "updating": self.updating,
+                "last_error": self.last_error,
+                "retry_in_seconds": max(0.0, round(self._retry_at - time.monotonic(), 1))
+            }
@@ -0,0 +1,149 @@
+#history_writer
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# 进程退出时刷新所有仍有待写任务的写入器
+_live_writers = weakref.WeakSet()
+
+
+class HistoryWriter:
+    """后台合并写入对话历史的线程
+
+    每个目标文件只保留最新的一个待写任务: 短时间内连续提交的多轮对话
+    合并为一次写入。任务在最后一次提交后等待 coalesce_delay 秒再执行,
+    但距第一次提交不超过 max_delay 秒。写入失败记录在 status() 中,
+    由调用方决定如何提示。
+    """
+
+    def __init__(self, coalesce_delay: float = 0.2, max_delay: float = 2.0):
+        self.coalesce_delay = max(0.0, float(coalesce_delay))
+        self.max_delay = max(self.coalesce_delay, float(max_delay))
+        self._cond = threading.Condition()
+        self._pending: Dict[Hashable, Callable[[], Any]] = {}
+        self._first_submit: Optional[float] = None
+        self._last_submit = 0.0
+        self._running = 0          # 正在执行的任务数
+        self._flushing = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._unreported_error: Optional[str] = None
+        self._stats = {
+            "submitted": 0,        # 提交的保存请求数
+            "writes": 0,           # 实际执行的写入次数
+            "failures": 0,         # 失败的写入次数
+            "last_write_time": None,
+            "last_write_seconds": None,
+            "last_error": None,
+            "last_error_time": None
+        }
+        _live_writers.add(self)
+
+    def submit(self, key: Hashable, task: Callable[[], Any]):
+        """提交写入任务,替换同一 key 尚未执行的任务"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("对话历史写入器已关闭")
+            now = time.monotonic()
+            if not self._pending:
+                self._first_submit = now
+            self._pending[key] = task
+            self._last_submit = now
+            self._stats["submitted"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _due(self) -> float:
+        """待写任务应执行的时刻"""
+        return min(self._last_submit + self.coalesce_delay, self._first_submit + self.max_delay)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # 刷新或关闭时立即执行,否则等到合并窗口结束
+                while not self._closed and self._pending and not self._flushing:
+                    delay = self._due() - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                tasks = list(self._pending.values())
+                self._pending.clear()
+                self._first_submit = None
+                self._running = len(tasks)
+            try:
+                for task in tasks:
+                    self._execute(task)
+            finally:
+                with self._cond:
+                    self._running = 0
+                    self._cond.notify_all()
+
+    def _execute(self, task: Callable[[], Any]):
+        start = time.perf_counter()
+        try:
+            task()
+        except Exception as e:
+            with self._cond:
+                self._stats["failures"] += 1
+                self._stats["last_error"] = str(e)
+                self._stats["last_error_time"] = datetime.now().isoformat(timespec="seconds")
+                self._unreported_error = str(e)
+            return
+        with self._cond:
+            self._stats["writes"] += 1
+            self._stats["last_write_time"] = datetime.now().isoformat(timespec="seconds")
+            self._stats["last_write_seconds"] = time.perf_counter() - start
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """立即执行所有待写任务并等待完成,超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._pending or self._running:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushing = False
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """写完待写任务后结束后台线程"""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        _live_writers.discard(self)
+        return flushed
+
+    def pop_error(self) -> Optional[str]:
+        """返回上次提示之后新发生的写入错误(只返回一次)"""
+        with self._cond:
+            error, self._unreported_error = self._unreported_error, None
+            return error
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            status = dict(self._stats)
+            status["pending"] = len(self._pending) + self._running
+        # 被后续提交替换、没有单独执行的保存请求数
+        status["coalesced"] = status["submitted"] - status["writes"] - status["failures"] - status["pending"]
+        return status
+
+
+@atexit.register
+def _flush_all_writers():
+    for writer in list(_live_writers):
+        writer.flush(timeout=10)
@@ -20,13 +20,19 @@ class ai_config ():
             "temperature": 0.7,
             "max_tokens": 2000,
             "timeout": 30,
+            "connect_timeout": 10,
+            "read_timeout": 30,
+            "max_connections": 10,
+            "max_keepalive_connections": 5,
+            "keepalive_expiry": 60,
+            "http2": False,
             "stream": True,
             "top_p": 1.0,
             "frequency_penalty": 0.0,
             "presence_penalty": 0.0,
             "history_size": 10,
             "system_prompt": "You are a helpful AI assistant.",
-            "log_file": "conversation_history.json",
+            "log_file": "conversation_history.jsonl",
             "auto_save": True,
         }
 
@@ -0,0 +1,75 @@
+#rate_limiter
+import threading
+import time
+from typing import Optional
+
+
+class RequestDeadlineExceeded(Exception):
+    """请求(含排队和重试)超过了总时限"""
+
+
+class TokenBucket:
+    """令牌桶: 按每分钟速率补充,容量为一分钟的配额"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取走 amount 个令牌需要等待的秒数(不消耗令牌)"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self._tokens >= amount:
+            return 0.0
+        return (amount - self._tokens) / self.rate
+
+    def consume(self, amount: float):
+        # 允许透支,透支部分由后续请求的等待时间偿还
+        self._tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """客户端限流器,同时限制每分钟请求数(RPM)和每分钟token数(TPM)
+
+    reserve() 只计算并预占配额,返回需要等待的秒数,
+    由调用方自行 sleep (同步) 或 await asyncio.sleep (异步)。
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._request_bucket is not None or self._token_bucket is not None
+
+    def reserve(self, tokens: int, max_wait: Optional[float] = None) -> float:
+        """预占一次请求和 tokens 个token的配额,返回需要等待的秒数
+
+        等待时间超过 max_wait 时不预占配额并抛出 RequestDeadlineExceeded。
+        """
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._request_bucket is not None:
+                wait = max(wait, self._request_bucket.wait_time(1, now))
+            if self._token_bucket is not None:
+                wait = max(wait, self._token_bucket.wait_time(tokens, now))
+            if max_wait is not None and wait > max_wait:
+                raise RequestDeadlineExceeded(f"限流排队需要等待{wait:.1f}秒,超过剩余时限{max_wait:.1f}秒")
+            if self._request_bucket is not None:
+                self._request_bucket.consume(1)
+            if self._token_bucket is not None:
+                self._token_bucket.consume(tokens)
+            return wait
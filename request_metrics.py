@@ -0,0 +1,270 @@
+#request_metrics
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Tuple
+from conversation_journal import mkstemp_beside
+from token_estimator import estimate_tokens
+
+# 当前线程/协程正在发送的请求,供httpx的trace回调记录连接耗时
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+# 指标名 -> (Prometheus指标名, 说明)
+METRICS = {
+    "connect_time": ("deepmini_connect_seconds", "TCP+TLS建连耗时,复用连接时为0"),
+    "ttft": ("deepmini_time_to_first_token_seconds", "首token时间"),
+    "inter_chunk_gap": ("deepmini_inter_chunk_gap_seconds", "流式chunk之间的间隔"),
+    "duration": ("deepmini_request_duration_seconds", "请求总耗时"),
+    "prompt_tokens": ("deepmini_prompt_tokens", "提示词token数"),
+    "prompt_cache_hit_tokens": ("deepmini_prompt_cache_hit_tokens", "命中服务端前缀缓存的提示词token数"),
+    "prompt_cache_miss_tokens": ("deepmini_prompt_cache_miss_tokens", "未命中前缀缓存的提示词token数"),
+    "completion_tokens": ("deepmini_completion_tokens", "回复token数"),
+    "tokens_per_sec": ("deepmini_tokens_per_second", "生成速度(token/秒)"),
+}
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def prompt_cache_usage(usage) -> Tuple[Any, Any]:
+    """从用量中取出 (前缀缓存命中token数, 未命中token数),服务端未返回时为 (None, None)
+
+    DeepSeek 返回 prompt_cache_hit_tokens/prompt_cache_miss_tokens,
+    OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens。
+    """
+    hit = getattr(usage, "prompt_cache_hit_tokens", None)
+    miss = getattr(usage, "prompt_cache_miss_tokens", None)
+    if hit is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        hit = getattr(details, "cached_tokens", None)
+    if hit is None:
+        return None, None
+    if miss is None:
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        miss = max(0, prompt_tokens - hit) if prompt_tokens is not None else 0
+    return hit, miss
+
+
+def trace_http_event(name: str, info: Dict[str, Any]):
+    """httpcore的trace回调: 把建连事件记到当前请求上"""
+    ctx = current_request.get()
+    if ctx is not None:
+        ctx.on_http_event(name)
+
+
+async def atrace_http_event(name: str, info: Dict[str, Any]):
+    # 异步连接池要求trace回调是协程
+    trace_http_event(name, info)
+
+
+def install_trace(request):
+    request.extensions["trace"] = trace_http_event
+
+
+async def ainstall_trace(request):
+    request.extensions["trace"] = atrace_http_event
+
+
+class RequestContext:
+    """单次请求的路由与计时信息
+
+    记录建连耗时、首token时间、chunk间隔、总耗时和token用量,
+    同时更新端点池的延迟/健康统计,完成后写入指标存储。
+    """
+    __slots__ = ("pool", "endpoint", "model", "metrics", "start", "ttft", "connect_time",
+                 "_connect_start", "_last_chunk", "gaps", "usage", "finished")
+
+    def __init__(self, pool, endpoint, model: str = "", metrics: "MetricsStore" = None):
+        self.pool = pool
+        self.endpoint = endpoint
+        self.model = model
+        self.metrics = metrics
+        self.start = time.perf_counter()
+        self.ttft = None
+        self.connect_time = 0.0
+        self._connect_start = None
+        self._last_chunk = None
+        self.gaps = []
+        self.usage = None
+        self.finished = False
+
+    def on_http_event(self, name: str):
+        if name == "connection.connect_tcp.started":
+            self._connect_start = time.perf_counter()
+        elif name in ("connection.connect_tcp.complete", "connection.start_tls.complete") \
+                and self._connect_start is not None:
+            self.connect_time = time.perf_counter() - self._connect_start
+
+    def mark_first_token(self):
+        """收到第一个token(非流式为完整响应)时记录首token时间"""
+        if self.ttft is None:
+            now = time.perf_counter()
+            self.ttft = now - self.start
+            self._last_chunk = now
+            self.pool.record_success(self.endpoint, self.ttft)
+
+    def mark_chunk(self):
+        """每个流式chunk到达时调用,记录与上一个chunk的间隔"""
+        if self.ttft is None:
+            self.mark_first_token()
+            return
+        now = time.perf_counter()
+        self.gaps.append(now - self._last_chunk)
+        self._last_chunk = now
+
+    def set_usage(self, usage):
+        if usage is not None:
+            self.usage = usage
+
+    def mark_failure(self, error: str, count_endpoint: bool = True):
+        # 首token之前的失败计为一次失败请求; 之后的失败只计入错误率
+        if count_endpoint:
+            self.pool.record_failure(self.endpoint, error, new_request=self.ttft is None)
+        if self.metrics is not None and not self.finished:
+            self.finished = True
+            self.metrics.record_error(self.model, self.endpoint.base_url)
+
+    def finish(self, completion_text: str = "") -> Dict[str, float]:
+        """请求成功结束,计算本次的各项指标并写入指标存储"""
+        self.mark_first_token()
+        duration = time.perf_counter() - self.start
+        prompt_tokens = getattr(self.usage, "prompt_tokens", None)
+        completion_tokens = getattr(self.usage, "completion_tokens", None)
+        if completion_tokens is None:
+            # 服务端未返回用量时用本地估算
+            completion_tokens = estimate_tokens(completion_text)
+        # 流式按首token之后的生成时间计算速度,非流式只能按总耗时计算
+        generation_time = duration - self.ttft if self.gaps else duration
+        sample = {
+            "connect_time": self.connect_time,
+            "ttft": self.ttft,
+            "duration": duration,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": completion_tokens / generation_time if generation_time > 0 else 0.0,
+        }
+        if prompt_tokens is not None:
+            sample["prompt_tokens"] = prompt_tokens
+        cache_hit, cache_miss = prompt_cache_usage(self.usage)
+        if cache_hit is not None:
+            sample["prompt_cache_hit_tokens"] = cache_hit
+            sample["prompt_cache_miss_tokens"] = cache_miss
+        if self.metrics is not None and not self.finished:
+            self.finished = True
+            self.metrics.record(self.model, self.endpoint.base_url, sample, self.gaps)
+        return sample
+
+
+class _Series:
+    """有界样本序列: 只保留最近 max_samples 个样本计算分位数,累计值单独维护"""
+    __slots__ = ("samples", "count", "total")
+
+    def __init__(self, max_samples: int):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def extend(self, values: List[float]):
+        self.samples.extend(values)
+        self.count += len(values)
+        self.total += sum(values)
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        result = {"count": self.count, "sum": self.total,
+                  "mean": self.total / self.count if self.count else 0.0}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+        return result
+
+
+class MetricsStore:
+    """进程内的有界指标存储,按 (模型, 端点) 分组"""
+
+    def __init__(self, max_samples: int = 1024):
+        self.max_samples = max(16, int(max_samples))
+        self._series: Dict[Tuple[str, str], Dict[str, _Series]] = {}
+        self._requests: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _group(self, key: Tuple[str, str]) -> Dict[str, _Series]:
+        group = self._series.get(key)
+        if group is None:
+            group = self._series[key] = {name: _Series(self.max_samples) for name in METRICS}
+            self._requests[key] = {"success": 0, "error": 0}
+        return group
+
+    def record(self, model: str, endpoint: str, sample: Dict[str, float], gaps: List[float] = ()):
+        key = (model, endpoint)
+        with self._lock:
+            group = self._group(key)
+            for name, value in sample.items():
+                group[name].add(value)
+            if gaps:
+                group["inter_chunk_gap"].extend(gaps)
+            self._requests[key]["success"] += 1
+
+    def record_error(self, model: str, endpoint: str):
+        key = (model, endpoint)
+        with self._lock:
+            self._group(key)
+            self._requests[key]["error"] += 1
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """返回每个 (模型, 端点) 的请求数和各指标的 p50/p95/p99"""
+        with self._lock:
+            return [{
+                "model": model,
+                "endpoint": endpoint,
+                "requests": dict(self._requests[(model, endpoint)]),
+                "metrics": {name: series.summary() for name, series in group.items()}
+            } for (model, endpoint), group in self._series.items()]
+
+    def to_prometheus(self) -> str:
+        """导出为Prometheus文本格式(summary类型),可由node exporter的textfile收集器抓取"""
+        summary = self.summary()
+        lines = [
+            "# HELP deepmini_requests_total 按结果统计的请求数",
+            "# TYPE deepmini_requests_total counter",
+        ]
+        for group in summary:
+            labels = _labels(group["model"], group["endpoint"])
+            for status, count in group["requests"].items():
+                lines.append(f'deepmini_requests_total{{{labels},status="{status}"}} {count}')
+        for name, (metric_name, help_text) in METRICS.items():
+            lines.append(f"# HELP {metric_name} {help_text}")
+            lines.append(f"# TYPE {metric_name} summary")
+            for group in summary:
+                labels = _labels(group["model"], group["endpoint"])
+                stats = group["metrics"][name]
+                for q in QUANTILES:
+                    lines.append(f'{metric_name}{{{labels},quantile="{q}"}} {stats[f"p{int(q * 100)}"]:.6g}')
+                lines.append(f"{metric_name}_sum{{{labels}}} {stats['sum']:.6g}")
+                lines.append(f"{metric_name}_count{{{labels}}} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str) -> str:
+        """导出到文件: .prom 为Prometheus文本格式,其他为JSON; 原子写入(临时文件 + rename)"""
+        if path.endswith(".prom"):
+            data, fmt = self.to_prometheus(), "prometheus"
+        else:
+            data, fmt = json.dumps({"generated_at": time.time(), "groups": self.summary()},
+                                   ensure_ascii=False, indent=2), "json"
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = mkstemp_beside(path)
+        with os.fdopen(fd, 'w', encoding="utf-8") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return fmt
+
+
+def _labels(model: str, endpoint: str) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'model="{escape(model)}",endpoint="{escape(endpoint)}"'
@@ -0,0 +1,153 @@
+#response_cache
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class ResponseCache:
+    """确定性请求的两级响应缓存: 内存LRU + SQLite持久化
+
+    键为模型、消息和采样参数的稳定哈希。条目超过TTL后失效,
+    磁盘总大小超过上限时按最近访问时间淘汰最旧的条目。
+    """
+
+    def __init__(self, path: str, memory_entries: int = 256, ttl: float = 7 * 86400,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.memory_entries = max(0, int(memory_entries))
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # batch_chat 会在线程池中并发访问,由 self._lock 串行化
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+            "created REAL, last_access REAL, size INTEGER)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_created ON responses(created)")
+        self._db.commit()
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(params: Dict[str, Any]) -> str:
+        """对请求参数做稳定哈希(键排序、紧凑分隔符)"""
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return response
+                del self._memory[key]
+            row = self._db.execute(
+                "SELECT response, created, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            response, created, size = row
+            if now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self._disk_bytes -= size
+                self._counters["evictions"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, response, created)
+            self._counters["disk_hits"] += 1
+            return response
+
+    def put(self, key: str, response: str, model: str = ""):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, now, now, size)
+            )
+            self._disk_bytes += size - (old[0] if old else 0)
+            self._evict_locked(now)
+            self._db.commit()
+            self._remember(key, response, now)
+            self._counters["stores"] += 1
+
+    def _remember(self, key: str, response: str, created: float):
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_locked(self, now: float):
+        """删除过期条目,并在超出大小上限时淘汰最久未访问的条目"""
+        expired_count, expired_bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created < ?", (now - self.ttl,)
+        ).fetchone()
+        if expired_count:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            self._disk_bytes -= expired_bytes
+            self._counters["evictions"] += expired_count
+        while self._disk_bytes > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                self._disk_bytes -= size
+                self._counters["evictions"] += 1
+                if self._disk_bytes <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stats = dict(self._counters)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats.update({
+            "hits": hits,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": entries,
+            "disk_bytes": self._disk_bytes,
+            "path": self.path
+        })
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+            self._memory.clear()
+            self._disk_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
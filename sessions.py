@@ -0,0 +1,114 @@
+#sessions
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_SESSION = "default"
+
+
+class _RoutedStdout:
+    """按线程转发的标准输出
+
+    会话工作线程中的 print (包括客户端服务内部的提示信息)写入该会话的缓冲区,
+    其他线程照常写到原来的标准输出。
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._routes: Dict[int, "Session"] = {}
+
+    def route(self, session: "Session"):
+        self._routes[threading.get_ident()] = session
+
+    def unroute(self):
+        self._routes.pop(threading.get_ident(), None)
+
+    def write(self, text: str) -> int:
+        session = self._routes.get(threading.get_ident())
+        if session is None:
+            return self._stream.write(text)
+        session.write(text)
+        return len(text)
+
+    def flush(self):
+        if threading.get_ident() not in self._routes:
+            self._stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def _routed_stdout() -> _RoutedStdout:
+    if not isinstance(sys.stdout, _RoutedStdout):
+        sys.stdout = _RoutedStdout(sys.stdout)
+    return sys.stdout
+
+
+class Session:
+    """命名会话: 独立的客户端服务(配置、对话历史)和输出缓冲区
+
+    对话在会话自己的工作线程中执行,输出先写入缓冲区;
+    前台会话由命令行实时取出显示,后台会话的输出保留到切换回来时再显示。
+    """
+
+    def __init__(self, name: str, client=None, config_path: Optional[str] = None):
+        self.name = name
+        self.client = client
+        self.config_path = config_path
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def busy(self) -> bool:
+        """是否有对话正在执行"""
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending_chars(self) -> int:
+        """缓冲区中尚未显示的字符数"""
+        return self._buffered_chars
+
+    def write(self, text: str):
+        with self._cond:
+            self._buffer.append(text)
+            self._buffered_chars += len(text)
+            self._cond.notify_all()
+
+    def submit(self, func: Callable, *args):
+        """在会话的工作线程中执行 func(*args),期间的输出都写入缓冲区"""
+        if self.busy:
+            raise RuntimeError(f"会话 {self.name} 正在进行对话")
+        stdout = _routed_stdout()
+
+        def run():
+            stdout.route(self)
+            try:
+                func(*args)
+            except Exception as e:
+                self.write(f"会话 {self.name} 执行出错: {str(e)}\n")
+            finally:
+                stdout.unroute()
+                with self._cond:
+                    self._cond.notify_all()
+
+        self._thread = threading.Thread(target=run, name=f"session-{self.name}", daemon=True)
+        self._thread.start()
+
+    def read(self, timeout: Optional[float] = None) -> Tuple[str, bool]:
+        """取出缓冲的输出,缓冲区为空且对话仍在执行时最多等待 timeout 秒
+
+        返回 (输出文本, 对话是否仍在执行)。
+        """
+        with self._cond:
+            if not self._buffer and self.busy:
+                self._cond.wait(timeout)
+            text = "".join(self._buffer)
+            self._buffer.clear()
+            self._buffered_chars = 0
+        return text, self.busy
+
+    def join(self, timeout: Optional[float] = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
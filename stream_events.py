@@ -0,0 +1,126 @@
+#stream_events
+import socket
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict, List, Optional
+
+
+class StreamEvent(Mapping):
+    """流式响应事件
+
+    chunk事件只携带本次增量,full_response 在访问时才由共享缓冲区拼接;
+    complete事件直接携带完整文本; truncated事件表示响应被取消或超出限制,
+    携带已收到的部分文本和原因(reason)。实现了只读字典接口,
+    现有的 event["content"] / event.get(...) 写法无需修改。
+    """
+    __slots__ = ("success", "type", "content", "done", "reason", "_parts", "_count", "_full")
+
+    _KEYS = ("success", "type", "content", "full_response", "done", "reason")
+
+    def __init__(self, success: bool, type: str, content: str = "", done: bool = False,
+                 full_response: Optional[str] = None, parts: Optional[List[str]] = None,
+                 count: int = 0, reason: Optional[str] = None):
+        self.success = success
+        self.type = type
+        self.content = content
+        self.done = done
+        self.reason = reason
+        self._full = full_response
+        self._parts = parts
+        self._count = count
+
+    @classmethod
+    def chunk(cls, content: str, parts: List[str]) -> "StreamEvent":
+        """增量事件, parts 为累积缓冲区, 按当前长度截取"""
+        return cls(True, "chunk", content, parts=parts, count=len(parts))
+
+    @classmethod
+    def complete(cls, full_response: str) -> "StreamEvent":
+        return cls(True, "complete", full_response, done=True, full_response=full_response)
+
+    @classmethod
+    def truncated(cls, partial_response: str, reason: str) -> "StreamEvent":
+        """响应被中途停止, reason 为 cancelled / timeout / max_output_chars"""
+        return cls(True, "truncated", partial_response, done=True, full_response=partial_response, reason=reason)
+
+    @classmethod
+    def error(cls, message: str) -> "StreamEvent":
+        return cls(False, "error", message, done=True, full_response="")
+
+    @property
+    def full_response(self) -> str:
+        """截至本事件的完整文本,按需拼接"""
+        if self._full is None:
+            if self._parts is None:
+                return ""
+            self._full = "".join(self._parts[:self._count])
+            self._parts = None
+        return self._full
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self) -> int:
+        return len(self._KEYS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self._KEYS}
+
+    def __repr__(self) -> str:
+        return f"StreamEvent(success={self.success!r}, type={self.type!r}, content={self.content!r}, done={self.done!r})"
+
+
+class StreamHandle:
+    """进行中的流式响应,可以从其他线程取消
+
+    取消时先关闭底层socket的读写,让阻塞在读取上的线程立即返回,
+    由读取线程自己关闭响应、把连接从连接池中释放。
+    HTTP/2 的多个流复用同一个连接,关闭socket会中断其他会话和批量请求的流,
+    此时只标记取消,由读取线程在收到本流的下一帧后关闭响应(只关闭这一个流)。
+    """
+    __slots__ = ("response", "reason", "_lock")
+
+    def __init__(self, response):
+        self.response = response
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """请求停止该响应,已经取消过时返回 False"""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+        if self._multiplexed():
+            # 不能从其他线程关闭: httpcore 会丢弃该流已到达的帧,读取线程一直等到读取超时
+            return True
+        sock = self._socket()
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+            else:
+                self.response.close()
+        except Exception:
+            # 连接可能已经关闭
+            pass
+        return True
+
+    def _multiplexed(self) -> bool:
+        http_response = getattr(self.response, "response", None)
+        return getattr(http_response, "http_version", "") == "HTTP/2"
+
+    def _socket(self) -> Optional[socket.socket]:
+        http_response = getattr(self.response, "response", None)
+        extensions = getattr(http_response, "extensions", None) or {}
+        network_stream = extensions.get("network_stream")
+        if network_stream is None:
+            return None
+        try:
+            return network_stream.get_extra_info("socket")
+        except Exception:
+            return None
@@ -0,0 +1,64 @@
+#stream_renderer
+import sys
+import time
+from typing import Optional, TextIO
+
+DEFAULT_RENDER_INTERVAL = 0.016
+
+
+class StreamRenderer:
+    """流式输出的终端渲染器
+
+    逐个增量 print(..., flush=True) 时每个chunk都是一次系统调用和刷新,
+    高速输出时(尤其是Windows控制台和SSH)终端跟不上网络。
+    这里把增量先攒在内存中,距上次刷新超过 interval 秒或遇到换行时一次写出。
+    输出不是终端(重定向到文件/管道)或关闭缓冲时,每次写入直接透传。
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, interval: float = DEFAULT_RENDER_INTERVAL,
+                 enabled: bool = True):
+        self.stream = stream if stream is not None else sys.stdout
+        self.interval = max(0.0, float(interval))
+        isatty = getattr(self.stream, "isatty", None)
+        try:
+            tty = bool(isatty and isatty())
+        except ValueError:
+            # 流已关闭
+            tty = False
+        self.buffered = enabled and self.interval > 0 and tty
+        self._parts = []
+        self._last_flush = time.monotonic()
+        self.flushes = 0  # 实际写出到终端的次数
+
+    def write(self, text: str):
+        """写入一段增量; 空字符串只检查是否到了刷新时间"""
+        if not self.buffered:
+            if text:
+                self.stream.write(text)
+                self.stream.flush()
+                self.flushes += 1
+            return
+        if text:
+            self._parts.append(text)
+        if self._parts and ("\n" in text or time.monotonic() - self._last_flush >= self.interval):
+            self.flush()
+
+    def time_until_flush(self) -> Optional[float]:
+        """距离下一次必须刷新还有多少秒,没有待写内容时返回 None"""
+        if not self._parts:
+            return None
+        return max(0.0, self._last_flush + self.interval - time.monotonic())
+
+    def flush(self):
+        if self._parts:
+            self.stream.write("".join(self._parts))
+            self._parts.clear()
+            self.stream.flush()
+            self.flushes += 1
+        self._last_flush = time.monotonic()
+
+    def __enter__(self) -> "StreamRenderer":
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
@@ -0,0 +1,28 @@
+#token_estimator
+# 本地快速估算token数,不依赖分词器。
+# 参考DeepSeek的换算: 1个英文字符约0.3个token, 1个中文字符约0.6个token。
+
+ASCII_TOKENS_PER_CHAR = 0.3
+NON_ASCII_TOKENS_PER_CHAR = 0.6
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数
+
+    只用 len() 和一次UTF-8编码(均在C层完成)统计非ASCII字符数:
+    中文等字符编码为3字节,比字符数多出约2字节。
+    """
+    if not text:
+        return 0
+    chars = len(text)
+    extra_bytes = len(text.encode("utf-8", "surrogatepass")) - chars
+    non_ascii = min(chars, (extra_bytes + 1) // 2)
+    ascii_chars = chars - non_ascii
+    return int(ascii_chars * ASCII_TOKENS_PER_CHAR + non_ascii * NON_ASCII_TOKENS_PER_CHAR) + 1
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """估算一条聊天消息(含固定开销)的token数"""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS